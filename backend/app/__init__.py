@@ -56,6 +56,12 @@ socketio = SocketIO(app)
 # Start the job manager
 from app.job_manager import start_job_manager
 start_job_manager()
+from app.socket_service import start_console_compactor
+start_console_compactor()
+from app.fact_cache import setup_fact_cache
+setup_fact_cache()
+from app.portal_cache import PORTAL_LINKS
+PORTAL_LINKS.start()
 
 # Load the REST API
 from app import common_controller
@@ -67,3 +73,4 @@ from app import portal_controller
 from app import health_controller
 from app import configmap_controller
 from app import archive_controller
+from app import job_controller
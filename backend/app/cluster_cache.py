@@ -0,0 +1,250 @@
+"""
+Module that keeps an in memory copy of the kubernetes objects the UI polls.
+
+Every kind of object has an informer that lists the objects once and then watches
+for changes from the resourceVersion of the list, so polling the cache never reaches
+the kubernetes API server.  When the watch falls too far behind (410 Gone) the
+informer lists the objects again.
+"""
+import gevent
+
+from app import conn_mng, logger
+from collections import OrderedDict
+from flask import json
+from gevent.event import Event
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from shared.connection_mngs import KUBERNETES_CLIENT
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+WATCH_TIMEOUT_SECONDS = 300
+RETRY_SECONDS = 10
+SYNC_WAIT_SECONDS = 5
+DELETED_HISTORY_SIZE = 1000
+HTTP_GONE = 410
+
+
+class ResourceVersionExpired(Exception):
+    pass
+
+
+def _object_key(item: Dict) -> Tuple[str, str]:
+    return item['metadata'].get('namespace') or '', item['metadata']['name']
+
+
+class Informer(object):
+    """
+    Keeps the objects of a kind in a store indexed by (namespace, name).
+
+    Every change to the store is numbered with a local version so clients can ask for
+    the changes since the last version they have seen.  The versions start at the
+    time the informer was created so versions from a previous process are always older.
+    """
+
+    def __init__(self, kind: str, list_func_name: str, transform: Callable[[Dict], Dict]=None):
+        """
+        :param kind: The kind of the objects (IE: pods)
+        :param list_func_name: The name of the CoreV1Api function that lists the objects (IE: list_node)
+        :param transform: A function that changes the dictionary of an object before it is stored.
+        """
+        self.kind = kind
+        self._list_func_name = list_func_name
+        self._transform = transform
+        self._items = OrderedDict()  # type: Dict[Tuple[str, str], Dict]
+        self._versions = {}  # type: Dict[Tuple[str, str], int]
+        self._resource_versions = {}  # type: Dict[Tuple[str, str], str]
+        self._deleted = OrderedDict()  # type: Dict[Tuple[str, str], int]
+        self._listeners = []  # type: List[Callable[[str, Dict, int], None]]
+        self.version = int(time() * 1000)
+        self._oldest_delta_version = self.version
+        self._json = None  # type: str
+        self._synced = Event()
+        self._is_failing = False
+        self._greenlet = None
+
+    def start(self) -> None:
+        """
+        Starts the informer if it is not running yet.
+
+        :return:
+        """
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def add_listener(self, listener: Callable[[str, Dict, int], None]) -> None:
+        """
+        Adds a function that is called with the event type (ADDED, MODIFIED or DELETED),
+        the object and the new version every time the store changes.
+
+        :param listener:
+        :return:
+        """
+        self._listeners.append(listener)
+
+    def wait_synced(self, timeout: float=SYNC_WAIT_SECONDS) -> bool:
+        """
+        Starts the informer and waits until its first list is in the store.  It does not wait
+        while the informer is failing to reach kubernetes.
+
+        :param timeout: The number of seconds to wait.
+        :return: True if the store is filled and being watched.
+        """
+        self.start()
+        if self._is_failing:
+            return self._synced.is_set()
+        return self._synced.wait(timeout)
+
+    def get(self, namespace: str, name: str) -> Optional[Dict]:
+        return self._items.get((namespace or '', name))
+
+    def items(self) -> List[Dict]:
+        return list(self._items.values())
+
+    def to_json(self) -> str:
+        """
+        Returns the json list of every object.  It is only serialized again after the store changes.
+
+        :return:
+        """
+        if self._json is None:
+            self._json = json.dumps(self.items())
+        return self._json
+
+    def changes_since(self, since: int) -> Dict:
+        """
+        Gets the objects that changed and the keys of the objects that were deleted since a version.
+        If the changes since that version are no longer known every object is returned and full is set.
+
+        :param since: A version returned by a previous call.
+        :return: {'version': 1546300800000, 'full': False, 'items': [...], 'deleted': [{'namespace': '', 'name': ''}]}
+        """
+        if since < self._oldest_delta_version or since > self.version:
+            return {'version': self.version, 'full': True, 'items': self.items(), 'deleted': []}
+
+        return {'version': self.version,
+                'full': False,
+                'items': [self._items[key] for key, version in self._versions.items() if version > since],
+                'deleted': [{'namespace': key[0], 'name': key[1]}
+                            for key, version in self._deleted.items() if version > since]}
+
+    def _notify(self, event_type: str, item: Dict) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event_type, item, self.version)
+            except Exception as e:
+                logger.exception(e)
+
+    def _upsert(self, item: Dict) -> None:
+        key = _object_key(item)
+        resource_version = item['metadata'].get('resource_version')
+        if key in self._items and self._resource_versions.get(key) == resource_version:
+            return
+
+        event_type = 'MODIFIED' if key in self._items else 'ADDED'
+        if self._transform:
+            item = self._transform(item)
+        self.version += 1
+        self._items[key] = item
+        self._versions[key] = self.version
+        self._resource_versions[key] = resource_version
+        self._deleted.pop(key, None)
+        self._json = None
+        self._notify(event_type, item)
+
+    def _delete(self, key: Tuple[str, str]) -> None:
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+
+        self.version += 1
+        del self._versions[key]
+        del self._resource_versions[key]
+        self._deleted[key] = self.version
+        if len(self._deleted) > DELETED_HISTORY_SIZE:
+            _, self._oldest_delta_version = self._deleted.popitem(last=False)
+        self._json = None
+        self._notify('DELETED', item)
+
+    def _replace(self, items: List[Dict]) -> None:
+        """
+        Replaces the store with the result of a list.  Only the objects that changed are versioned.
+
+        :param items:
+        :return:
+        """
+        keys = set()
+        for item in items:
+            keys.add(_object_key(item))
+            self._upsert(item)
+
+        for key in [key for key in self._items if key not in keys]:
+            self._delete(key)
+
+    def _list_and_watch(self) -> None:
+        """
+        Lists the objects and watches them until the resourceVersion expires.
+
+        :return:
+        """
+        kube_apiv1 = KUBERNETES_CLIENT.get(conn_mng)
+        list_func = getattr(kube_apiv1, self._list_func_name)
+        api_response = list_func()
+        resource_version = api_response.metadata.resource_version
+        self._replace([item.to_dict() for item in api_response.items])
+        self._is_failing = False
+        self._synced.set()
+
+        while True:
+            for event in watch.Watch().stream(list_func, resource_version=resource_version,
+                                              timeout_seconds=WATCH_TIMEOUT_SECONDS):
+                if event['type'] == 'ERROR':
+                    if event['raw_object'].get('code') == HTTP_GONE:
+                        raise ResourceVersionExpired()
+                    raise Exception("Watching %s failed: %s" % (self.kind, event['raw_object'].get('message')))
+
+                item = event['object'].to_dict()
+                resource_version = item['metadata']['resource_version']
+                if event['type'] == 'DELETED':
+                    self._delete(_object_key(item))
+                else:
+                    self._upsert(item)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._list_and_watch()
+            except ResourceVersionExpired:
+                logger.info("The %s watch expired, listing them again." % self.kind)
+                continue
+            except ApiException as e:
+                if e.status == HTTP_GONE:
+                    logger.info("The %s watch expired, listing them again." % self.kind)
+                    continue
+                logger.warn("Watching %s failed: %s" % (self.kind, str(e)))
+            except Exception as e:
+                logger.warn("Watching %s failed: %s" % (self.kind, str(e)))
+
+            # The store is stale until the objects are listed again.
+            self._is_failing = True
+            self._synced.clear()
+            gevent.sleep(RETRY_SECONDS)
+
+
+def add_public_ip(item: Dict) -> Dict:
+    """
+    Copies the public ip flannel annotates a node with to the metadata of the node.
+
+    :param item: The dictionary of a node.
+    :return:
+    """
+    try:
+        item["metadata"]["public_ip"] = item["metadata"]["annotations"]["flannel.alpha.coreos.com/public-ip"]
+    except (KeyError, TypeError):
+        item["metadata"]["public_ip"] = ''
+    return item
+
+
+POD_INFORMER = Informer('pods', 'list_pod_for_all_namespaces')
+NODE_INFORMER = Informer('nodes', 'list_node', add_public_ip)
+CONFIG_MAP_INFORMER = Informer('configmaps', 'list_config_map_for_all_namespaces')
@@ -2,13 +2,36 @@
 Module that has commonly shared things between controller modules.
 You can put constants or shared functions in this module.
 """
-from flask import Response
+from flask import Response, request
 
 OK_RESPONSE = Response()
 OK_RESPONSE.status_code = 200
 
+BAD_REQUEST_RESPONSE = Response()
+BAD_REQUEST_RESPONSE.status_code = 400
+
 NOTFOUND_RESPONSE = Response()
 NOTFOUND_RESPONSE.status_code = 404
 
 ERROR_RESPONSE = Response()
-ERROR_RESPONSE.status_code = 500
\ No newline at end of file
+ERROR_RESPONSE.status_code = 500
+
+
+def get_int_arg(name: str, default: int=None, minimum: int=None) -> int:
+    """
+    Returns an integer query string argument.
+
+    :param name: The name of the query string argument.
+    :param default: The value returned if it was not passed in.
+    :param minimum: The smallest value that is allowed.
+    :return:
+    :raises ValueError: If the argument is not an integer or it is less than minimum.
+    """
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+
+    value = int(value)
+    if minimum is not None and value < minimum:
+        raise ValueError("%s must be at least %d." % (name, minimum))
+    return value
\ No newline at end of file
@@ -3,58 +3,127 @@ This is the main module for all the shared REST calls
 """
 import json
 
+from collections import OrderedDict
 from app import app, logger, conn_mng
 from app.common import ERROR_RESPONSE, OK_RESPONSE
-from app.job_manager import kill_job_in_queue, shell
-from app.node_facts import get_system_info
+from app.host_scan import HostBitmap, HostScanner, management_network, SCAN_BUDGET_SECONDS
+from app.job_manager import kill_job_in_queue
+from app.node_facts import get_system_info, get_systems_info, FactResult, Node
 from shared.constants import KICKSTART_ID
-from shared.utils import filter_ip, netmask_to_cidr, decode_password
-from flask import request, jsonify, Response
-from typing import List
+from shared.utils import netmask_to_cidr, decode_password
+from flask import request, jsonify, Response, stream_with_context
+from ipaddress import IPv4Address
+from typing import Dict, List
 
 
 MIN_MBPS = 1000
 
 
+def _get_root_password() -> str:
+    """
+    Gets the root password of the nodes from the saved kickstart form.
+
+    :return:
+    """
+    current_config = conn_mng.mongo_kickstart.find_one({"_id": KICKSTART_ID})
+    if current_config:
+        return decode_password(current_config["form"]["root_password"])
+    return ''
+
+
+def _node_to_facts(node: Node, management_ip: str) -> Dict:
+    """
+    Converts a Node to the facts the kit form needs.
+
+    :param node: The Node object of the server.
+    :param management_ip: The management ip of the server.
+    :return: A dictionary of the facts or an error_message.
+    """
+    potential_monitor_interfaces = []
+    for interface in node.interfaces:
+        if interface.ip_address != management_ip:
+            potential_monitor_interfaces.append(interface.name)
+        if interface.ip_address == management_ip:
+            if interface.speed < MIN_MBPS:
+                return {'error_message': "ERROR: Please check your "
+                        "network configuration. The link speed on {} is less than {} Mbps."
+                        .format(interface.name, MIN_MBPS)}
+
+    return {'cpus_available': node.cpu_cores,
+            'memory_available': node.memory_gb,
+            'disks': json.dumps([disk.to_dict() for disk in node.disks]),
+            'hostname': node.hostname,
+            'potential_monitor_interfaces': potential_monitor_interfaces,
+            'interfaces': json.dumps([interface.to_dict() for interface in node.interfaces])}
+
+
+def _result_to_facts(result: FactResult) -> Dict:
+    """
+    Converts the FactResult of a server to the facts the kit form needs.
+
+    :param result: The FactResult of the server.
+    :return: A dictionary of the facts or an error_message.
+    """
+    if not result.ok:
+        return {'error_message': result.error_message}
+    return _node_to_facts(result.node, result.host)
+
+
 @app.route('/api/gather_device_facts', methods=['POST'])
 def gather_device_facts() -> Response:
     """
     Gathers device facts or sends back a HTTP error to the
-    user if something fails.
+    user if something fails.  The facts come from the fact cache
+    unless refresh is set in the payload.
 
     :return: A jsonified response object.
     """
     try:
         payload = request.get_json()
         management_ip = payload.get('management_ip')
-        current_config = conn_mng.mongo_kickstart.find_one({"_id": KICKSTART_ID})
-        if current_config:
-            password = decode_password(current_config["form"]["root_password"])
-        else:
-            password = ''
-
-        node = get_system_info(management_ip, password)
-        potential_monitor_interfaces = []
-        for interface in node.interfaces:
-            if interface.ip_address != management_ip:
-                potential_monitor_interfaces.append(interface.name)
-            if interface.ip_address == management_ip:
-                if interface.speed < MIN_MBPS:
-                    return jsonify(error_message="ERROR: Please check your "
-                                   "network configuration. The link speed on {} is less than {} Mbps."
-                                   .format(interface.name, MIN_MBPS))
-
-        return jsonify(cpus_available=node.cpu_cores,
-                       memory_available=node.memory_gb,
-                       disks= json.dumps([disk. __dict__ for disk in node.disks]),
-                       hostname=node.hostname,
-                       potential_monitor_interfaces=potential_monitor_interfaces,
-                       interfaces=json.dumps([interface. __dict__ for interface in node.interfaces]))
+        result = get_system_info(management_ip, _get_root_password(), payload.get('refresh', False))
+        return jsonify(**_result_to_facts(result))
     except Exception as e:
         logger.exception(e)
         return jsonify(error_message=str(e))
 
 
+@app.route('/api/gather_device_facts_batch', methods=['POST'])
+def gather_device_facts_batch() -> Response:
+    """
+    Gathers the device facts of many nodes with a single ansible run.  The response
+    is streamed as newline delimited json, one line per node as soon as its facts
+    are in, so the kit form can fill in the fast nodes while the slow ones finish.
+
+    Each line has the management_ip and status of the node and either its facts or an error_message.
+    The facts come from the fact cache unless refresh is set in the payload.
+
+    :return: A streamed application/x-ndjson response.
+    """
+    payload = request.get_json()
+    management_ips = list(OrderedDict.fromkeys(payload.get('management_ips', [])))
+    password = _get_root_password()
+    refresh = payload.get('refresh', False)
+
+    def generate():
+        # The request context is kept while streaming so the ansible process is killed if the client goes away.
+        results = get_systems_info(management_ips, password, refresh)
+        try:
+            for result in results:
+                facts = _result_to_facts(result)
+                facts['management_ip'] = result.host
+                facts['status'] = result.status
+                yield json.dumps(facts) + '\n'
+        except Exception as e:
+            logger.exception(e)
+            yield json.dumps({'error_message': str(e)}) + '\n'
+        finally:
+            # Closing the response (IE: the client aborted the batch) closes the generators down to ansible.
+            results.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/api/kill_job', methods=['POST'])
 def kill_job() -> Response:
     """
@@ -71,65 +140,35 @@ def kill_job() -> Response:
     return ERROR_RESPONSE
 
 
-def _is_valid_ip_block(available_ip_addresses: List[str], index: int) -> bool:
+def _get_ip_blocks(live_hosts: HostBitmap) -> List[str]:
     """
-    Ensures that the /28 IP blocks ip are all available.
+    Gets the /28 or 16 host IP blocks of a network that are all unused.
     If a given /28 blocks IP address has been taken by some other node on the network,
-    the block gets thrown out.
-
-    :param available_ip_addresses: A list of unused IP on the subnet.
-    :param index: 
-    """
-    cached_octet = None
-    for i, ip in enumerate(available_ip_addresses[index:]):
-        pos = ip.rfind('.') + 1
-        last_octet = int(ip[pos:])
-        if cached_octet is None:
-            cached_octet = last_octet
-        else:
-            if (cached_octet + 1) == last_octet:
-                cached_octet = last_octet
-            else:
-                return False
-
-        if i == 15:
-            break        
-    return True
-
-
-def _get_ip_blocks(cidr: int) -> List[int]:
-    """
-    Gets IP blocks based on CIDR notation. 
-    It only accept /24 through /27 subnet ranges.
+    the block gets thrown out, as is a block with an address the scan did not get to.
+    The first block of the network starts at its first host and the broadcast address
+    counts as unused.
 
-    It returns an array of the start of each IP /28 block.
+    :param live_hosts: The live hosts of the network.
 
-    :param cidr: The network cidr
-
-    :return: [1, 16, 32 ...]
+    :return: The first IP of each available block (IE: ['192.168.1.1', '192.168.1.16', ...])
     """
-    cidr_to_host_mapping = {24: 254, 25: 126, 26: 62, 27: 30}
-    count = 0
-    number_of_hosts = cidr_to_host_mapping[cidr]
-    valid_ip_blocks = []
-    for i in range(number_of_hosts):
-        count += 1
-        if count == 1:
-            if i == 0:
-                valid_ip_blocks.append(i + 1)
-            else:
-                valid_ip_blocks.append(i)
-
-        if count == 16:
-            count = 0
-    return valid_ip_blocks
+    network = live_hosts.network
+    first = int(network.network_address)
+    available_ip_blocks = []
+    for offset in range(0, network.num_addresses - 15, 16):
+        start = first + max(offset, 1)
+        block = [IPv4Address(address) for address in range(start, start + 16)]
+        if block[-1] > network.broadcast_address:
+            continue
+        if all(ip == network.broadcast_address or live_hosts.is_unused(ip) for ip in block):
+            available_ip_blocks.append(str(block[0]))
+    return available_ip_blocks
 
 
 @app.route('/api/get_available_ip_blocks', methods=['GET'])
 def get_available_ip_blocks() -> Response:
     """
-    Grabs available /28 or 16 host blocks from a /24, /25, /26, or /27 
-    IP subnet range.
+    Grabs available /28 or 16 host blocks from the management network.
 
     :return:    
     """    
@@ -139,21 +178,11 @@ def get_available_ip_blocks() -> Response:
     
     mng_ip = mongo_document["form"]["controller_interface"][0]
     cidr = netmask_to_cidr(mongo_document["form"]["netmask"])
-    if cidr <= 24:
-        command = "nmap -v -sn -n %s/24 -oG - | awk '/Status: Down/{print $2}'" % mng_ip
-        cidr = 24
-    else:
-        command = "nmap -v -sn -n %s/%d -oG - | awk '/Status: Down/{print $2}'" % (mng_ip, cidr) 
-   
-    stdout_str, stderr_str = shell(command, use_shell=True)
-    available_ip_addresses = stdout_str.decode("utf-8").split('\n')
-    available_ip_addresses = [x for x in available_ip_addresses if not filter_ip(x)]
-    ip_address_blocks = _get_ip_blocks(cidr)    
-    available_ip_blocks = []
-    for index, ip in enumerate(available_ip_addresses):
-        pos = ip.rfind('.') + 1
-        last_octet = int(ip[pos:])
-        if last_octet in ip_address_blocks:
-            if _is_valid_ip_block(available_ip_addresses, index):
-                available_ip_blocks.append(ip)
-    return jsonify(available_ip_blocks)
+    try:
+        network = management_network(mng_ip, cidr)
+    except ValueError as e:
+        logger.exception(e)
+        return jsonify([])
+
+    live_hosts = HostScanner().scan(network, SCAN_BUDGET_SECONDS)
+    return jsonify(_get_ip_blocks(live_hosts))
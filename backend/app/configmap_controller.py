@@ -1,15 +1,152 @@
 """
 Main module for handling all of the config map REST calls.
 """
+import hashlib
 import json
 import requests
 import multiprocessing
 from app import app, logger, conn_mng
-from app.common import ERROR_RESPONSE, OK_RESPONSE
+from app.cluster_cache import CONFIG_MAP_INFORMER
+from app.common import ERROR_RESPONSE, NOTFOUND_RESPONSE, OK_RESPONSE
 from app.job_manager import shell
 from flask import jsonify, Response, request
+from gevent.pool import Pool
 from kubernetes import client, config
+from kubernetes.client.rest import ApiException
 from shared.connection_mngs import KubernetesWrapper, KitFormNotFound
+from time import time
+from typing import Callable, Dict, List, Tuple
+
+
+CONFIG_MAP_APPLY_CONCURRENCY = 8
+CONFIG_MAP_SUMMARY_FIELDS = ('namespace', 'name', 'creation_timestamp', 'resource_version')
+
+_summaries = {}  # type: Dict[Tuple[str, str], Tuple[str, Dict]]
+
+
+def _config_map_summary(config_map: Dict, memoize: bool=True) -> Dict:
+    """
+    Reduces a config map to its metadata and the names and sizes of its data.  Summaries of
+    the config maps of the informer are kept until the resourceVersion of the config map
+    changes or it is deleted.
+
+    :param config_map: The dictionary of a config map.
+    :param memoize: If set to false the summary is not kept.
+    :return: {'metadata': {...}, 'keys': [{'name': 'suricata.yaml', 'size': 71360}, ...], 'size': 71360}
+    """
+    metadata = config_map['metadata']
+    key = (metadata.get('namespace') or '', metadata['name'])
+    cached = _summaries.get(key)
+    if cached is not None and cached[0] == metadata.get('resource_version'):
+        return cached[1]
+
+    keys = []
+    for name, value in sorted((config_map.get('data') or {}).items()):
+        keys.append({'name': name, 'size': len((value or '').encode('utf-8'))})
+    for name, value in sorted((config_map.get('binary_data') or {}).items()):
+        keys.append({'name': name, 'size': len(value or ''), 'binary': True})
+
+    summary = {'metadata': {field: metadata.get(field) for field in CONFIG_MAP_SUMMARY_FIELDS},
+               'keys': keys,
+               'size': sum(item['size'] for item in keys)}
+    if memoize:
+        _summaries[key] = (metadata.get('resource_version'), summary)
+    return summary
+
+
+def _forget_summary(event_type: str, item: Dict, version: int) -> None:
+    """
+    Informer listener that drops the summaries of deleted config maps.
+
+    :return:
+    """
+    if event_type == 'DELETED':
+        _summaries.pop((item['metadata'].get('namespace') or '', item['metadata']['name']), None)
+
+
+CONFIG_MAP_INFORMER.add_listener(_forget_summary)
+
+
+def _is_filtered_out(config_map: Dict, namespace: str, search: str) -> bool:
+    metadata = config_map['metadata']
+    if namespace and metadata.get('namespace') != namespace:
+        return True
+    return bool(search) and search.lower() not in metadata['name'].lower()
+
+
+def _conditional_response(etag: str, build: Callable[[], Dict]) -> Response:
+    """
+    Returns 304 Not Modified if the client already has the etag, otherwise the json the
+    build function returns.  The response must be revalidated every time it is used.
+
+    :param etag: The entity tag of the response.
+    :param build: Builds the json object, it is only called when the client needs it.
+    :return:
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/get_config_map_summaries', methods=['GET'])
+def get_config_map_summaries() -> Response:
+    """
+    Gets the summaries of the config maps without their data.  The list can be narrowed
+    with the namespace query parameter and a name search query parameter.
+
+    :return: Response object with a json list of summaries or 304 if the list did not change.
+    """
+    namespace = request.args.get('namespace')
+    search = request.args.get('search')
+    # The filters are part of the etag so a shared cache never serves one filter's list for another.
+    filters = hashlib.sha1(request.query_string).hexdigest()[:16]
+    # Only the informer tells when a config map is deleted so only its summaries are kept.
+    memoize = CONFIG_MAP_INFORMER.wait_synced()
+    if memoize:
+        etag = 'configmaps-%d-%s' % (CONFIG_MAP_INFORMER.version, filters)
+        config_maps = CONFIG_MAP_INFORMER.items()
+    else:
+        try:
+            with KubernetesWrapper(conn_mng) as kube_apiv1:
+                api_response = kube_apiv1.list_config_map_for_all_namespaces()
+        except KitFormNotFound as e:
+            logger.exception(e)
+            return jsonify([])
+        etag = 'configmaps-rv-%s-%s' % (api_response.metadata.resource_version, filters)
+        config_maps = api_response.to_dict()['items']
+
+    return _conditional_response(etag, lambda: [_config_map_summary(config_map, memoize)
+                                                for config_map in config_maps
+                                                if not _is_filtered_out(config_map, namespace, search)])
+
+
+@app.route('/api/get_config_map/<namespace>/<name>', methods=['GET'])
+def get_config_map(namespace: str, name: str) -> Response:
+    """
+    Gets one config map with its data.
+
+    :param namespace: The namespace of the config map.
+    :param name: The name of the config map.
+    :return: Response object with the config map or 304 if its resourceVersion did not change.
+    """
+    config_map = None
+    if CONFIG_MAP_INFORMER.wait_synced():
+        config_map = CONFIG_MAP_INFORMER.get(namespace, name)
+
+    if config_map is None:
+        try:
+            with KubernetesWrapper(conn_mng) as kube_apiv1:
+                config_map = kube_apiv1.read_namespaced_config_map(name, namespace).to_dict()
+        except ApiException as e:
+            if e.status == 404:
+                return NOTFOUND_RESPONSE
+            raise
+
+    return _conditional_response('configmap-%s' % config_map['metadata']['resource_version'], lambda: config_map)
 
 
 @app.route('/api/get_config_maps', methods=['GET'])
@@ -57,6 +194,105 @@ def save_config_map() -> Response:
     return ERROR_RESPONSE
 
 
+def _config_map_data_patch(current: Dict, data: Dict) -> Dict:
+    """
+    Builds a merge patch that changes the data of a config map to the new data.
+    Keys that are not in the new data are set to None which removes them.
+
+    :param current: The data the config map has now.
+    :param data: The data the config map should have.
+    :return: The changed keys, an empty dictionary if nothing changed.
+    """
+    patch = {key: value for key, value in data.items() if current.get(key) != value}
+    for key in current:
+        if key not in data:
+            patch[key] = None
+    return patch
+
+
+def _apply_config_map(kube_apiv1: client.CoreV1Api, payload: Dict) -> Dict:
+    """
+    Applies the data of one config map edit.  The config map is only patched if its
+    data changed.  If the edit has a resource_version the patch fails with a conflict
+    when the config map was changed by someone else since it was read.
+
+    The cached config map is only trusted to find the changed keys.  It is read from
+    kubernetes instead when its resourceVersion is not the one of the edit, and before
+    an edit is skipped as unchanged, because the cache can be behind the server.
+
+    :param kube_apiv1: The kubernetes API handler.
+    :param payload: {'metadata': {'namespace': 'default', 'name': 'suricata', 'resource_version': '1234'}, 'data': {...}}
+    :return: The result of the edit.
+    """
+    metadata = payload.get('metadata') or {}
+    namespace, name = metadata.get('namespace'), metadata.get('name')
+    result = {'namespace': namespace, 'name': name}
+    if not namespace or not name:
+        result['status'] = 'failed'
+        result['error_message'] = "The namespace and name of the config map are required."
+        return result
+
+    try:
+        data = payload.get('data') or {}
+        current = None
+        if CONFIG_MAP_INFORMER.wait_synced():
+            current = CONFIG_MAP_INFORMER.get(namespace, name)
+        if current is not None and metadata.get('resource_version') not in (None, '',
+                                                                            current['metadata']['resource_version']):
+            current = None
+
+        patch = None
+        if current is not None:
+            patch = _config_map_data_patch(current.get('data') or {}, data)
+        if not patch:
+            current = kube_apiv1.read_namespaced_config_map(name, namespace).to_dict()
+            patch = _config_map_data_patch(current.get('data') or {}, data)
+
+        result['changed_keys'] = sorted(key for key, value in patch.items() if value is not None)
+        result['removed_keys'] = sorted(key for key, value in patch.items() if value is None)
+        if not patch:
+            result['status'] = 'unchanged'
+            return result
+
+        body = {'data': patch}
+        if metadata.get('resource_version'):
+            body['metadata'] = {'resourceVersion': metadata['resource_version']}
+        api_response = kube_apiv1.patch_namespaced_config_map(name, namespace, body)
+        result['status'] = 'patched'
+        result['resource_version'] = api_response.metadata.resource_version
+    except ApiException as e:
+        result['status'] = {404: 'not_found', 409: 'conflict'}.get(e.status, 'failed')
+        result['error_message'] = e.reason
+    except Exception as e:
+        logger.exception(e)
+        result['status'] = 'failed'
+        result['error_message'] = str(e)
+    return result
+
+
+@app.route('/api/apply_config_maps', methods=['POST'])
+def apply_config_maps() -> Response:
+    """
+    Applies the edits of several config maps at once.  Every config map is diffed against
+    its current version and only its changed keys are patched, config maps that did not
+    change are skipped.
+
+    :return: {'results': [{'namespace': 'default', 'name': 'suricata', 'status': 'patched',
+                           'changed_keys': [...], 'removed_keys': [...]}, ...],
+              'seconds': 0.42}
+    """
+    payload = request.get_json()  # type: Dict[str, List[Dict]]
+    if not payload or not isinstance(payload.get('config_maps'), list):
+        return ERROR_RESPONSE
+
+    start = time()
+    with KubernetesWrapper(conn_mng) as kube_apiv1:
+        pool = Pool(CONFIG_MAP_APPLY_CONCURRENCY)
+        results = pool.map(lambda config_map: _apply_config_map(kube_apiv1, config_map), payload['config_maps'])
+
+    return jsonify({'results': results, 'seconds': time() - start})
+
+
 @app.route('/api/create_config_map', methods=['POST'])
 def create_config_map() -> Response:
     """
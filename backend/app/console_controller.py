@@ -3,9 +3,11 @@ Controller responsible for handling the scrolling
 console box when we kick off jobs.
 """
 from app import app, socketio, conn_mng, logger
-from app.common import OK_RESPONSE
+from app.common import OK_RESPONSE, ERROR_RESPONSE, BAD_REQUEST_RESPONSE, get_int_arg
+from app.socket_service import console_sink, console_room, read_console_logs, delete_console_logs
 from flask import request, jsonify, Response
-from flask_socketio import emit
+from flask_socketio import emit, join_room, leave_room
+from pymongo.errors import OperationFailure
 
 
 @socketio.on('connect')
@@ -18,14 +20,55 @@ def disconnect():
     print('Client disconnected')
 
 
+@socketio.on('join_job')
+def join_job(job_name: str) -> bool:
+    """
+    Subscribes the client to the console output of a job.  Clients should fetch the
+    lines they missed with /api/get_console_logs after this is acknowledged.
+
+    :param job_name: The name of the job (EX: Kickstart or Kit)
+    :return: True so that the client is acknowledged.
+    """
+    join_room(console_room(job_name))
+    return True
+
+
+@socketio.on('leave_job')
+def leave_job(job_name: str) -> None:
+    """
+    Unsubscribes the client from the console output of a job.
+
+    :param job_name: The name of the job (EX: Kickstart or Kit)
+    """
+    leave_room(console_room(job_name))
+
+
 @app.route('/api/get_console_logs/<job_name>', methods=['GET'])
 def get_console_logs(job_name: str) -> Response:
     """
-    Gets the console logs by Job name.
+    Gets the console logs by Job name.  Logs are always returned in ascending order
+    of their per job sequence number ('seq').
+
+    Query string arguments:
+        after: Only return logs with a sequence number greater than this one.
+        before: Only return logs with a sequence number less than this one.
+        limit: The maximum number of logs to return.
+        tail: Returns the last N logs, it is the same as limit without after.
+
+    With no arguments the whole history is returned.  Sequence numbers must not be
+    negative and limit and tail must be positive, otherwise 400 is returned.
 
     :param job_name: The name of the job (EX: Kickstart or Kit)
     """
-    logs = list(conn_mng.mongo_console.find({"jobName": job_name}, {'_id': False}))
+    try:
+        after = get_int_arg('after', minimum=0)
+        before = get_int_arg('before', minimum=0)
+        tail = get_int_arg('tail', minimum=1)
+        limit = tail if tail is not None else get_int_arg('limit', 0, minimum=1)
+    except ValueError:
+        return BAD_REQUEST_RESPONSE
+
+    logs = read_console_logs(job_name, after, before, limit)
     return jsonify(logs)
 
 
@@ -37,5 +80,20 @@ def remove_console_logs() -> Response:
     :return: OK Response.
     """
     payload = request.get_json()
-    conn_mng.mongo_console.delete_many({'jobName': payload['jobName']})
+    try:
+        delete_console_logs(payload['jobName'])
+    except OperationFailure as e:
+        # Older versions of mongo do not allow deletes on capped collections.
+        logger.exception(e)
+        return ERROR_RESPONSE
     return OK_RESPONSE
+
+
+@app.route('/api/get_console_sink_stats', methods=['GET'])
+def get_console_sink_stats() -> Response:
+    """
+    Gets the batch size and flush latency statistics of the console sink.
+
+    :return: Response object with a json dictionary.
+    """
+    return jsonify(console_sink.stats)
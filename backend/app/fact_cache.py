@@ -0,0 +1,84 @@
+"""
+Module for caching the ansible setup facts of nodes.
+
+Gathering facts runs the ansible setup module over ssh which takes several seconds
+per node.  The facts of a node (cpus, memory, disks and interfaces) rarely change, so
+they are cached by host in mongo until they expire or are invalidated.
+"""
+import json
+
+from app import conn_mng, logger
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure
+from typing import Dict, List, Optional
+
+FACT_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+
+def setup_fact_cache() -> None:
+    """
+    Creates the TTL index that removes expired facts.  If the index exists with a
+    different TTL it is changed to the configured one.
+
+    :return:
+    """
+    try:
+        conn_mng.mongo_node_facts.create_index('gathered_at', expireAfterSeconds=FACT_CACHE_TTL_SECONDS)
+    except OperationFailure:
+        conn_mng.mongo_database.command('collMod', conn_mng.mongo_node_facts.name,
+                                        index={'keyPattern': {'gathered_at': 1},
+                                               'expireAfterSeconds': FACT_CACHE_TTL_SECONDS})
+
+
+def get_cached_facts(host: str) -> Optional[Dict]:
+    """
+    Gets the cached ansible setup output of a host.
+
+    :param host: The ip address or hostname the facts were gathered from.
+    :return: The ansible setup json object or None if there are no facts or they have expired.
+    """
+    # The TTL monitor only runs once a minute so the expiration is checked here too.
+    oldest = datetime.utcnow() - timedelta(seconds=FACT_CACHE_TTL_SECONDS)
+    doc = conn_mng.mongo_node_facts.find_one({'_id': host, 'gathered_at': {'$gt': oldest}})
+    if doc is None:
+        return None
+    return json.loads(doc['facts'])
+
+
+def cache_facts(host: str, json_object: Dict) -> None:
+    """
+    Caches the ansible setup output of a host.  The output is stored as a string
+    because fact names are not always valid mongo keys.
+
+    :param host: The ip address or hostname the facts were gathered from.
+    :param json_object: The ansible setup json object.
+    :return:
+    """
+    conn_mng.mongo_node_facts.replace_one({'_id': host},
+                                          {'_id': host,
+                                           'facts': json.dumps(json_object),
+                                           'gathered_at': datetime.utcnow()},
+                                          upsert=True)
+
+
+def invalidate_facts(hosts: List[str]=None) -> None:
+    """
+    Removes the cached facts of the hosts.
+
+    :param hosts: The hosts to remove, if None the facts of every host are removed.
+    :return:
+    """
+    if hosts is None:
+        conn_mng.mongo_node_facts.delete_many({})
+    else:
+        conn_mng.mongo_node_facts.delete_many({'_id': {'$in': hosts}})
+
+
+def invalidate_fact_cache() -> None:
+    """
+    Job hook that removes every cached fact after a job reprovisions the nodes.
+
+    :return:
+    """
+    logger.info("Invalidating the node fact cache.")
+    invalidate_facts()
@@ -3,28 +3,36 @@ Main module for handling all of the Kit Configuration REST calls.
 """
 import json
 import pymongo
-from app import app, logger, conn_mng
-from app.job_manager import shell
+from app import app, logger, conn_mng, socketio, kube_describe
+from app.cluster_cache import add_public_ip, Informer, NODE_INFORMER, POD_INFORMER
+from app.health_service import HEALTH_ROOM, start_status_push
+from app.job_manager import shell, ShellTimeoutError
 from shared.constants import KIT_ID
 from shared.utils import decode_password
 
-from app.job_manager import spawn_job
+from app.job_manager import spawn_job, ANSIBLE_LOCK_ID
+from app.lock_manager import shared_lock
 from app.socket_service import log_to_console
 from app.common import OK_RESPONSE, ERROR_RESPONSE
 from flask import request, Response, jsonify
+from flask_socketio import join_room, leave_room
 from shared.connection_mngs import KubernetesWrapper, objectify, KitFormNotFound
+from typing import Callable, Dict, List
 
+DESCRIBE_TIMEOUT = 30  # seconds
 
-@app.route('/api/describe_pod/<pod_name>/<namespace>', methods=['GET'])
-def describe_pod(pod_name: str, namespace: str) -> Response:
+
+def _describe_with_fabfile(command: str) -> Response:
     """
-    Runs a command and pulls the pods describe command output.
+    Runs one of the describe fabfiles which runs kubectl describe on the master server.
 
-    :param pod_name: The name of the pod of cource.  
-                     You can get it with 'kubectl get pods' on the main server node.
+    :param command: The fabfile command.
+    :return:
     """
-    command = '/opt/rock-frontend/tfp-env/bin/python describe_kubernetes_pod.py %s %s' % (pod_name, namespace)
-    stdout, stderr = shell(command, working_dir="/opt/rock-frontend/backend/fabfiles")
+    try:
+        stdout, stderr = shell(command, working_dir="/opt/rock-frontend/backend/fabfiles", timeout=DESCRIBE_TIMEOUT)
+    except ShellTimeoutError as e:
+        return jsonify({'stdout': None, 'stderr': str(e)})
 
     if stdout:
         stdout = stdout.decode('utf-8')        
@@ -35,24 +43,42 @@ def describe_pod(pod_name: str, namespace: str) -> Response:
     return jsonify({'stdout': stdout, 'stderr': stderr})
 
 
+@app.route('/api/describe_pod/<pod_name>/<namespace>', methods=['GET'])
+def describe_pod(pod_name: str, namespace: str) -> Response:
+    """
+    Describes a pod and its events with the kubernetes API.  If that fails the
+    describe fabfile is used instead.
+
+    :param pod_name: The name of the pod of cource.  
+                     You can get it with 'kubectl get pods' on the main server node.
+    """
+    try:
+        with KubernetesWrapper(conn_mng) as kube_apiv1:
+            return jsonify({'stdout': kube_describe.describe_pod(kube_apiv1, pod_name, namespace), 'stderr': None})
+    except Exception as e:
+        logger.exception(e)
+
+    command = '/opt/rock-frontend/tfp-env/bin/python describe_kubernetes_pod.py %s %s' % (pod_name, namespace)
+    return _describe_with_fabfile(command)
+
+
 @app.route('/api/describe_node/<node_name>', methods=['GET'])
 def describe_node(node_name: str) -> Response:
     """
-    Runs a command and pulls the pods describe command output.
+    Describes a node, its pods and its events with the kubernetes API.  If that fails
+    the describe fabfile is used instead.
 
     :param node_name: The name of the node of cource.  
                       You can get it with 'kubectl get nodes' on the main server node.
     """
-    command = '/opt/rock-frontend/tfp-env/bin/python describe_kubernetes_node.py %s' % node_name
-    stdout, stderr = shell(command, working_dir="/opt/rock-frontend/backend/fabfiles")        
-
-    if stdout:
-        stdout = stdout.decode('utf-8')        
-
-    if stderr:
-        stderr = stderr.decode('utf-8')        
+    try:
+        with KubernetesWrapper(conn_mng) as kube_apiv1:
+            return jsonify({'stdout': kube_describe.describe_node(kube_apiv1, node_name), 'stderr': None})
+    except Exception as e:
+        logger.exception(e)
 
-    return jsonify({'stdout': stdout, 'stderr': stderr})
+    command = '/opt/rock-frontend/tfp-env/bin/python describe_kubernetes_node.py %s' % node_name
+    return _describe_with_fabfile(command)
 
 
 @app.route('/api/perform_systems_check', methods=['GET'])
@@ -69,7 +95,7 @@ def perform_systems_check() -> Response:
                               decode_password(current_kit_configuration["form"]["root_password"]) + "' site.yml")
             spawn_job("SystemsCheck",
                     cmd_to_execute,
-                    ["systems_check"],
+                    ["systems_check", shared_lock("kit"), shared_lock(ANSIBLE_LOCK_ID)],
                     log_to_console,
                     working_directory="/opt/rock-integration-testing/playbooks")
             return OK_RESPONSE
@@ -78,37 +104,87 @@ def perform_systems_check() -> Response:
     return ERROR_RESPONSE
 
 
-@app.route('/api/get_pods_statuses', methods=['GET'])
-def get_pod_info() -> Response:
+@socketio.on('join_health')
+def join_health() -> bool:
+    """
+    Subscribes the client to the pod and node status changes.  Clients should fetch
+    the pods and nodes with since=0 after this is acknowledged and then apply the
+    changes whose version is newer than the one they fetched.
+
+    :return: True so that the client is acknowledged.
+    """
+    join_room(HEALTH_ROOM)
+    start_status_push()
+    return True
+
+
+@socketio.on('leave_health')
+def leave_health() -> None:
+    """
+    Unsubscribes the client from the pod and node status changes.
+    """
+    leave_room(HEALTH_ROOM)
+
+
+def _informer_response(informer: Informer, list_items: Callable[[], List[Dict]]) -> Response:
+    """
+    Serves the objects of an informer.  If the since query parameter is set only the changes
+    after that version are returned.  Until the informer has listed the objects once, they
+    are listed directly from kubernetes.
+
+    :param informer: The Informer of the objects.
+    :param list_items: A function that lists the objects directly from kubernetes.
+    :return:
+    """
+    since = request.args.get('since', type=int)
+    if not informer.wait_synced():
+        items = list_items()
+        if since is None:
+            return jsonify(items)
+        return jsonify({'version': None, 'full': True, 'items': items, 'deleted': []})
+
+    if since is None:
+        return Response(informer.to_json(), mimetype='application/json')
+    return jsonify(informer.changes_since(since))
+
+
+def _list_pods() -> List[Dict]:
     try:
         with KubernetesWrapper(conn_mng) as kube_apiv1:
             api_response = kube_apiv1.list_pod_for_all_namespaces(watch=False)
-            return jsonify(api_response.to_dict()['items'])
+            return api_response.to_dict()['items']
     except Exception as e:
         logger.exception(e)
 
-    return jsonify([])    
+    return []
 
 
-@app.route('/api/get_node_statuses', methods=['GET'])
-def get_node_statuses() -> Response:
+def _list_nodes() -> List[Dict]:
     try:
         with KubernetesWrapper(conn_mng) as kube_apiv1:
             api_response = kube_apiv1.list_node()
-            ret_val = []
-            for item in api_response.to_dict()['items']:                
-                try:
-                    public_ip = item["metadata"]["annotations"]["flannel.alpha.coreos.com/public-ip"]
-                    item["metadata"]["public_ip"] = public_ip
-                    ret_val.append(item)
-                except KeyError as e:
-                    item["metadata"]["public_ip"] = ''
-                    ret_val.append(item)
-                except Exception as e:
-                    logger.warn(item)
-                    logger.exception(e)
-            return jsonify(ret_val)
+            return [add_public_ip(item) for item in api_response.to_dict()['items']]
     except Exception as e:
         logger.exception(e)
 
-    return jsonify([])
+    return []
+
+
+@app.route('/api/get_pods_statuses', methods=['GET'])
+def get_pod_info() -> Response:
+    """
+    Gets the pods of every namespace from the cluster cache.
+
+    :return: A json list of pods or the changes since the version passed in the since query parameter.
+    """
+    return _informer_response(POD_INFORMER, _list_pods)
+
+
+@app.route('/api/get_node_statuses', methods=['GET'])
+def get_node_statuses() -> Response:
+    """
+    Gets the nodes from the cluster cache.
+
+    :return: A json list of nodes or the changes since the version passed in the since query parameter.
+    """
+    return _informer_response(NODE_INFORMER, _list_nodes)
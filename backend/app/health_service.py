@@ -0,0 +1,155 @@
+"""
+Module that pushes the pod and node status changes of the cluster cache to the
+System Health page over socket.io.
+
+Changes are coalesced per object for STATUS_PUSH_INTERVAL seconds so a burst of
+events (IE: a rolling restart) becomes one update per object.  Only the fields the
+page shows are sent and changes to any other field are not pushed at all.
+"""
+from app import socketio
+from app.cluster_cache import NODE_INFORMER, POD_INFORMER
+from collections import OrderedDict
+from gevent import spawn_later
+from typing import Callable, Dict, List, Tuple
+
+HEALTH_ROOM = 'health'
+STATUS_PUSH_INTERVAL = 0.5
+
+
+def pod_summary(item: Dict) -> Dict:
+    """
+    Reduces a pod to the fields the System Health page shows.  The shape of the pod is kept
+    so the page can merge it into the pod it has.
+
+    :param item: The dictionary of a pod.
+    :return:
+    """
+    status = item.get('status') or {}
+    container_statuses = []
+    for container_status in status.get('container_statuses') or []:
+        state = {}
+        for key, value in (container_status.get('state') or {}).items():
+            state[key] = {'reason': value.get('reason'), 'message': value.get('message')} if value else None
+        container_statuses.append({'name': container_status['name'],
+                                   'ready': container_status.get('ready'),
+                                   'restart_count': container_status.get('restart_count') or 0,
+                                   'state': state})
+
+    return {'metadata': {'name': item['metadata']['name'], 'namespace': item['metadata'].get('namespace')},
+            'spec': {'node_name': (item.get('spec') or {}).get('node_name')},
+            'status': {'phase': status.get('phase'),
+                       'reason': status.get('reason'),
+                       'message': status.get('message'),
+                       'host_ip': status.get('host_ip'),
+                       'restarts': sum(container['restart_count'] for container in container_statuses),
+                       'conditions': [{'type': condition['type'], 'status': condition['status']}
+                                      for condition in status.get('conditions') or []],
+                       'container_statuses': container_statuses}}
+
+
+def node_summary(item: Dict) -> Dict:
+    """
+    Reduces a node to the fields the System Health page shows.  The heartbeat times of the
+    conditions are left out because they change every few seconds.
+
+    :param item: The dictionary of a node.
+    :return:
+    """
+    status = item.get('status') or {}
+    return {'metadata': {'name': item['metadata']['name'], 'public_ip': item['metadata'].get('public_ip')},
+            'status': {'conditions': [{'type': condition['type'],
+                                       'status': condition['status'],
+                                       'reason': condition.get('reason'),
+                                       'message': condition.get('message')}
+                                      for condition in status.get('conditions') or []]}}
+
+
+class StatusPusher(object):
+    """
+    Coalesces the changes of an informer and emits them to the health room.
+    """
+
+    def __init__(self, kind: str, summarize: Callable[[Dict], Dict], interval: float=STATUS_PUSH_INTERVAL):
+        """
+        :param kind: The kind of the objects (IE: pods)
+        :param summarize: Reduces an object to the fields that are pushed.
+        :param interval: The number of seconds changes are coalesced for.
+        """
+        self.kind = kind
+        self._summarize = summarize
+        self._interval = interval
+        self._pending = OrderedDict()  # type: Dict[Tuple[str, str], List]
+        self._sent = {}  # type: Dict[Tuple[str, str], Dict]
+        self._version = None
+        self._is_scheduled = False
+
+    def on_change(self, event_type: str, item: Dict, version: int) -> None:
+        """
+        Informer listener that queues a change until the next flush.
+
+        :param event_type: ADDED, MODIFIED or DELETED
+        :param item: The object that changed.
+        :param version: The version of the informer after the change.
+        :return:
+        """
+        key = (item['metadata'].get('namespace') or '', item['metadata']['name'])
+        summary = None if event_type == 'DELETED' else self._summarize(item)
+        self._version = version
+
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = [event_type, summary]
+        elif event_type == 'DELETED':
+            if key in self._sent:
+                self._pending[key] = [event_type, None]
+            else:
+                # Added and deleted before anyone heard of it.
+                del self._pending[key]
+        elif pending[0] == 'DELETED':
+            self._pending[key] = ['MODIFIED', summary]
+        else:
+            pending[1] = summary
+
+        if self._pending and not self._is_scheduled:
+            self._is_scheduled = True
+            spawn_later(self._interval, self.flush)
+
+    def flush(self) -> None:
+        """
+        Emits one change per object that changed since the last flush.
+
+        :return:
+        """
+        self._is_scheduled = False
+        pending, self._pending = self._pending, OrderedDict()
+        changes = []
+        for key, (event_type, summary) in pending.items():
+            change = {'type': event_type, 'namespace': key[0], 'name': key[1]}
+            if event_type == 'DELETED':
+                self._sent.pop(key, None)
+            elif self._sent.get(key) == summary:
+                continue
+            else:
+                self._sent[key] = summary
+                change['object'] = summary
+            changes.append(change)
+
+        if changes:
+            socketio.emit('cluster_status', {'kind': self.kind, 'version': self._version, 'changes': changes},
+                          room=HEALTH_ROOM)
+
+
+POD_PUSHER = StatusPusher('pods', pod_summary)
+NODE_PUSHER = StatusPusher('nodes', node_summary)
+POD_INFORMER.add_listener(POD_PUSHER.on_change)
+NODE_INFORMER.add_listener(NODE_PUSHER.on_change)
+
+
+def start_status_push() -> None:
+    """
+    Starts the informers whose changes are pushed.
+
+    :return:
+    """
+    POD_INFORMER.start()
+    NODE_INFORMER.start()
@@ -0,0 +1,376 @@
+"""
+Module that finds the live hosts of a network without shelling out to nmap.
+
+Every address is probed concurrently on greenlets.  A host is up if it answers an
+ICMP echo, if a TCP connect to one of SCAN_TCP_PORTS is answered (accepted or
+refused) or if the kernel resolved its ARP entry while it was being probed.  ARP
+entries that were already resolved before the scan are ignored, they might be stale.
+
+Every address is pinged first, which only needs the one ICMP socket, and only the
+addresses that did not answer are probed over TCP.  A scan can be given a time budget
+so it finishes before the proxy in front of the backend gives up on the request, the
+addresses that were not probed within the budget are unknown.  The budget covers both
+the ICMP and the TCP probes.
+"""
+import errno
+import gevent
+import os
+import socket
+import struct
+
+from app import logger
+from gevent.event import Event
+from gevent.pool import Pool
+from ipaddress import IPv4Address, IPv4Network, ip_address, ip_network
+from time import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# The number of hosts probed over TCP at the same time, each one uses len(SCAN_TCP_PORTS) sockets.
+SCAN_CONCURRENCY = 128
+# The number of hosts pinged at the same time, pings share one socket.
+SCAN_ICMP_CONCURRENCY = 1024
+# Apache's default ProxyTimeout is 60 seconds.
+SCAN_BUDGET_SECONDS = 45
+SCAN_TIMEOUT = 1.0  # seconds
+SCAN_RETRIES = 1
+SCAN_TCP_PORTS = (22, 80, 443)
+# The largest network that is scanned, larger networks are narrowed to the /20 of the address.
+SCAN_MIN_PREFIX = 20
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ARP_CACHE = '/proc/net/arp'
+ARP_COMPLETE = 0x2
+TCP_UP_ERRNOS = (0, errno.ECONNREFUSED)
+
+
+def management_network(address: str, cidr: int) -> IPv4Network:
+    """
+    Gets the network of an address that is scanned.
+
+    :param address: An address on the network (IE: 192.168.1.10)
+    :param cidr: The prefix length of the network (IE: 24)
+    :return:
+    """
+    return ip_network('%s/%d' % (address, max(cidr, SCAN_MIN_PREFIX)), strict=False)
+
+
+class HostBitmap(object):
+    """
+    The result of a scan of a network, one bit per address for the live hosts and
+    one bit per address for the addresses that were probed.
+    """
+
+    def __init__(self, network: IPv4Network):
+        self.network = network
+        self._first = int(network.network_address)
+        self._live = bytearray((network.num_addresses + 7) // 8)
+        self._probed = bytearray((network.num_addresses + 7) // 8)
+
+    def _index(self, address: IPv4Address) -> int:
+        index = int(address) - self._first
+        if not 0 <= index < self.network.num_addresses:
+            raise ValueError("%s is not in %s" % (address, self.network))
+        return index
+
+    @staticmethod
+    def _is_set(bits: bytearray, index: int) -> bool:
+        return bool(bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, address: IPv4Address) -> None:
+        """
+        Records a host that is up.
+
+        :param address:
+        :return:
+        """
+        index = self._index(address)
+        self._live[index >> 3] |= 1 << (index & 7)
+        self._probed[index >> 3] |= 1 << (index & 7)
+
+    def add_down(self, address: IPv4Address) -> None:
+        """
+        Records a host that did not answer.
+
+        :param address:
+        :return:
+        """
+        index = self._index(address)
+        self._probed[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, address: IPv4Address) -> bool:
+        return self._is_set(self._live, self._index(ip_address(address)))
+
+    def __iter__(self) -> Iterator[IPv4Address]:
+        for index in range(self.network.num_addresses):
+            if self._is_set(self._live, index):
+                yield IPv4Address(self._first + index)
+
+    def __len__(self) -> int:
+        return sum(bin(byte).count('1') for byte in self._live)
+
+    def is_unused(self, address: IPv4Address) -> bool:
+        """
+        Checks if an address was probed and did not answer.  Addresses the scan did not
+        get to are not unused.
+
+        :param address:
+        :return:
+        """
+        index = self._index(ip_address(address))
+        return self._is_set(self._probed, index) and not self._is_set(self._live, index)
+
+    def unused(self) -> List[IPv4Address]:
+        """
+        Gets the host addresses of the network that did not answer.
+
+        :return:
+        """
+        return [address for address in self.network.hosts() if self.is_unused(address)]
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _echo_request(identifier: int, sequence: int) -> bytes:
+    payload = b'rock-frontend-ping'
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = _checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+
+
+def _read_arp_cache() -> Set[str]:
+    """
+    Gets the addresses the kernel has resolved a hardware address for.
+
+    :return:
+    """
+    resolved = set()
+    try:
+        with open(ARP_CACHE) as arp_cache:
+            next(arp_cache)
+            for line in arp_cache:
+                fields = line.split()
+                if len(fields) >= 4 and int(fields[2], 16) & ARP_COMPLETE and fields[3] != '00:00:00:00:00:00':
+                    resolved.add(fields[0])
+    except (IOError, OSError, StopIteration):
+        pass
+    return resolved
+
+
+class _IcmpPinger(object):
+    """
+    Sends echo requests from one socket and wakes up the probes whose host replied.
+    A raw socket is used when the process is allowed to open one, otherwise an
+    unprivileged ICMP datagram socket.  If neither can be opened ICMP is skipped.
+    """
+
+    def __init__(self):
+        self._identifier = os.getpid() & 0xFFFF
+        self._sequence = 0
+        self._waiting = {}  # type: Dict[str, Event]
+        self._is_raw = True
+        self._sock = None  # type: Optional[socket.socket]
+        try:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        except (PermissionError, OSError):
+            self._is_raw = False
+            try:
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            except (PermissionError, OSError) as e:
+                logger.warn("ICMP probes are disabled: %s" % str(e))
+        self._receiver = gevent.spawn(self._receive) if self._sock else None
+
+    @property
+    def enabled(self) -> bool:
+        return self._sock is not None
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                data, (source, _) = self._sock.recvfrom(2048)
+            except OSError:
+                return
+            icmp = data[(data[0] & 0x0F) * 4:] if self._is_raw else data
+            if len(icmp) < 8:
+                continue
+            icmp_type, _, _, identifier, _ = struct.unpack('!BBHHH', icmp[:8])
+            # The kernel sets and filters the identifier of datagram sockets.
+            if icmp_type == ICMP_ECHO_REPLY and (not self._is_raw or identifier == self._identifier):
+                event = self._waiting.get(source)
+                if event is not None:
+                    event.set()
+
+    def ping(self, address: str, timeout: float) -> bool:
+        """
+        Sends one echo request and waits for the reply.
+
+        :param address: The address to ping.
+        :param timeout: The number of seconds to wait for the reply.
+        :return: True if the host replied.
+        """
+        event = self._waiting.setdefault(address, Event())
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        try:
+            self._sock.sendto(_echo_request(self._identifier, self._sequence), (address, 0))
+        except OSError:
+            return False
+        return event.wait(timeout)
+
+    def done(self, address: str) -> None:
+        self._waiting.pop(address, None)
+
+    def close(self) -> None:
+        if self._receiver is not None:
+            self._receiver.kill()
+        if self._sock is not None:
+            self._sock.close()
+
+
+def _tcp_probe(address: str, port: int, timeout: float) -> bool:
+    """
+    Connects to a port of a host.  A refused connection still means the host is up.
+
+    :return: True if the host answered.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        return sock.connect_ex((address, port)) in TCP_UP_ERRNOS
+    except (socket.timeout, OSError):
+        return False
+    finally:
+        sock.close()
+
+
+class HostScanner(object):
+    """
+    Probes the hosts of a network concurrently.
+
+    EX:
+    live_hosts = HostScanner().scan(ip_network('10.40.12.0/22'))
+    unused = live_hosts.unused()
+    """
+
+    def __init__(self, concurrency: int=SCAN_CONCURRENCY, timeout: float=SCAN_TIMEOUT,
+                 retries: int=SCAN_RETRIES, tcp_ports: Tuple[int, ...]=SCAN_TCP_PORTS):
+        """
+        :param concurrency: The number of hosts that are probed at the same time.
+        :param timeout: The number of seconds to wait for each probe.
+        :param retries: The number of echo requests that are sent again before a host is probed over TCP.
+        :param tcp_ports: The ports that are connected to if the host does not answer ICMP.
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.tcp_ports = tcp_ports
+
+    def _ping(self, pinger: _IcmpPinger, address: IPv4Address,
+              deadline: Optional[float]) -> Tuple[IPv4Address, Optional[bool]]:
+        host = str(address)
+        try:
+            for _ in range(self.retries + 1):
+                timeout = self.timeout
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time())
+                    if timeout <= 0:
+                        return address, None
+                if pinger.ping(host, timeout):
+                    return address, True
+            return address, False
+        finally:
+            pinger.done(host)
+
+    def _probe(self, address: IPv4Address, deadline: Optional[float]) -> Tuple[IPv4Address, Optional[bool]]:
+        if deadline is not None and time() >= deadline:
+            return address, None
+
+        host = str(address)
+        if self.tcp_ports:
+            probes = [gevent.spawn(_tcp_probe, host, port, self.timeout) for port in self.tcp_ports]
+            gevent.joinall(probes)
+            if any(probe.value for probe in probes):
+                return address, True
+        return address, False
+
+    def iter_scan(self, addresses: Iterable[IPv4Address],
+                  budget: float=None) -> Iterator[Tuple[IPv4Address, Optional[bool]]]:
+        """
+        Probes the addresses and yields each one as soon as its probes are done.
+
+        :param addresses: The addresses to probe.
+        :param budget: The number of seconds after which no more addresses are probed.
+        :return: (address, is_up) in the order the probes complete.  is_up is None for the
+                 addresses that were not probed within the budget.  The addresses that did
+                 not answer at all come last, once the ARP cache has been checked.
+        """
+        deadline = None if budget is None else time() + budget
+        addresses = list(addresses)
+        resolved_before = _read_arp_cache()
+        pinger = _IcmpPinger()
+        try:
+            unanswered = addresses
+            if pinger.enabled:
+                unanswered = []
+                pool = Pool(SCAN_ICMP_CONCURRENCY)
+                for address, is_up in pool.imap_unordered(lambda address: self._ping(pinger, address, deadline),
+                                                          addresses):
+                    if is_up is False:
+                        unanswered.append(address)
+                    else:
+                        yield address, is_up
+        finally:
+            pinger.close()
+
+        silent = []
+        pool = Pool(self.concurrency)
+        for address, is_up in pool.imap_unordered(lambda address: self._probe(address, deadline), unanswered):
+            if is_up is False:
+                silent.append(address)
+            else:
+                yield address, is_up
+
+        # Probing a host on the local segment makes the kernel resolve its hardware address.
+        resolved = _read_arp_cache() - resolved_before
+        for address in silent:
+            yield address, str(address) in resolved
+
+    def live_hosts(self, addresses: Iterable[str], budget: float=None) -> Set[str]:
+        """
+        Probes some addresses.
+
+        :param addresses: The addresses to probe (IE: ['192.168.1.10', '192.168.1.11'])
+        :param budget: The number of seconds after which no more addresses are probed.
+        :return: The addresses that are up or were not probed within the budget.
+        """
+        return {str(address) for address, is_up in self.iter_scan((ip_address(address) for address in addresses),
+                                                                   budget)
+                if is_up is not False}
+
+    def scan(self, network: IPv4Network, budget: float=None) -> HostBitmap:
+        """
+        Probes every host address of a network.
+
+        :param network: The network to scan.
+        :param budget: The number of seconds after which no more addresses are probed.
+        :return: The live hosts.
+        """
+        live_hosts = HostBitmap(network)
+        unknown = 0
+        for address, is_up in self.iter_scan(network.hosts(), budget):
+            if is_up:
+                live_hosts.add(address)
+            elif is_up is None:
+                unknown += 1
+            else:
+                live_hosts.add_down(address)
+
+        if unknown:
+            logger.warn("%d addresses of %s were not probed within %s seconds." % (unknown, network, budget))
+        return live_hosts
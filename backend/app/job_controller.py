@@ -0,0 +1,45 @@
+"""
+Main module for handling the job history REST calls.
+"""
+from app import app
+from app.common import BAD_REQUEST_RESPONSE, get_int_arg
+from app.job_history import get_job_history, get_task_stats, MAX_HISTORY_RUNS
+from flask import jsonify, Response
+
+
+@app.route('/api/get_job_history/<job_name>', methods=['GET'])
+def get_job_history_api(job_name: str) -> Response:
+    """
+    Gets the newest runs of a job with their queue wait time, start and end times,
+    exit status and output volume.
+
+    Query string arguments:
+        limit: The number of runs to return, 20 by default and at most MAX_HISTORY_RUNS.
+
+    :param job_name: The name of the job (EX: Kit or Add_Node_sensor1)
+    :return: Response object with a json list or 400 if limit is not a positive integer.
+    """
+    try:
+        limit = get_int_arg('limit', 20, minimum=1)
+    except ValueError:
+        return BAD_REQUEST_RESPONSE
+    return jsonify(get_job_history(job_name, min(limit, MAX_HISTORY_RUNS)))
+
+
+@app.route('/api/get_job_task_stats/<job_name>', methods=['GET'])
+def get_job_task_stats(job_name: str) -> Response:
+    """
+    Gets the p50 and p95 durations of every ansible task the job ran across
+    its newest completed runs.  The slowest tasks come first.
+
+    Query string arguments:
+        runs: The number of runs to aggregate, 20 by default and at most MAX_HISTORY_RUNS.
+
+    :param job_name: The name of the job (EX: Kit or Add_Node_sensor1)
+    :return: Response object with a json list or 400 if runs is not a positive integer.
+    """
+    try:
+        runs = get_int_arg('runs', 20, minimum=1)
+    except ValueError:
+        return BAD_REQUEST_RESPONSE
+    return jsonify(get_task_stats(job_name, min(runs, MAX_HISTORY_RUNS)))
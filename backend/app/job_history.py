@@ -0,0 +1,135 @@
+"""
+Module for recording the history of jobs and timing the ansible tasks they run.
+
+The history is kept in the jobs collection which the job manager maintains.
+"""
+import math
+import pymongo
+import re
+
+from app import conn_mng
+from time import time
+from typing import Dict, List
+
+TASK_HEADER = re.compile(r'^(PLAY|TASK|RUNNING HANDLER) \[(.*)\]')
+HEADER_PREFIXES = ('PLAY', 'TASK', 'RUNNING HANDLER')
+# The command is left out because it has the root password of the nodes in it.
+HISTORY_PROJECTION = {'tasks': False, 'command': False}
+# The most runs that are returned or aggregated by one request.
+MAX_HISTORY_RUNS = 500
+
+
+class AnsibleTaskTimer(object):
+    """
+    Times the tasks of ansible-playbook runs from their output.  A task lasts
+    from its TASK header until the next TASK, PLAY or PLAY RECAP header.
+    """
+
+    def __init__(self):
+        self.tasks = []  # type: List[Dict]
+        self._play = None
+        self._task = None
+        self._task_start = None
+
+    def feed(self, line: str) -> None:
+        """
+        Feeds a line of output to the timer.
+
+        :param line: A line of ansible-playbook output.
+        :return:
+        """
+        if not line.startswith(HEADER_PREFIXES):
+            return
+
+        match = TASK_HEADER.match(line)
+        if match is None:
+            if line.startswith('PLAY RECAP'):
+                self._end_task()
+            return
+
+        self._end_task()
+        kind, name = match.groups()
+        if kind == 'PLAY':
+            self._play = name
+        else:
+            self._task = name
+            self._task_start = time()
+
+    def _end_task(self) -> None:
+        if self._task is not None:
+            self.tasks.append({'play': self._play, 'task': self._task,
+                               'duration': time() - self._task_start})
+            self._task = None
+
+    def finish(self) -> List[Dict]:
+        """
+        Ends the task that is still running and returns the timed tasks.
+
+        :return: [{'play': 'Common', 'task': 'common : Install packages', 'duration': 12.3}, ...]
+        """
+        self._end_task()
+        return self.tasks
+
+
+def setup_job_history() -> None:
+    """
+    Creates the indexes the history queries sort by.
+
+    :return:
+    """
+    conn_mng.mongo_jobs.create_index([('job_name', pymongo.ASCENDING), ('queued_at', pymongo.DESCENDING)])
+    conn_mng.mongo_jobs.create_index([('job_name', pymongo.ASCENDING), ('completed_at', pymongo.DESCENDING)])
+
+
+def _percentile(sorted_values: List[float], percent: int) -> float:
+    """
+    Nearest rank percentile.
+
+    :param sorted_values: A non empty ascending list of values.
+    :param percent: The percentile (IE: 95)
+    :return:
+    """
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def get_job_history(job_name: str, limit: int=20) -> List[Dict]:
+    """
+    Gets the newest runs of a job without their task timings.
+
+    :param job_name: The name of the job (EX: Kit)
+    :param limit: The number of runs to return.
+    :return:
+    """
+    cursor = conn_mng.mongo_jobs.find({'job_name': job_name}, HISTORY_PROJECTION)
+    return list(cursor.sort('queued_at', pymongo.DESCENDING).limit(limit))
+
+
+def get_task_stats(job_name: str, runs: int=20) -> List[Dict]:
+    """
+    Aggregates the task durations of the newest completed runs of a job.
+
+    :param job_name: The name of the job (EX: Kit)
+    :param runs: The number of runs to aggregate.
+    :return: The stats of every task sorted by their total duration, the slowest first.
+    """
+    pipeline = [
+        {'$match': {'job_name': job_name, 'completed_at': {'$exists': True}}},
+        {'$sort': {'completed_at': pymongo.DESCENDING}},
+        {'$limit': runs},
+        {'$unwind': '$tasks'},
+        {'$group': {'_id': {'play': '$tasks.play', 'task': '$tasks.task'},
+                    'durations': {'$push': '$tasks.duration'}}}
+    ]
+    stats = []
+    for group in conn_mng.mongo_jobs.aggregate(pipeline):
+        durations = sorted(group['durations'])
+        stats.append({'play': group['_id']['play'],
+                      'task': group['_id']['task'],
+                      'count': len(durations),
+                      'total': sum(durations),
+                      'p50': _percentile(durations, 50),
+                      'p95': _percentile(durations, 95),
+                      'max': durations[-1]})
+    stats.sort(key=lambda stat: stat['total'], reverse=True)
+    return stats
@@ -1,65 +1,227 @@
+import codecs
 import fcntl
+import importlib
 import os
-import sys
+import re
 import shlex
+import socket
 from app import logger, socketio, conn_mng
-from shared.constants import DATE_FORMAT_STR
+from app.job_history import AnsibleTaskTimer, setup_job_history
+from app.lock_manager import Lock, LockManager, to_locks
+from pymongo.errors import OperationFailure
+from shared.constants import DATE_FORMAT_STR, KICKSTART_ID
+from shared.utils import decode_password
 from uuid import uuid4
-from datetime import datetime, timedelta
+from datetime import datetime
 import psutil
+import pymongo
 
 import subprocess
-from typing import Callable, List, Tuple
+from flask import has_request_context, request
+from typing import Callable, Dict, Iterator, List, Tuple
 from threading import Thread
-from gevent import sleep
+from time import time
+from gevent import Greenlet, joinall, spawn
+from gevent.event import Event
+from gevent.socket import wait_read
 
 
 JOB_QUEUE = []
-LOCK_IDS = {}
+LOCKS = LockManager()
+# Counted lock that every ansible run takes in shared mode.
+ANSIBLE_LOCK_ID = 'ansible'
+MAX_CONCURRENT_ANSIBLE_RUNS = 2
+LOCKS.set_limit(ANSIBLE_LOCK_ID, MAX_CONCURRENT_ANSIBLE_RUNS)
+
+# The states a job goes through in the jobs collection.
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+# Return code saved for jobs whose outcome was lost because the backend restarted.
+UNKNOWN_RETVAL = 700
+ORPHAN_KILL_TIMEOUT = 5  # seconds
+READ_CHUNK_SIZE = 65536
+# Defaults of shell().
+SHELL_TIMEOUT = 120  # seconds
+SHELL_MAX_OUTPUT = 16 * 1024 * 1024  # bytes
+# Finished jobs are removed from the jobs collection after this long.
+JOB_RETENTION_SECONDS = 90 * 24 * 60 * 60
+# The root password is replaced with this before a command is saved or logged.
+SSH_PASS_PATTERN = re.compile(r"(ansible_ssh_pass=')[^']*(')")
+REDACTED_PASSWORD = '********'
+# Set whenever the scheduler has something to do (IE: a job was queued or a job finished).
+SCHEDULER_EVENT = Event()
 
 
 class SynchronousIPLockException(Exception):
     def __init__(self, msg=""):
         super(SynchronousIPLockException, self).__init__(msg)
-    
 
-def _async_read2(job):
-    """
-    A synchronously read stdout
 
-    :param job: A proc job object     
+class ShellTimeoutError(Exception):
+    def __init__(self, command: str, timeout: float):
+        super(ShellTimeoutError, self).__init__("'%s' did not finish within %s seconds." % (command, timeout))
 
-    :return: Return true if no ouput was sent to function pointer, false otherwise.
-    """    
-    if job.silent:
-        return
-    # set non-blocking flag while preserving old flags
-    fd = job.process.stdout
-    fd2 = job.process.stderr
 
+def _set_nonblocking(fd) -> None:
+    """
+    Sets the non-blocking flag on a file object while preserving its old flags.
+
+    :param fd: The file object (IE: process.stdout)
+    :return:
+    """
     fl = fcntl.fcntl(fd, fcntl.F_GETFL)
     fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-    
-    fl2 = fcntl.fcntl(fd2, fcntl.F_GETFL)
-    fcntl.fcntl(fd2, fcntl.F_SETFL, fl2 | os.O_NONBLOCK)
 
-    # read char until EOF hit
-    ch = None
-    ch2 = None
-    try:
-        sleep(0.1)
-        ch = os.read(fd.fileno(), 1024)
-        job.run_output_func(ch)
 
-        ch2 = os.read(fd2.fileno(), 1024)
-        job.run_output_func(ch2, is_stderr=True)
-    except OSError as e:
-        # waiting for data be available on fd
-        pass
+def _func_path(func: Callable) -> str:
+    """
+    Returns the import path of a module level function so that it can be persisted.
+
+    :param func: The function
+    :return: The path (IE: app.socket_service:log_to_console) or None if the function cannot be imported.
+    """
+    qualname = getattr(func, '__qualname__', '')
+    if '<' in qualname or not getattr(func, '__module__', None):
+        logger.warn("%s cannot be persisted with its job." % str(func))
+        return None
+    return "%s:%s" % (func.__module__, qualname)
+
+
+def redact_command(command: str) -> str:
+    """
+    Replaces the root passwords in a command so that it can be saved and logged.
+
+    :param command: The command of a job.
+    :return:
+    """
+    return SSH_PASS_PATTERN.sub(r"\g<1>%s\g<2>" % REDACTED_PASSWORD, command)
+
+
+def _unredact_command(command: str) -> str:
+    """
+    Puts the root password from the kickstart form back into a redacted command.
+
+    :param command: A command returned by redact_command.
+    :return:
+    """
+    if SSH_PASS_PATTERN.search(command) is None:
+        return command
+
+    kickstart_form = conn_mng.mongo_kickstart.find_one({"_id": KICKSTART_ID})
+    password = decode_password(kickstart_form["form"]["root_password"]) if kickstart_form else ''
+    return SSH_PASS_PATTERN.sub(lambda match: match.group(1) + password + match.group(2), command)
+
 
-    stdout_done = ch is None or ch == b''
-    stderr_done = ch2 is None or ch2 == b''
-    return stderr_done and stderr_done
+def _load_func(path: str) -> Callable:
+    """
+    Imports a function that was persisted with _func_path.
+
+    :param path: The import path of the function.
+    :return:
+    """
+    module_name, qualname = path.split(':')
+    func = importlib.import_module(module_name)
+    for attr in qualname.split('.'):
+        func = getattr(func, attr)
+    return func
+
+
+class LineDecoder(object):
+    """
+    Incrementally decodes chunks of UTF-8 output into complete lines.
+
+    Lines and multibyte characters which straddle a chunk boundary are kept
+    until the rest of them arrives.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial_line = ''
+
+    def decode(self, chunk: bytes) -> List[str]:
+        """
+        Decodes a chunk and returns the lines it completed without their trailing newline.
+
+        :param chunk: A chunk of output.
+        :return:
+        """
+        lines = (self._partial_line + self._decoder.decode(chunk)).split('\n')
+        self._partial_line = lines.pop()
+        return lines
+
+    def flush(self) -> List[str]:
+        """
+        Returns the last line if the output did not end with a newline.
+
+        :return:
+        """
+        last_line = self._partial_line + self._decoder.decode(b'', final=True)
+        self._partial_line = ''
+        return [last_line] if last_line else []
+
+
+def _read_chunks(fd: int, timeout: float=None, timeout_exc: Exception=None) -> Iterator[bytes]:
+    """
+    Yields large chunks read from a pipe as soon as they are available until the pipe hits EOF.
+
+    :param fd: The file descriptor of the pipe.
+    :param timeout: The number of seconds until all of the output must have been read.
+    :param timeout_exc: The exception raised when the timeout expires.
+    :return:
+    """
+    _set_nonblocking(fd)
+    deadline = None if timeout is None else time() + timeout
+    while True:
+        if deadline is None:
+            wait_read(fd)
+        else:
+            wait_read(fd, max(deadline - time(), 0), timeout_exc)
+
+        try:
+            chunk = os.read(fd, READ_CHUNK_SIZE)
+        except BlockingIOError:
+            continue
+
+        if not chunk:
+            return
+        yield chunk
+
+
+def _stream_pipe(job, pipe, is_stderr: bool=False) -> None:
+    """
+    Streams one pipe of a running job line by line until it hits EOF.
+
+    :param job: A proc job object
+    :param pipe: The pipe file object (IE: process.stdout)
+    :param is_stderr: True if the pipe is the processes stderr.
+    :return:
+    """
+    decoder = LineDecoder()
+    for chunk in _read_chunks(pipe.fileno()):
+        job.output_bytes += len(chunk)
+        if job.silent:
+            continue
+        for line in decoder.decode(chunk):
+            job.run_output_func(line, is_stderr)
+
+    if not job.silent:
+        for line in decoder.flush():
+            job.run_output_func(line, is_stderr)
+
+
+def _read_job_output(job) -> None:
+    """
+    Spawns a reader greenlet for stdout and stderr of a running job and
+    waits for both pipes to hit EOF.
+
+    :param job: A proc job object
+    :return:
+    """
+    readers = [spawn(_stream_pipe, job, job.process.stdout),
+               spawn(_stream_pipe, job, job.process.stderr, True)]
+    joinall(readers, raise_error=True)
 
 
 class ProcJob(object):
@@ -71,7 +233,8 @@ class ProcJob(object):
                  lock_ids: List[str]=[],
                  silent: bool=False,
                  working_directory: str=None,
-                 is_shell=False):
+                 is_shell=False,
+                 priority: int=0):
         """
         Initializes a Process Job.
 
@@ -80,28 +243,38 @@ class ProcJob(object):
         :param func_output: The callback to run
         :param funcs_before: A List of function pointers to call before executing the process.
         :param funcs_after: A List of function pointers to call after process is done executing.
-        :param lock_ids: A list of ids that identifies the locking mechanisme for this process.
+        :param lock_ids: A list of ids or Lock objects that identifies the locking mechanisme for this process.
+                         Plain ids are exclusive locks.
         :param silent: If set to true, no output will be captured.
         :param working_directory: The working directory of where we want to run the command.
         :param is_shell: The boolean that controls whether or not we are executing the command using a shell.
+        :param priority: Jobs with a higher priority are started first.  Equal priorities run in FIFO order.
         """
         self.job_name = job_name
         self.job_id = str(uuid4())[-12:]
         self.process = None  # type: subprocess.Popen
+        self.pid = None  # type: int
+        self.holds_locks = False
+        self.queued_at = None  # type: datetime
+        self.started_at = None  # type: datetime
+        self.output_lines = 0
+        self.output_bytes = 0
+        self.task_timer = AnsibleTaskTimer()
         self.funcToOperateOnOuput = func_output
         self.runAfterComplete = funcs_after
         self.runBeforeComplete = funcs_before
         self.isProcRunning = False
         self.command = command
-        self.lock_ids = lock_ids
+        self.lock_ids = to_locks(lock_ids)  # type: List[Lock]
         self.silent = silent
         self.working_directory = working_directory
         self.is_shell = is_shell
+        self.priority = priority
 
     def __str__(self):
-        if self.process is not None:
+        if self.pid is not None:
             return "PID: %d Job: %s ID: %s Locked IDs: %s isProcRunning: %s isSilent: %s" % (
-                self.process.pid, self.job_name, self.job_id,
+                self.pid, self.job_name, self.job_id,
                 self.lock_ids, self.isProcRunning, self.silent)
         else:
             return ("Job: %s ID: %s Locked IPs: %s isProcRunning: %s isSilent: %s"
@@ -140,10 +313,7 @@ class ProcJob(object):
         if self.isProcRunning:
             return True
 
-        for ip in self.lock_ids:
-            if ip in LOCK_IDS:
-                return False
-        return True
+        return LOCKS.can_acquire(self.lock_ids)
 
     def run_process(self) -> None:
         """
@@ -172,9 +342,11 @@ class ProcJob(object):
                                                 stderr=subprocess.PIPE,
                                                 cwd=self.working_directory,
                                                 env=my_env)
-            for ip in self.lock_ids:
-                LOCK_IDS[ip] = True
-            logger.debug("IP_ADDRESS_LOCK size after add: %d" % len(LOCK_IDS))
+            self.pid = self.process.pid
+            self.started_at = datetime.utcnow()
+            LOCKS.acquire(self.lock_ids)
+            self.holds_locks = True
+            logger.debug("IP_ADDRESS_LOCK size after add: %d" % len(LOCKS))
 
     def kill_myself(self, index: int) -> None:
         """
@@ -205,90 +377,195 @@ class ProcJob(object):
         for func in self.runAfterComplete:
             func()
 
-    def run_output_func(self, msg: bytes, is_stderr=False) -> None:
+    def run_output_func(self, line: str, is_stderr=False) -> None:
         """
-        Passes a message to the output function.
+        Passes a single line of output to the output function.
 
-        :param msg:
+        :param line: A complete line of output without its trailing newline.
+        :param is_stderr: True if the line came from stderr.
         :return:
         """
+        self.output_lines += 1
+        self.task_timer.feed(line)
         if self.funcToOperateOnOuput is None:
             return
 
-        lines = msg.decode("utf-8").split('\n')
         if is_stderr:
-            for line in lines:
-                self.funcToOperateOnOuput(self.job_name, self.job_id, line, 'red')
+            self.funcToOperateOnOuput(self.job_name, self.job_id, line, 'red')
         else:
-            for line in lines:
-                self.funcToOperateOnOuput(self.job_name, self.job_id, line)
+            self.funcToOperateOnOuput(self.job_name, self.job_id, line)
+
+    def to_document(self) -> Dict:
+        """
+        Returns the mongo document that persists the job.
 
-    def run_job_clean_up(self, index: int):
+        :return:
+        """
+        return {"_id": self.job_id,
+                "job_name": self.job_name,
+                "command": redact_command(self.command),
+                "working_directory": self.working_directory,
+                "is_shell": self.is_shell,
+                "silent": self.silent,
+                "priority": self.priority,
+                "locks": [{"lock_id": lock.lock_id, "mode": lock.mode} for lock in self.lock_ids],
+                "output_func": _func_path(self.funcToOperateOnOuput) if self.funcToOperateOnOuput else None,
+                "funcs_before": [_func_path(func) for func in self.runBeforeComplete],
+                "funcs_after": [_func_path(func) for func in self.runAfterComplete]}
+
+    @classmethod
+    def from_document(cls, doc: Dict) -> 'ProcJob':
         """
-        Cleans up the job queue and locks that the job had.
+        Recreates a job from its mongo document.  The root password of the command is
+        read from the kickstart form again.
 
-        :param index:
+        :param doc: The document returned by to_document.
         :return:
         """
-        while True:
-            if _async_read2(self):
-                break
+        job = cls(doc["job_name"], _unredact_command(doc["command"]),
+                  _load_func(doc["output_func"]) if doc["output_func"] else None,
+                  [_load_func(path) for path in doc["funcs_before"] if path],
+                  [_load_func(path) for path in doc["funcs_after"] if path],
+                  [Lock(lock["lock_id"], lock["mode"]) for lock in doc["locks"]],
+                  doc["silent"], doc["working_directory"], doc["is_shell"], doc["priority"])
+        job.job_id = doc["_id"]
+        job.queued_at = doc.get("queued_at")
+        job.started_at = doc.get("started_at")
+        return job
+
+    def run_job_clean_up(self):
+        """
+        Cleans up the job queue and locks that the job had and then
+        wakes up the scheduler so that blocked jobs get a chance to run.
 
-        JOB_QUEUE.pop(index)
-        for ip in self.lock_ids:
-            LOCK_IDS.pop(ip, None)
+        :return:
+        """
+        if self in JOB_QUEUE:
+            JOB_QUEUE.remove(self)
+        if self.holds_locks:
+            LOCKS.release(self.lock_ids)
+            self.holds_locks = False
 
         logger.debug("QUEUE size after pop: %d" % len(JOB_QUEUE))
-        logger.debug("IP_ADDRESS_LOCK size after pop: %d" % len(LOCK_IDS))
+        logger.debug("IP_ADDRESS_LOCK size after pop: %d" % len(LOCKS))
+        SCHEDULER_EVENT.set()
 
 
-def _async_read(fd):
-    # set non-blocking flag while preserving old flags
-    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-    # read char until EOF hit
-    while True:
+def _popen(command: str, working_dir: str, use_shell: bool, merge_stderr: bool) -> subprocess.Popen:
+    """
+    Starts the process of a shell command.
+
+    :return:
+    """
+    command_to_run = command if use_shell else shlex.split(command)
+    return subprocess.Popen(command_to_run,
+                            shell=use_shell,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT if merge_stderr else None,
+                            cwd=working_dir)
+
+
+def _kill_on_client_disconnect(proc: subprocess.Popen) -> Greenlet:
+    """
+    Kills the process if the HTTP client that we are running the command for goes away.
+
+    :param proc: The process to kill.
+    :return: The watching greenlet or None if we are not serving a request under gunicorn.
+    """
+    if not has_request_context():
+        return None
+
+    client_socket = request.environ.get('gunicorn.socket')
+    if client_socket is None:
+        return None
+
+    def watch_client():
+        wait_read(client_socket.fileno())
         try:
-            sleep(0.1)
-            ch = os.read(fd.fileno(), 1024)
-            # EOF
-            if not ch:
-                break
-            sys.stdout.write(ch.decode("utf-8"))
+            is_closed = client_socket.recv(1, socket.MSG_PEEK) == b''
         except OSError:
-            # waiting for data be available on fd
-            pass
+            is_closed = True
+
+        if is_closed and proc.poll() is None:
+            logger.warn("Client disconnected, killing PID: %d" % proc.pid)
+            proc.kill()
 
+    return spawn(watch_client)
 
-def shell(command: str, async: bool=False, working_dir=None, use_shell=False) -> Tuple[bytes, bytes]:
+
+def _iter_output(command: str, working_dir: str, use_shell: bool, timeout: float,
+                 merge_stderr: bool=True) -> Iterator[bytes]:
     """
-    Runs a command and returns std out and stderr.
+    Runs a command and yields its output as it arrives.  The process is killed if it times out,
+    the HTTP client disconnects or the caller stops iterating early.
+
+    :return:
+    """
+    proc = _popen(command, working_dir, use_shell, merge_stderr)
+    client_watcher = _kill_on_client_disconnect(proc)
+    try:
+        for chunk in _read_chunks(proc.stdout.fileno(), timeout, ShellTimeoutError(command, timeout)):
+            yield chunk
+        proc.wait()
+    finally:
+        if client_watcher is not None:
+            client_watcher.kill()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+
+def shell(command: str, working_dir: str=None, use_shell: bool=False,
+          timeout: float=SHELL_TIMEOUT, max_output: int=SHELL_MAX_OUTPUT,
+          merge_stderr: bool=True) -> Tuple[bytes, bytes]:
+    """
+    Runs a command and returns std out and stderr.  Only the greenlet that called it
+    waits for the command.
 
     :param command: The command to be run.
-    :param async: If set to true the output is gathered will the process is running otherwise it blocks and return
+    :param working_dir: The working directory of where we want to run the command.
     :param use_shell: If set to true.  the command will be run as is without shlex module through the shell.
-    :return:
+    :param timeout: The command is killed and ShellTimeoutError is raised if it runs longer than this.
+    :param max_output: The number of bytes of output that are kept, the rest is thrown away.
+    :param merge_stderr: If set to true stderr is part of stdout, otherwise it goes to our stderr.
+    :return: The output and None as stderr is either merged into stdout or not captured.
     """
-    sout = None
-    serr = None
-    proc = None
+    chunks = []
+    output_size = 0
+    for chunk in _iter_output(command, working_dir, use_shell, timeout, merge_stderr):
+        if output_size < max_output:
+            chunks.append(chunk[:max_output - output_size])
+        output_size += len(chunk)
 
-    if use_shell:
-        if working_dir:
-            proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=working_dir)
-        else:    
-            proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    else:
-        if working_dir:
-            proc = subprocess.Popen(shlex.split(command), shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=working_dir)
-        else:    
-            proc = subprocess.Popen(shlex.split(command), shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if output_size > max_output:
+        logger.warn("Output of '%s' was truncated from %d to %d bytes." % (command, output_size, max_output))
+    return b''.join(chunks), None
 
-    if async:
-        _async_read(proc.stdout)
-    else:
-        sout, serr = proc.communicate()
-    return sout, serr
+
+def shell_lines(command: str, working_dir: str=None, use_shell: bool=False,
+                timeout: float=SHELL_TIMEOUT, merge_stderr: bool=True) -> Iterator[str]:
+    """
+    Runs a command and yields its output line by line as it arrives.
+
+    :param command: The command to be run.
+    :param working_dir: The working directory of where we want to run the command.
+    :param use_shell: If set to true.  the command will be run as is without shlex module through the shell.
+    :param timeout: The command is killed and ShellTimeoutError is raised if it runs longer than this.
+    :param merge_stderr: If set to true stderr is part of stdout, otherwise it goes to our stderr.
+    :return:
+    """
+    decoder = LineDecoder()
+    chunks = _iter_output(command, working_dir, use_shell, timeout, merge_stderr)
+    try:
+        for chunk in chunks:
+            for line in decoder.decode(chunk):
+                yield line
+    finally:
+        # Kills the process right away when the caller stops iterating early.
+        chunks.close()
+    for line in decoder.flush():
+        yield line
 
 
 def _log_queues() -> None:
@@ -300,16 +577,41 @@ def _log_queues() -> None:
     jobqueue_len = len(JOB_QUEUE)
     if jobqueue_len > 0:
         logger.info("JOB_QUEUE size: %d" % jobqueue_len)
-        logger.info("IP_ADDRESS_LOCK size: %d" % len(LOCK_IDS))
+        logger.info("IP_ADDRESS_LOCK size: %d" % len(LOCKS))
         for job in JOB_QUEUE:
             logger.debug(str(job))
 
 
+def _persist_job_state(job: ProcJob, state: str, **fields) -> None:
+    """
+    Records a state change of a job in the jobs collection.
+
+    :param job: A proc job object
+    :param state: One of the JOB_* states.
+    :param fields: Additional fields to set on the jobs document.
+    :return:
+    """
+    fields['state'] = state
+    conn_mng.mongo_jobs.update_one({"_id": job.job_id}, {"$set": fields})
+
+
 def _save_job(job: ProcJob, job_retval: int, message: str) -> None:
     """
     Saves a to the mongo database so that we can check it on the integration side.
+    The job document is kept as history once the job is done.
     :return:
     """
+    completed_at = datetime.utcnow()
+    metrics = {"output_lines": job.output_lines,
+               "output_bytes": job.output_bytes,
+               "tasks": job.task_timer.finish()}
+    if job.started_at is not None:
+        metrics["duration_seconds"] = (completed_at - job.started_at).total_seconds()
+        if job.queued_at is not None:
+            metrics["queue_wait_seconds"] = (job.started_at - job.queued_at).total_seconds()
+
+    _persist_job_state(job, JOB_SUCCEEDED if job_retval == 0 else JOB_FAILED,
+                       return_code=job_retval, message=message, completed_at=completed_at, **metrics)
     conn_mng.mongo_last_jobs.find_one_and_replace({"_id": job.job_name},
                                                   {"_id": job.job_name, 
                                                    "return_code": job_retval, 
@@ -318,60 +620,187 @@ def _save_job(job: ProcJob, job_retval: int, message: str) -> None:
                                                    upsert=True)  # type: InsertOneResult
 
 
+def _watch_job(job: ProcJob) -> None:
+    """
+    Greenlet that streams the output of a running job and waits for its process to exit.
+    The wait is handled by gevent's child watcher (SIGCHLD) so nothing is polled.
+
+    :param job: A proc job object that has already been started.
+    :return:
+    """
+    try:
+        _persist_job_state(job, JOB_RUNNING, pid=job.pid, started_at=job.started_at,
+                           pid_create_time=psutil.Process(job.pid).create_time())
+    except Exception as e:
+        logger.exception(e)
+
+    try:
+        _read_job_output(job)
+        job_retval = job.process.wait()
+        logger.debug("Completed: %s" % str(job))
+        if job_retval != 0:
+            logger.debug("Job return value was not 0. It was %d" % int(job_retval))
+            _save_job(job, job_retval, "Failed to execute with unknown error.")
+        else:
+            _save_job(job, job_retval, "Successfully executed job.")
+
+        job.run_funcs_after_proc_completion()
+    except Exception as e:
+        logger.exception(e)
+        # The process must not keep running once its locks are released.
+        if job.process.poll() is None:
+            job.process.kill()
+            job.process.wait()
+        _save_job(job, 500, str(e))
+    finally:
+        job.run_job_clean_up()
+
+
+def _find_job_process(doc: Dict) -> psutil.Process:
+    """
+    Finds the still running process of a persisted job.
+
+    :param doc: The jobs document.
+    :return: The process or None if the process is gone or the pid was reused.
+    """
+    try:
+        proc = psutil.Process(doc["pid"])
+        if proc.create_time() != doc.get("pid_create_time") or proc.status() == psutil.STATUS_ZOMBIE:
+            return None
+        return proc
+    except (psutil.Error, KeyError, TypeError):
+        return None
+
+
+def _kill_orphaned_process(proc: psutil.Process) -> None:
+    """
+    Kills the process of a job that was running when the backend stopped and its children.
+
+    :param proc: The process returned by _find_job_process.
+    :return:
+    """
+    try:
+        procs = proc.children(recursive=True) + [proc]
+    except psutil.NoSuchProcess:
+        return
+
+    for orphan in procs:
+        try:
+            orphan.kill()
+        except psutil.NoSuchProcess:
+            pass
+    psutil.wait_procs(procs, timeout=ORPHAN_KILL_TIMEOUT)
+
+
+def setup_job_collection() -> None:
+    """
+    Creates the index that finds the unfinished jobs on startup and the TTL index that
+    removes finished jobs after JOB_RETENTION_SECONDS.  If the TTL index exists with a
+    different TTL it is changed to the configured one.
+
+    :return:
+    """
+    conn_mng.mongo_jobs.create_index([('state', pymongo.ASCENDING), ('queued_at', pymongo.ASCENDING)])
+    try:
+        conn_mng.mongo_jobs.create_index('completed_at', expireAfterSeconds=JOB_RETENTION_SECONDS)
+    except OperationFailure:
+        conn_mng.mongo_database.command('collMod', conn_mng.mongo_jobs.name,
+                                        index={'keyPattern': {'completed_at': 1},
+                                               'expireAfterSeconds': JOB_RETENTION_SECONDS})
+
+
+def _restore_jobs() -> None:
+    """
+    Restores the jobs that were queued or running when the backend stopped.  Queued jobs
+    are put back on the queue and running jobs are marked failed.
+
+    A running job cannot be reattached.  Its output went to pipes of the old backend
+    process so it dies of SIGPIPE the next time it writes, and its return code is lost.
+    So a process that is still alive is killed before its locks can be given to other
+    jobs and the functions the job runs after its process completes are not run.
+
+    :return:
+    """
+    docs = conn_mng.mongo_jobs.find({"state": {"$in": [JOB_QUEUED, JOB_RUNNING]}}).sort("queued_at", pymongo.ASCENDING)
+    for doc in docs:
+        try:
+            job = ProcJob.from_document(doc)
+        except Exception as e:
+            logger.exception(e)
+            conn_mng.mongo_jobs.update_one({"_id": doc["_id"]}, {"$set": {"state": JOB_FAILED,
+                                                                          "return_code": 500,
+                                                                          "message": str(e)}})
+            continue
+
+        if doc["state"] == JOB_RUNNING:
+            proc = _find_job_process(doc)
+            if proc is not None:
+                logger.warn("Killing PID: %d of %s, it was orphaned by a backend restart." % (proc.pid, str(job)))
+                _kill_orphaned_process(proc)
+            _save_job(job, UNKNOWN_RETVAL, "The backend restarted while the job was running.")
+            continue
+
+        JOB_QUEUE.append(job)
+    SCHEDULER_EVENT.set()
+
+
+def _start_runnable_jobs() -> None:
+    """
+    Starts every queued job whose locks are free. Each started job
+    gets its own greenlet that watches it until completion.
+
+    Jobs are visited by priority and then in FIFO order.  A waiting job reserves its
+    locks so that later jobs cannot keep taking them and starve it.
+
+    :return:
+    """
+    waiting_locks = []  # type: List[Lock]
+    for job in sorted(JOB_QUEUE, key=lambda queued_job: -queued_job.priority):
+        if job.isProcRunning:
+            continue
+
+        if not job.is_runnable() or LOCKS.conflicts(job.lock_ids, waiting_locks):
+            waiting_locks.extend(job.lock_ids)
+            continue
+
+        try:
+            job.run_funcs_before_proc_completion()
+            job.run_process()
+        except Exception as e:
+            logger.exception(e)
+            _save_job(job, 500, str(e))
+            job.run_job_clean_up()
+            continue
+        spawn(_watch_job, job)
+
+
 def _spawn_jobqueue() -> None:
     """
     Spawns a job queue:
 
+    The scheduler sleeps until SCHEDULER_EVENT is set by spawn_job or by
+    a job cleaning up after itself.
+
     :return:
     """
     logger.info("Starting job queue!")
-    future_time = datetime.utcnow() + timedelta(seconds=10)
     while True:
-        if len(JOB_QUEUE) == 0:
-            # logger.debug("Sleeping one second")
-            sleep(1)
-
-        if future_time <= datetime.utcnow():
-            future_time = datetime.utcnow() + timedelta(seconds=15)
-            _log_queues()
-
-        for index, job in enumerate(JOB_QUEUE):
-            try:
-                if not job.is_runnable():
-                    continue
-
-                job.run_funcs_before_proc_completion()
-                job.run_process()
-                # Periodically check the queue for messages and print them.
-                _async_read2(job)
-                job_retval = job.process.poll()
-                if job_retval != None or not job.is_pid():
-                    logger.debug("Completed: %s" % str(job))
-                    if job_retval != 0:
-                        logger.debug("Job return value was not 0. It was %d" % int(job_retval))
-                        _save_job(job, job_retval, "Failed to execute with unknown error.")
-                    else:
-                        _save_job(job, job_retval, "Successfully executed job.")
-                    
-                    job.run_funcs_after_proc_completion()
-                    job.run_job_clean_up(index)
-                elif job.is_zombie():
-                    logger.warn("ZOMBIE process cleanup %s" % str(job))
-                    _save_job(job, 600, "Job became a zombie somehow.")
-                    job.run_job_clean_up(index)
-                    # Clean zombie has to happen after we garbage collect the popen object
-            except Exception as e:
-                logger.exception(e)
-                _save_job(job, 500, str(e.message))
-                job.run_job_clean_up(index)
+        SCHEDULER_EVENT.wait()
+        SCHEDULER_EVENT.clear()
+        _log_queues()
+        _start_runnable_jobs()
 
 
 def start_job_manager() -> None:
     """
-    Starts the main job manager thread for the backend system.
+    Starts the main job manager thread for the backend system after restoring
+    the jobs that survived a restart.
 
     :return:
     """
+    setup_job_collection()
+    setup_job_history()
+    _restore_jobs()
     job_thread = socketio.start_background_task(target=_spawn_jobqueue)  # type: Thread
     job_thread.start()
 
@@ -383,26 +812,35 @@ def spawn_job(job_name: str, command: str,
               funcs_after: List[Callable]=[],
               silent=False,
               working_directory: str=None,
-              is_shell: bool=False) -> None:
+              is_shell: bool=False,
+              priority: int=0) -> None:
     """
     The main method to call when spawning a new Job. It will instantiate
     a ProcJob object with the appropriate locks and then populate the queue.
 
     :param job_name: The name of the job
     :param command: The command to be run
-    :param lock_ids: A list of ids that identifies the locking mechanism for this process.
+    :param lock_ids: A list of ids or Lock objects that identifies the locking mechanism for this process.
+                     Plain ids are exclusive locks.
     :param output_func: The callback to run for process output.
     :param funcs_before: A List of function pointers to call before the process is executed.
     :param funcs_after: A List of function pointers to call after process is done executing.
     :param silent: If set to true, no output will be captured.
     :param working_directory: The working directory of where we want to run the command.
+    :param is_shell: The boolean that controls whether or not we are executing the command using a shell.
+    :param priority: Jobs with a higher priority are started first.
     :return:
     """
-    logger.info("Spawning %s %s" % (job_name, command))
+    logger.info("Spawning %s %s" % (job_name, redact_command(command)))
     job = ProcJob(job_name, command, output_func, funcs_before,
-                  funcs_after, lock_ids, silent, working_directory, is_shell)
+                  funcs_after, lock_ids, silent, working_directory, is_shell, priority)
+    job.queued_at = datetime.utcnow()
+    doc = job.to_document()
+    doc.update({"state": JOB_QUEUED, "queued_at": job.queued_at})
+    conn_mng.mongo_jobs.insert_one(doc)
     JOB_QUEUE.append(job)
     logger.debug("QUEUE size after add: %d" % len(JOB_QUEUE))
+    SCHEDULER_EVENT.set()
 
 
 def kill_job_in_queue(job_name: str) -> None:
@@ -426,6 +864,6 @@ def get_running_jobs() -> List:
     json_doc = []
     for job in JOB_QUEUE:
         if job.funcToOperateOnOuput != None:
-            json_doc.append({"jobID": job.job_id, "jobName": job.job_name, "cmd": job.command})
+            json_doc.append({"jobID": job.job_id, "jobName": job.job_name, "cmd": redact_command(job.command)})
 
     return json_doc
@@ -5,31 +5,39 @@ import json
 
 from app import (app, logger, conn_mng)
 from app.archive_controller import archive_form
+from app.fact_cache import invalidate_fact_cache
+from app.host_scan import HostScanner, management_network, SCAN_BUDGET_SECONDS
 from app.inventory_generator import KickstartInventoryGenerator
-from app.job_manager import spawn_job, shell
+from app.job_manager import spawn_job, ANSIBLE_LOCK_ID
+from app.lock_manager import shared_lock
 from app.socket_service import log_to_console
 from app.common import OK_RESPONSE, ERROR_RESPONSE
 from flask import request, jsonify, Response
+from ipaddress import ip_address
 from pymongo.results import InsertOneResult
 from shared.constants import KICKSTART_ID
 from shared.utils import netmask_to_cidr, filter_ip, encode_password, decode_password
+from typing import List, Set
 
 
-def _is_valid_ip(ip_address: str) -> bool:
+def _get_invalid_ips(ip_addresses: List[str]) -> Set[str]:
     """
-    Ensures that the IP passed in is valid.
+    Finds the IPs passed in that are malformed or already used by a host on the network.
+    The IPs are probed concurrently.
 
-    :param ip_address: Some ip address (IE: 192.168.1.1).
+    :param ip_addresses: Some ip addresses (IE: ['192.168.1.1', '192.168.1.2']).
 
-    :return:
+    :return: The ip addresses that are malformed or answered.
     """
-    command = "nmap -v -sn -n %s/32 -oG - | awk '/Status: Down/{print $2}'" % ip_address
-    stdout_str, stderr_str = shell(command, use_shell=True)
-    if stdout_str != b'':
-        available_ip_addresses = stdout_str.decode("utf-8").split('\n')
-        if len(available_ip_addresses) > 0:            
-            return True        
-    return False
+    well_formed_ips = []
+    invalid_ips = set()
+    for ip in ip_addresses:
+        try:
+            ip_address(ip)
+            well_formed_ips.append(ip)
+        except ValueError:
+            invalid_ips.add(ip)
+    return invalid_ips | HostScanner().live_hosts(well_formed_ips, SCAN_BUDGET_SECONDS)
 
 
 @app.route('/api/generate_kickstart_inventory', methods=['POST'])
@@ -41,10 +49,8 @@ def generate_kickstart_inventory() -> Response:
     :return:
     """
     payload = request.get_json()
-    invalid_ips = []
-    for node in payload["nodes"]:
-        if not _is_valid_ip(node["ip_address"]):
-            invalid_ips.append(node["ip_address"])
+    invalid_ip_set = _get_invalid_ips([node["ip_address"] for node in payload["nodes"]])
+    invalid_ips = [node["ip_address"] for node in payload["nodes"] if node["ip_address"] in invalid_ip_set]
 
     invalid_ips_len = len(invalid_ips)
     if invalid_ips_len > 0:
@@ -70,8 +76,9 @@ def generate_kickstart_inventory() -> Response:
 
     spawn_job("Kickstart",
               "make",
-              ["kickstart"],
+              ["kickstart", shared_lock(ANSIBLE_LOCK_ID)],
               log_to_console,
+              funcs_after=[invalidate_fact_cache],
               working_directory="/opt/rock-deployer/playbooks")
     return OK_RESPONSE
 
@@ -102,12 +109,13 @@ def get_unused_ip_addrs() -> Response:
     """
     payload = request.get_json()    
     cidr = netmask_to_cidr(payload['netmask'])    
-    if cidr <= 24:
-        command = "nmap -v -sn -n %s/24 -oG - | awk '/Status: Down/{print $2}'" % payload['mng_ip']
-    else:
-        command = "nmap -v -sn -n %s/%d -oG - | awk '/Status: Down/{print $2}'" % (payload['mng_ip'], cidr) 
-    
-    stdout_str, stderr_str = shell(command, use_shell=True)
-    available_ip_addresses = stdout_str.decode("utf-8").split('\n')
+    try:
+        network = management_network(payload['mng_ip'], cidr)
+    except ValueError as e:
+        logger.exception(e)
+        return jsonify([])
+
+    live_hosts = HostScanner().scan(network, SCAN_BUDGET_SECONDS)
+    available_ip_addresses = [str(ip) for ip in live_hosts.unused()]
     available_ip_addresses = [x for x in available_ip_addresses if not filter_ip(x)]
     return jsonify(available_ip_addresses)
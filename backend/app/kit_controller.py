@@ -7,15 +7,18 @@ import os
 from app import app, logger, conn_mng
 from app.archive_controller import archive_form
 from app.common import OK_RESPONSE
+from app.fact_cache import invalidate_fact_cache
 from app.inventory_generator import KitInventoryGenerator
-from app.job_manager import spawn_job
+from app.job_manager import spawn_job, ANSIBLE_LOCK_ID
+from app.lock_manager import exclusive_lock, shared_lock
+from app.portal_cache import refresh_portal_links
 from app.socket_service import log_to_console
 from bson import ObjectId
 from datetime import datetime
 from flask import request, Response, jsonify
 from pymongo.collection import ReturnDocument
 from shared.constants import KIT_ID, KICKSTART_ID
-from shared.connection_mngs import KUBEDIR, FabricConnectionManager
+from shared.connection_mngs import KUBEDIR, KUBERNETES_CLIENT, FabricConnectionManager
 from shared.utils import decode_password
 from typing import Dict, Tuple
 
@@ -44,13 +47,14 @@ def _delete_kubernetes_conf():
     """
     Delets the kubernetes file on disk so that the next time we connect
     using our Kubernenets in our connection_mng.py module. It will reset to 
-    a new configuration file.
+    a new configuration file.  The shared kubernetes client is dropped with it.
     
     :return: 
     """
     config_path = KUBEDIR + '/config'
     if os.path.exists(config_path) and os.path.isfile(config_path):
         os.remove(config_path)
+    KUBERNETES_CLIENT.invalidate()
 
 
 def _replace_kit_inventory(payload: Dict) -> Tuple[bool, str]:
@@ -155,8 +159,9 @@ def execute_kit_inventory() -> Response:
                               "ansible-playbook -i inventory.yml -e ansible_ssh_pass='" + root_password + "' grr-only.yml")
         spawn_job("Kit",
                 cmd_to_execute,
-                ["kit"],
+                [exclusive_lock("kit"), shared_lock(ANSIBLE_LOCK_ID)],
                 log_to_console,
+                funcs_after=[invalidate_fact_cache, refresh_portal_links],
                 working_directory="/opt/rock/playbooks")
         
         return OK_RESPONSE
@@ -176,18 +181,25 @@ def execute_add_node() -> Response:
     # logger.debug(json.dumps(payload, indent=4, sort_keys=True))
     isSucessful, root_password = _replace_kit_inventory(payload['kitForm'])
     if isSucessful:
+        job_names = []
         for nodeToAdd in payload['nodesToAdd']:
             cmd_to_execute = ("ansible-playbook -i inventory.yml -e ansible_ssh_pass='{playbook_pass}' -e node_to_add='{node}' -t preflight-add-node,disable-firewall,repos,update-networkmanager,update-dnsmasq-hosts,update-dns,yum-update,genkeys,preflight,common,vars-configmap site.yml; "
                             "ansible-playbook -i inventory.yml -e ansible_ssh_pass='{playbook_pass}' -e node_to_add='{node}' -t docker -l {node} site.yml; "
                             "ansible-playbook -i inventory.yml -e ansible_ssh_pass='{playbook_pass}' -e node_to_add='{node}' -t pull_join_script,kube-node,ceph,es-scale,kafka-scale,bro-scale,moloch-scale,enable-sensor-monitor-interface site.yml"
                             ).format(playbook_pass=root_password, node=nodeToAdd['hostname'])
-            spawn_job("Add_Node",
+            # Only the docker step is limited to the node, the other steps update dns, the vars
+            # configmap and scale the cluster services for the whole inventory.  So nodes are
+            # added one at a time, every node has its own job so their consoles and kills stay apart.
+            job_name = "Add_Node_" + nodeToAdd['hostname']
+            job_names.append(job_name)
+            spawn_job(job_name,
                     cmd_to_execute,
-                    ["kit"],
+                    [exclusive_lock("kit"), shared_lock(ANSIBLE_LOCK_ID)],
                     log_to_console,
+                    funcs_after=[refresh_portal_links],
                     working_directory="/opt/rock/playbooks",
                     is_shell=True)
-        return OK_RESPONSE
+        return jsonify({'job_names': job_names})
 
     logger.error("Executing add node configuration has failed.")
     return ERROR_RESPONSE
@@ -0,0 +1,250 @@
+"""
+Module that builds kubectl describe like output for pods and nodes straight from
+the kubernetes API, so describing an object does not need a new interpreter or an
+ssh session to the master server.
+"""
+from datetime import datetime, timezone
+from kubernetes import client
+from typing import Dict, List
+
+INDENT = '  '
+EPOCH = datetime.fromtimestamp(0, timezone.utc)
+
+
+def _age(timestamp: datetime) -> str:
+    """
+    Formats the time since a timestamp like kubectl does (IE: 5m, 3h, 2d).
+
+    :param timestamp: A timezone aware datetime.
+    :return:
+    """
+    if timestamp is None:
+        return '<unknown>'
+    seconds = int((datetime.now(timezone.utc) - timestamp).total_seconds())
+    if seconds < 120:
+        return '%ds' % max(seconds, 0)
+    if seconds < 2 * 60 * 60:
+        return '%dm' % (seconds // 60)
+    if seconds < 2 * 24 * 60 * 60:
+        return '%dh' % (seconds // (60 * 60))
+    return '%dd' % (seconds // (24 * 60 * 60))
+
+
+def _table(headers: List[str], rows: List[List], indent: str=INDENT) -> List[str]:
+    """
+    Formats rows as columns that are as wide as their widest value.
+
+    :param headers: The column names.
+    :param rows: The rows, each one has a value for every column.
+    :param indent: The indent of every line.
+    :return: The lines of the table.
+    """
+    rows = [headers, ['-' * len(header) for header in headers]] + [[str(value) for value in row] for row in rows]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(headers))]
+    return [indent + '  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+
+
+def _map_lines(title: str, values: Dict, width: int) -> List[str]:
+    """
+    Formats a dictionary like kubectl formats labels and annotations.
+
+    :param title: The name of the field (IE: Labels)
+    :param values: The dictionary.
+    :param width: The width of the field names.
+    :return:
+    """
+    title = (title + ':').ljust(width)
+    if not values:
+        return [title + '<none>']
+    items = ['%s=%s' % (key, value) for key, value in sorted(values.items())]
+    return [title + items[0]] + [' ' * width + item for item in items[1:]]
+
+
+def _field(title: str, value, width: int) -> str:
+    return (title + ':').ljust(width) + ('<none>' if value is None or value == '' else str(value))
+
+
+def _events_lines(events: List[Dict]) -> List[str]:
+    """
+    Formats the events of an object, the oldest first.
+
+    :param events: The dictionaries of the events.
+    :return:
+    """
+    if not events:
+        return ['Events:  <none>']
+
+    events = sorted(events, key=lambda event: (event.get('last_timestamp') or
+                                               event['metadata'].get('creation_timestamp') or EPOCH))
+    rows = []
+    for event in events:
+        age = _age(event.get('last_timestamp') or event['metadata'].get('creation_timestamp'))
+        if (event.get('count') or 1) > 1:
+            age = '%s (x%d over %s)' % (age, event['count'], _age(event.get('first_timestamp')))
+        source = (event.get('source') or {}).get('component') or ''
+        rows.append([event.get('type') or '', event.get('reason') or '', age, source,
+                     (event.get('message') or '').strip()])
+    return ['Events:'] + _table(['Type', 'Reason', 'Age', 'From', 'Message'], rows)
+
+
+def _container_state_lines(title: str, state: Dict, indent: str) -> List[str]:
+    if not state:
+        return []
+    for key, value in state.items():
+        if not value:
+            continue
+        lines = [indent + '%s: %s' % (title, key.capitalize())]
+        for field in ('reason', 'message', 'exit_code', 'started_at', 'finished_at'):
+            if value.get(field) is not None:
+                lines.append(indent + INDENT + '%s: %s' % (field.replace('_', ' ').title().replace(' ', ''), value[field]))
+        return lines
+    return []
+
+
+def _resources_lines(title: str, resources: Dict, indent: str) -> List[str]:
+    if not resources:
+        return []
+    return [indent + title + ':'] + [indent + INDENT + '%s: %s' % (key, value) for key, value in sorted(resources.items())]
+
+
+def _pod_container_lines(pod: Dict) -> List[str]:
+    statuses = {status['name']: status for status in (pod['status'].get('container_statuses') or [])}
+    lines = ['Containers:']
+    for container in pod['spec']['containers']:
+        status = statuses.get(container['name'], {})
+        indent = INDENT * 2
+        lines.append(INDENT + container['name'] + ':')
+        lines.append(indent + 'Container ID:  %s' % (status.get('container_id') or ''))
+        lines.append(indent + 'Image:         %s' % container.get('image'))
+        ports = ', '.join('%s/%s' % (port['container_port'], port.get('protocol') or 'TCP')
+                          for port in container.get('ports') or [])
+        lines.append(indent + 'Ports:         %s' % (ports or '<none>'))
+        lines.extend(_container_state_lines('State', status.get('state'), indent))
+        lines.extend(_container_state_lines('Last State', status.get('last_state'), indent))
+        lines.append(indent + 'Ready:         %s' % status.get('ready'))
+        lines.append(indent + 'Restart Count: %s' % status.get('restart_count', 0))
+        resources = container.get('resources') or {}
+        lines.extend(_resources_lines('Limits', resources.get('limits'), indent))
+        lines.extend(_resources_lines('Requests', resources.get('requests'), indent))
+        mounts = container.get('volume_mounts') or []
+        lines.append(indent + 'Mounts:' + ('' if mounts else ' <none>'))
+        for mount in mounts:
+            lines.append(indent + INDENT + '%s from %s (%s)' % (mount['mount_path'], mount['name'],
+                                                                'ro' if mount.get('read_only') else 'rw'))
+    return lines
+
+
+def describe_pod(kube_apiv1: client.CoreV1Api, pod_name: str, namespace: str) -> str:
+    """
+    Describes a pod and its events like 'kubectl describe pod'.
+
+    :param kube_apiv1: The kubernetes API handler.
+    :param pod_name: The name of the pod.
+    :param namespace: The namespace of the pod.
+    :return: The description.
+    """
+    pod = kube_apiv1.read_namespaced_pod(pod_name, namespace).to_dict()
+    events = kube_apiv1.list_namespaced_event(
+        namespace, field_selector='involvedObject.kind=Pod,involvedObject.name=%s' % pod_name).to_dict()['items']
+
+    metadata, spec, status = pod['metadata'], pod['spec'], pod['status']
+    width = 16
+    lines = [_field('Name', metadata['name'], width),
+             _field('Namespace', metadata['namespace'], width),
+             _field('Node', '%s/%s' % (spec.get('node_name'), status.get('host_ip')) if spec.get('node_name') else None,
+                    width),
+             _field('Start Time', status.get('start_time'), width)]
+    lines.extend(_map_lines('Labels', metadata.get('labels'), width))
+    lines.extend(_map_lines('Annotations', metadata.get('annotations'), width))
+    lines.append(_field('Status', status.get('phase'), width))
+    if status.get('reason'):
+        lines.append(_field('Reason', status['reason'], width))
+    if status.get('message'):
+        lines.append(_field('Message', status['message'], width))
+    lines.append(_field('IP', status.get('pod_ip'), width))
+    for owner in metadata.get('owner_references') or []:
+        if owner.get('controller'):
+            lines.append(_field('Controlled By', '%s/%s' % (owner['kind'], owner['name']), width))
+    lines.extend(_pod_container_lines(pod))
+
+    lines.append('Conditions:')
+    lines.extend(_table(['Type', 'Status'], [[condition['type'], condition['status']]
+                                             for condition in status.get('conditions') or []]))
+    lines.append('Volumes:' + ('' if spec.get('volumes') else '  <none>'))
+    for volume in spec.get('volumes') or []:
+        kinds = [key for key, value in volume.items() if key != 'name' and value]
+        lines.append(INDENT + '%s:' % volume['name'])
+        lines.append(INDENT * 2 + 'Type: %s' % (', '.join(kinds) or '<unknown>'))
+    lines.append(_field('QoS Class', status.get('qos_class'), width))
+    lines.extend(_map_lines('Node-Selectors', spec.get('node_selector'), width))
+    tolerations = ['%s:%s op=%s for %ss' % (toleration.get('key'), toleration.get('effect'), toleration.get('operator'),
+                                            toleration.get('toleration_seconds'))
+                   if toleration.get('toleration_seconds') is not None else
+                   '%s:%s' % (toleration.get('key'), toleration.get('effect'))
+                   for toleration in spec.get('tolerations') or []]
+    lines.append(_field('Tolerations', '\n'.join(' ' * width + toleration for toleration in tolerations).strip(), width))
+    lines.extend(_events_lines(events))
+    return '\n'.join(lines) + '\n'
+
+
+def describe_node(kube_apiv1: client.CoreV1Api, node_name: str) -> str:
+    """
+    Describes a node, the pods running on it and its events like 'kubectl describe node'.
+
+    :param kube_apiv1: The kubernetes API handler.
+    :param node_name: The name of the node.
+    :return: The description.
+    """
+    node = kube_apiv1.read_node(node_name).to_dict()
+    pods = kube_apiv1.list_pod_for_all_namespaces(
+        field_selector='spec.nodeName=%s,status.phase!=Succeeded,status.phase!=Failed' % node_name).to_dict()['items']
+    events = kube_apiv1.list_event_for_all_namespaces(
+        field_selector='involvedObject.kind=Node,involvedObject.name=%s' % node_name).to_dict()['items']
+
+    metadata, spec, status = node['metadata'], node['spec'], node['status']
+    labels = metadata.get('labels') or {}
+    roles = [label.split('/', 1)[1] for label in labels if label.startswith('node-role.kubernetes.io/')]
+    width = 19
+    lines = [_field('Name', metadata['name'], width),
+             _field('Roles', ','.join(sorted(roles)), width)]
+    lines.extend(_map_lines('Labels', labels, width))
+    lines.extend(_map_lines('Annotations', metadata.get('annotations'), width))
+    lines.append(_field('CreationTimestamp', metadata.get('creation_timestamp'), width))
+    taints = ['%s=%s:%s' % (taint['key'], taint['value'], taint['effect']) if taint.get('value') else
+              '%s:%s' % (taint['key'], taint['effect'])
+              for taint in spec.get('taints') or []]
+    lines.append(_field('Taints', ', '.join(taints), width))
+    lines.append(_field('Unschedulable', bool(spec.get('unschedulable')), width))
+
+    lines.append('Conditions:')
+    lines.extend(_table(['Type', 'Status', 'LastHeartbeatTime', 'LastTransitionTime', 'Reason', 'Message'],
+                        [[condition['type'], condition['status'], condition.get('last_heartbeat_time'),
+                          condition.get('last_transition_time'), condition.get('reason') or '',
+                          condition.get('message') or '']
+                         for condition in status.get('conditions') or []]))
+    lines.append('Addresses:')
+    lines.extend(INDENT + '%s: %s' % (address['type'], address['address']) for address in status.get('addresses') or [])
+    lines.extend(_resources_lines('Capacity', status.get('capacity'), ''))
+    lines.extend(_resources_lines('Allocatable', status.get('allocatable'), ''))
+    lines.append('System Info:')
+    for key, value in sorted((status.get('node_info') or {}).items()):
+        lines.append(INDENT + '%s: %s' % (key.replace('_', ' ').title().replace(' ', ''), value))
+    lines.append(_field('PodCIDR', spec.get('pod_cidr'), width))
+
+    rows = []
+    for pod in pods:
+        requests, limits = {}, {}
+        for container in pod['spec']['containers']:
+            resources = container.get('resources') or {}
+            for key in ('cpu', 'memory'):
+                if (resources.get('requests') or {}).get(key):
+                    requests.setdefault(key, []).append(resources['requests'][key])
+                if (resources.get('limits') or {}).get(key):
+                    limits.setdefault(key, []).append(resources['limits'][key])
+        rows.append([pod['metadata']['namespace'], pod['metadata']['name'],
+                     '+'.join(requests.get('cpu', ['0'])), '+'.join(limits.get('cpu', ['0'])),
+                     '+'.join(requests.get('memory', ['0'])), '+'.join(limits.get('memory', ['0']))])
+    lines.append('Non-terminated Pods:  (%d in total)' % len(pods))
+    lines.extend(_table(['Namespace', 'Name', 'CPU Requests', 'CPU Limits', 'Memory Requests', 'Memory Limits'], rows))
+    lines.extend(_events_lines(events))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,134 @@
+"""
+Module that manages the locks jobs need before they are allowed to run.
+
+A lock is held in either shared or exclusive mode.  A lock that has a limit
+set works as a counted semaphore, at most limit jobs can hold it at once.
+"""
+from typing import Dict, List
+
+EXCLUSIVE = 'exclusive'
+SHARED = 'shared'
+
+
+class Lock(object):
+    """
+    A lock that a job needs in order to run.
+
+    Attributes:
+        lock_id (str): The id of the locked resource (EX: kit)
+        mode (str): Either SHARED or EXCLUSIVE
+    """
+
+    def __init__(self, lock_id: str, mode: str=EXCLUSIVE):
+        if mode not in (SHARED, EXCLUSIVE):
+            raise ValueError("%s is not a valid lock mode." % mode)
+        self.lock_id = lock_id
+        self.mode = mode
+
+    def __repr__(self):
+        return "%s(%s)" % (self.mode, self.lock_id)
+
+
+def exclusive_lock(lock_id: str) -> Lock:
+    return Lock(lock_id, EXCLUSIVE)
+
+
+def shared_lock(lock_id: str) -> Lock:
+    return Lock(lock_id, SHARED)
+
+
+def to_locks(lock_ids: List) -> List[Lock]:
+    """
+    Converts a list of lock ids to Lock objects.  Plain string ids are exclusive locks.
+
+    :param lock_ids: A list of strings or Lock objects.
+    :return:
+    """
+    return [lock if isinstance(lock, Lock) else exclusive_lock(lock) for lock in lock_ids]
+
+
+class LockManager(object):
+    """
+    Keeps track of the locks held by running jobs.
+    """
+
+    def __init__(self):
+        self._shared_holders = {}  # type: Dict[str, int]
+        self._exclusive_holders = set()
+        self._limits = {}  # type: Dict[str, int]
+
+    def set_limit(self, lock_id: str, limit: int) -> None:
+        """
+        Turns a lock into a counted semaphore that at most limit jobs can hold in shared mode.
+
+        :param lock_id: The id of the lock
+        :param limit: The maximum number of shared holders.
+        :return:
+        """
+        self._limits[lock_id] = limit
+
+    def _can_acquire_lock(self, lock: Lock) -> bool:
+        if lock.lock_id in self._exclusive_holders:
+            return False
+
+        shared_count = self._shared_holders.get(lock.lock_id, 0)
+        if lock.mode == EXCLUSIVE:
+            return shared_count == 0
+        return shared_count < self._limits.get(lock.lock_id, shared_count + 1)
+
+    def can_acquire(self, locks: List[Lock]) -> bool:
+        """
+        Checks if all of the locks can be acquired right now.
+
+        :param locks: A list of Lock objects.
+        :return:
+        """
+        return all(self._can_acquire_lock(lock) for lock in locks)
+
+    def conflicts(self, locks: List[Lock], other_locks: List[Lock]) -> bool:
+        """
+        Checks if two lists of locks compete for the same resource.  Two shared locks only
+        compete if the lock is a counted semaphore.
+
+        :param locks: A list of Lock objects.
+        :param other_locks: A list of Lock objects.
+        :return:
+        """
+        for lock in locks:
+            for other in other_locks:
+                if lock.lock_id != other.lock_id:
+                    continue
+                if EXCLUSIVE in (lock.mode, other.mode) or lock.lock_id in self._limits:
+                    return True
+        return False
+
+    def acquire(self, locks: List[Lock]) -> None:
+        """
+        Acquires all of the locks.  Call can_acquire first.
+
+        :param locks: A list of Lock objects.
+        :return:
+        """
+        for lock in locks:
+            if lock.mode == EXCLUSIVE:
+                self._exclusive_holders.add(lock.lock_id)
+            else:
+                self._shared_holders[lock.lock_id] = self._shared_holders.get(lock.lock_id, 0) + 1
+
+    def release(self, locks: List[Lock]) -> None:
+        """
+        Releases all of the locks.
+
+        :param locks: A list of Lock objects.
+        :return:
+        """
+        for lock in locks:
+            if lock.mode == EXCLUSIVE:
+                self._exclusive_holders.discard(lock.lock_id)
+            elif self._shared_holders.get(lock.lock_id, 0) > 1:
+                self._shared_holders[lock.lock_id] -= 1
+            else:
+                self._shared_holders.pop(lock.lock_id, None)
+
+    def __len__(self) -> int:
+        return len(self._exclusive_holders) + len(self._shared_holders)
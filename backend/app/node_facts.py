@@ -6,7 +6,24 @@ data to Node objects.
 """
 import json
 import os
-from typing import Dict, List
+import re
+import shutil
+import tempfile
+from app.fact_cache import cache_facts, get_cached_facts
+from app.job_manager import shell_lines, ShellTimeoutError
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+ANSIBLE_SETUP_TIMEOUT = 300  # seconds
+ANSIBLE_SETUP_FORKS = 25
+HOST_RESULT_HEADER = re.compile(r'^(\S+) \| (SUCCESS|CHANGED|UNREACHABLE!|FAILED!)')
+FACTS_OK = 'ok'
+FACTS_FAILED = 'failed'
+FACTS_UNREACHABLE = 'unreachable'
+# Do not return interfaces with veth, cni, docker or flannel
+EXCLUDED_INTERFACES = ("veth", "cni", "docker", "flannel", "virbr0", "lo")
+ROOT_MOUNTS = ("/", "/boot")
+
 
 class Interface(object):
     """
@@ -19,6 +36,7 @@ class Interface(object):
         mac_address (str): Mac address of interface not all interfaces have a mac address
 
     """
+    __slots__ = ('name', 'ip_address', 'mac_address', 'speed')
 
     def __init__(self, name, ip_address, mac_address, speed):
         self.name = name
@@ -34,6 +52,9 @@ class Interface(object):
         """
         return "Interface: %s Ip: %s Mac: %s Speed: %d" % (self.name, self.ip_address, self.mac_address, self.speed)
 
+    def to_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
 
 class Disk(object):
     """
@@ -46,6 +67,7 @@ class Disk(object):
         size_tb (float): Size of storage device in TB
         hasRoot (bool): Flag indicating whether or not a disk has the root of a filesystem present
     """
+    __slots__ = ('name', 'hasRoot', 'size_gb', 'size_tb')
 
     def __init__(self, name: str):
         """
@@ -88,6 +110,45 @@ class Disk(object):
         return "Disk: %s Size GB: %.2f Size TB: %.2f  HasRoot: %r" % (
                 self.name, self.size_gb, self.size_tb, self.hasRoot)
 
+    def to_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+# The ansible setup subsets and facts that Node consumes.  Facts are only gathered from
+# these subsets and everything else is dropped before the facts are parsed into a Node.
+NODE_GATHER_SUBSETS = ('!all', 'hardware', 'network')
+NODE_FACT_KEYS = ('ansible_devices', 'ansible_device_links', 'ansible_interfaces', 'ansible_mounts',
+                  'ansible_memory_mb', 'ansible_processor_vcpus', 'ansible_fqdn')
+
+
+def interface_fact_key(interface_name: str) -> str:
+    """
+    Gets the name of the fact that describes an interface.  Ansible replaces
+    dashes with underscores in fact names.
+
+    :param interface_name: The name of the interface (IE: eth0)
+    :return:
+    """
+    return "ansible_" + interface_name.replace('-', '_')
+
+
+def select_node_facts(json_object: Dict) -> Dict:
+    """
+    Drops every fact that Node does not consume from the ansible setup output.
+
+    :param json_object: python dictionary object from ansible setup module.
+    :return: A copy of the json object that only has the facts Node consumes.
+    """
+    if 'ansible_facts' not in json_object:
+        return json_object
+
+    ansible_facts = json_object['ansible_facts']
+    fact_keys = list(NODE_FACT_KEYS)
+    fact_keys.extend(interface_fact_key(name) for name in ansible_facts.get('ansible_interfaces', []))
+    selected = dict(json_object)
+    selected['ansible_facts'] = {key: ansible_facts[key] for key in fact_keys if key in ansible_facts}
+    return selected
+
 
 class Node(object):
     """
@@ -102,6 +163,7 @@ class Node(object):
         cpu_cores (int): Available CPU Cores
         disks (list): List of Disk Objects
     """
+    __slots__ = ('hostname', 'disks', 'interfaces', 'memory_mb', 'memory_gb', 'cpu_cores')
 
     def __init__(self, json_object: Dict=None):
         """
@@ -163,11 +225,11 @@ class Node(object):
         return "Hostname: %s\nInterface List:\n%s\nCPU Cores: %s\nMemory MB: %.2f\nMemory GB: %.2f\nDisk List:\n%s\n" % (
             self.hostname, p_interfaces, self.cpu_cores, self.memory_mb, self.memory_gb, p_disks)
 
-    def marshal(self):
-        node = self
-        setattr(node, 'interfaces', json.dumps([interface.__dict__ for interface in node.interfaces]))
-        setattr(node, 'disks', json.dumps([disk.__dict__ for disk in node.disks]))
-        return self.__dict__
+    def marshal(self) -> Dict:
+        node = {slot: getattr(self, slot) for slot in self.__slots__}
+        node['interfaces'] = json.dumps([interface.to_dict() for interface in self.interfaces])
+        node['disks'] = json.dumps([disk.to_dict() for disk in self.disks])
+        return node
 
     def _transform(self, json_object: Dict):
         """
@@ -177,98 +239,119 @@ class Node(object):
 
         :return: Node object as specified above
         """
+        ansible_facts = json_object['ansible_facts']
+
         # Get Disk
-        ansible_devices = json_object['ansible_facts']['ansible_devices']
-        disks = []
-        partition_links = {}
-        for i, k in ansible_devices.items():
+        ansible_devices = ansible_facts['ansible_devices']
+        disks_by_name = {}  # type: Dict[str, Disk]
+        # Maps a device to the devices it is built on.  A partition is built on its disk
+        # and a device mapper device (IE: lvm) is built on its slaves.
+        parent_devices = {}  # type: Dict[str, List[str]]
+        for name, device in ansible_devices.items():
             # We only want logical volume disks
-            if k['model'] != None and k['removable'] != "1":
-                disk = Disk(i)
-                disk.set_size(k['size'])
-                disks.append(disk)
-            for j in k['partitions']:
-                partition_links[j] = i
+            if device['model'] != None and device['removable'] != "1":
+                disk = Disk(name)
+                disk.set_size(device['size'])
+                disks_by_name[name] = disk
+            for partition in device['partitions']:
+                parent_devices.setdefault(partition, []).append(name)
+
         # Get Disk links
-        disk_links = {}
-        master_links = {}
-        for i in json_object['ansible_facts']['ansible_device_links']['uuids']:
-            for k in json_object['ansible_facts']['ansible_device_links']['uuids'][i]:
-                disk_links[k] = i
-
-        for i in json_object['ansible_facts']['ansible_device_links']['masters']:
-            for k in json_object['ansible_facts']['ansible_device_links']['masters'][i]:
-                master_links[k] = i
+        device_links = ansible_facts['ansible_device_links']
+        uuid_links = {}  # type: Dict[str, str]
+        for name, uuids in device_links['uuids'].items():
+            for uuid in uuids:
+                uuid_links[uuid] = name
+
+        for name, masters in device_links['masters'].items():
+            for master in masters:
+                parent_devices.setdefault(master, []).append(name)
+
         # Get Interfaces
         interfaces = []
-        for i in json_object['ansible_facts']['ansible_interfaces']:
-            ip = ""
-            mac = ""
-            # Do not return interfaces with veth, cni, docker or flannel
-            exclude = ["veth", "cni", "docker", "flannel", "virbr0", "lo"]
-            if not any([special in i for special in exclude]):
-                name = "ansible_" + i
-                interface = json_object['ansible_facts'][name]
-                speed = '0'
-                ip = ''
-                mac = ''
-                if 'ipv4' in interface:
-                    ip = interface['ipv4']['address']
-                if 'macaddress' in interface:
-                    mac = interface['macaddress']
-                if 'speed' in interface:
-                    speed = interface['speed']
-                if ip != "127.0.0.1":
-                    interfaces.append(Interface(i, ip, mac, speed))
-
-        # Determine location of root
-        for i in json_object['ansible_facts']['ansible_mounts']:
-            if i["mount"] == "/" or i["mount"] == "/boot":
-                # Use the established reverse dictionaries to get our partition
-                part_val = disk_links.get(i['uuid'])
-
-                found_disk = next((x for x in disks if x.name == part_val), None)
-                if found_disk is not None:
-                    found_disk.hasRoot = True
-
-                master_part_val = master_links.get(part_val)
-                top_part_val = partition_links.get(part_val)
-                found_disk = next((x for x in disks if x.name == top_part_val), None)
-                if found_disk is not None:
-                    found_disk.hasRoot = True
-                found_disk = next((x for x in disks if x.name == master_part_val), None)
-                if found_disk is not None:
-                    found_disk.hasRoot = True
-                top_part_val = partition_links.get(master_part_val)
-                found_disk = next((x for x in disks if x.name == top_part_val), None)
-                if found_disk is not None:
-                    found_disk.hasRoot = True
-
-        # Get Memory
-        memory = json_object['ansible_facts']['ansible_memory_mb']['real']['total']
-
-        # Get Cores
-        cores = json_object['ansible_facts']['ansible_processor_vcpus']
-
-        # Get FQDN
-        fqdn = json_object['ansible_facts']['ansible_fqdn']
+        for name in ansible_facts['ansible_interfaces']:
+            if any(special in name for special in EXCLUDED_INTERFACES):
+                continue
+            interface = ansible_facts[interface_fact_key(name)]
+            ip = ''
+            if 'ipv4' in interface:
+                ip = interface['ipv4']['address']
+            if ip != "127.0.0.1":
+                interfaces.append(Interface(name, ip, interface.get('macaddress', ''), interface.get('speed', '0')))
+
+        # Determine location of root by walking from the devices of the root mounts
+        # down to the disks they are built on.
+        pending = [uuid_links.get(mount['uuid']) for mount in ansible_facts['ansible_mounts']
+                   if mount["mount"] in ROOT_MOUNTS]
+        visited = set()
+        while pending:
+            name = pending.pop()
+            if name is None or name in visited:
+                continue
+            visited.add(name)
+            if name in disks_by_name:
+                disks_by_name[name].hasRoot = True
+            pending.extend(parent_devices.get(name, ()))
 
         # Create node object
-        self.hostname = fqdn
-        self.set_memory(memory)
+        self.hostname = ansible_facts['ansible_fqdn']
+        self.set_memory(ansible_facts['ansible_memory_mb']['real']['total'])
         self.set_interfaces(interfaces)
-        self.set_cpu_cores(cores)
-        self.set_disks(disks)        
+        self.set_cpu_cores(ansible_facts['ansible_processor_vcpus'])
+        self.set_disks(list(disks_by_name.values()))
 
 
-def ansible_setup(server_ip: str, password: str) -> Dict:
+class FactResult(object):
     """
-    Function opens ansible process to run setup on specified server and returns a json object
+    The result of gathering the facts of a single host.
 
-    :param server_ip: fully qualified domain name of server
-    :param password: password to server to create ansible ssh connection
+    Attributes:
+        host (str): The ip address or hostname the facts were gathered from.
+        status (str): FACTS_OK, FACTS_FAILED or FACTS_UNREACHABLE
+        facts (dict): The ansible setup json object, None if gathering failed.
+        node (Node): The Node built from the facts, None until it is built or if gathering failed.
+        error_message (str): Why gathering failed, None if it succeeded.
+    """
+    __slots__ = ('host', 'status', 'facts', 'node', 'error_message')
+
+    def __init__(self, host: str, status: str, facts: Dict=None, error_message: str=None):
+        self.host = host
+        self.status = status
+        self.facts = facts
+        self.node = None  # type: Node
+        self.error_message = error_message
+
+    @property
+    def ok(self) -> bool:
+        return self.status == FACTS_OK
+
+    @classmethod
+    def from_ansible(cls, host: str, json_object: Dict) -> 'FactResult':
+        """
+        Creates a result from the ansible output of a host.
+
+        :param host: The host the output belongs to.
+        :param json_object: The json object that ansible wrote for the host.
+        :return:
+        """
+        if json_object.get('unreachable') is True:
+            return cls(host, FACTS_UNREACHABLE, error_message="Error: " + json_object.get('msg', 'Host is unreachable.'))
+        if json_object.get('failed') is True:
+            return cls(host, FACTS_FAILED, error_message="Error: " + json_object.get('msg', 'Failed to gather facts.'))
+        return cls(host, FACTS_OK, facts=select_node_facts(json_object))
 
-    :return: Json object from ansible setup output
+    def __str__(self):
+        return "FactResult: %s Status: %s Error: %s" % (self.host, self.status, self.error_message)
+
+
+def _ansible_setup_command(server_ips: List[str], password: str, tree_dir: str) -> str:
+    """
+    Builds the ansible command that runs the setup module against the servers.
+
+    :param server_ips: The ip addresses of the servers
+    :param password: password to server to create ansible ssh connection
+    :param tree_dir: The directory ansible writes the json output of each server to.
+    :return:
     """
     # Disable ssh host key checking
     os.environ[
@@ -280,39 +363,148 @@ def ansible_setup(server_ip: str, password: str) -> Dict:
     if password.find("'") != -1:
         raise ValueError("The password you typed contained a single ' which is not allowed.")
 
-    ansible_string = "ansible all -m setup -e ansible_ssh_pass='" + password + "' -i " + server_ip + ","
-    if server_ip == "localhost" or server_ip == "127.0.0.1":
-        ansible_string = "ansible -m setup " + server_ip
+    setup_args = "-m setup -a 'gather_subset=%s' --one-line --tree %s" % (','.join(NODE_GATHER_SUBSETS), tree_dir)
+    if len(server_ips) == 1 and server_ips[0] in ("localhost", "127.0.0.1"):
+        return "ansible %s %s" % (setup_args, server_ips[0])
+
+    return ("ansible all %s -f %d -e ansible_ssh_pass='%s' -i %s,"
+            % (setup_args, min(len(server_ips), ANSIBLE_SETUP_FORKS), password, ','.join(server_ips)))
+
 
-    pid_object = os.popen(ansible_string).read()
-    json_object = {}
+def _load_tree_result(tree_dir: str, host: str) -> Optional[FactResult]:
+    """
+    Loads the json file ansible wrote for a host.
 
-    if pid_object.startswith(server_ip + " | UNREACHABLE! => "):
-        # This removes "hostname | status =>" (ie: "192.168.1.21 | SUCCESS =>")
-        # from the beginning of the return to make the return a valid json object.
-        pid_object = pid_object.replace(server_ip + " | UNREACHABLE! => ", "")
-        json_object = json.loads(pid_object)
+    :param tree_dir: The directory ansible writes the json output of each server to.
+    :param host: The host to load.
+    :return: None if the file has not been completely written yet.
+    """
+    try:
+        with open(os.path.join(tree_dir, host)) as tree_file:
+            return FactResult.from_ansible(host, json.load(tree_file))
+    except (OSError, ValueError):
+        return None
 
-    if pid_object.startswith(server_ip + " | SUCCESS => "):
-        # This removes "hostname | status =>" (ie: "192.168.1.21 | SUCCESS =>")
-        # from the beginning of the return to make the return a valid json object.
-        pid_object = pid_object.replace(server_ip + " | SUCCESS => ", "")
-        json_object = json.loads(pid_object)
 
-    if 'unreachable' in json_object and json_object['unreachable'] is True:
-        raise Exception("Error: " + json_object['msg'])
+def ansible_setup_hosts(server_ips: List[str], password: str) -> Iterator[FactResult]:
+    """
+    Runs the ansible setup module on all of the servers with a single ansible process and
+    yields the result of each server as soon as it finishes.  Only the facts Node consumes
+    are gathered and returned.
 
-    return json_object
+    Ansible writes the json output of every server to its own file in a tree directory.
+    The one line stdout is only used to learn which server finished, its facts are read
+    from the file so warnings or other noise on stdout are ignored.
 
+    :param server_ips: The ip addresses of the servers
+    :param password: password to server to create ansible ssh connection
 
-def get_system_info(server_ip: str, password: str) -> Node:
+    :return: A FactResult for every server.  Servers that fail, are unreachable or
+             do not return any facts get a result with an error_message.
+    """
+    tree_dir = tempfile.mkdtemp(prefix='ansible_setup_')
+    pending_ips = list(OrderedDict.fromkeys(server_ips))
+    finished_ips = []  # type: List[str]
+    error_message = "Error: ansible did not return any facts for %s"
+    try:
+        ansible_string = _ansible_setup_command(pending_ips, password, tree_dir)
+        lines = shell_lines(ansible_string, use_shell=True, timeout=ANSIBLE_SETUP_TIMEOUT, merge_stderr=False)
+        try:
+            for line in lines:
+                # Each result starts with "hostname | status" (ie: "192.168.1.21 | SUCCESS => {...}")
+                match = HOST_RESULT_HEADER.match(line)
+                if match and match.group(1) in pending_ips:
+                    finished_ips.append(match.group(1))
+
+                # The stdout callback runs before the tree callback so the
+                # file of a server might show up a little after its line.
+                for server_ip in list(finished_ips):
+                    result = _load_tree_result(tree_dir, server_ip)
+                    if result is not None:
+                        finished_ips.remove(server_ip)
+                        pending_ips.remove(server_ip)
+                        yield result
+        except ShellTimeoutError:
+            error_message = "Error: gathering the facts of %s timed out."
+        finally:
+            # Kills ansible if the caller stops iterating before every server finished.
+            lines.close()
+
+        for server_ip in pending_ips:
+            result = _load_tree_result(tree_dir, server_ip)
+            yield result or FactResult(server_ip, FACTS_FAILED, error_message=error_message % server_ip)
+    finally:
+        shutil.rmtree(tree_dir, ignore_errors=True)
+
+
+def ansible_setup(server_ip: str, password: str) -> FactResult:
+    """
+    Function opens ansible process to run setup on specified server and returns its result
+
+    :param server_ip: fully qualified domain name of server
+    :param password: password to server to create ansible ssh connection
+
+    :return: The FactResult of the server.
+    """
+    return list(ansible_setup_hosts([server_ip], password))[0]
+
+
+def _build_node(result: FactResult) -> FactResult:
+    """
+    Builds the Node of a successful result.  A result whose facts cannot be
+    transformed is changed to a failed result.
+
+    :param result: A FactResult
+    :return: The same result.
+    """
+    if result.ok:
+        try:
+            result.node = Node(result.facts)
+        except (KeyError, TypeError, ValueError) as e:
+            result.status = FACTS_FAILED
+            result.error_message = "Error: the facts of %s are missing %s" % (result.host, str(e))
+    return result
+
+
+def get_system_info(server_ip: str, password: str, refresh: bool=False) -> FactResult:
     """
     Main function to gather system information on server:
 
     :param server_ip: ip address of server
     :param password: password to server to create ansible ssh connection
-    :return: Node object as specified above
+    :param refresh: If True the cached facts are ignored and the facts are gathered again.
+    :return: A FactResult with the Node object as specified above or an error_message.
     """
-    json_object = ansible_setup(server_ip, password)
+    return list(get_systems_info([server_ip], password, refresh))[0]
 
-    return Node(json_object)
+
+def get_systems_info(server_ips: List[str], password: str, refresh: bool=False) -> Iterator[FactResult]:
+    """
+    Gathers system information on many servers at once.  Cached servers are yielded first,
+    the rest are yielded in the order they finish, so the whole batch takes as long as the slowest server.
+
+    :param server_ips: ip addresses of the servers
+    :param password: password to server to create ansible ssh connection
+    :param refresh: If True the cached facts are ignored and the facts are gathered again.
+    :return: A FactResult for every server with its Node object or an error_message.
+    """
+    pending_ips = []
+    for server_ip in server_ips:
+        json_object = None if refresh else get_cached_facts(server_ip)
+        if json_object is None:
+            pending_ips.append(server_ip)
+        else:
+            yield _build_node(FactResult(server_ip, FACTS_OK, facts=json_object))
+
+    if not pending_ips:
+        return
+
+    results = ansible_setup_hosts(pending_ips, password)
+    try:
+        for result in results:
+            _build_node(result)
+            if result.ok:
+                cache_facts(result.host, result.facts)
+            yield result
+    finally:
+        results.close()
@@ -0,0 +1,157 @@
+"""
+Module that keeps the portal links in memory.
+
+The links come from /etc/dnsmasq_kube_hosts on the kubernetes master server which
+is read over ssh.  A background greenlet reads the file every PORTAL_REFRESH_SECONDS
+so the portal page never waits on the ssh connection.  A kit deploy refreshes the
+links as soon as it finishes.
+"""
+import gevent
+
+from app import conn_mng, logger
+from datetime import datetime
+from fabric.runners import Result
+from gevent.event import Event
+from shared.connection_mngs import FabricConnectionWrapper
+from typing import Dict, List, Optional
+
+PORTAL_REFRESH_SECONDS = 60
+PORTAL_RETRY_SECONDS = 15
+
+DEFAULT_NAMES = ("grr-frontend.lan", "kafka-manager.lan", "kibana.lan", "moloch-viewer.lan",
+                 "kubernetes-dashboard.lan", "monitoring-grafana.lan")
+
+DISCLUDES = ("elasticsearch.lan", "mysql.lan", "mumble-server.lan")
+
+
+def _get_defaults() -> List[Dict]:
+    """
+    Gets the defaults for portal links in the event that we cannot 
+    connect to kubernetes master server.
+    
+    :return:
+    """    
+    portal_links = []
+    for default_dns in DEFAULT_NAMES:
+        portal_links.append({'ip': '', 'dns': default_dns})
+    return portal_links
+
+
+def _isDiscluded(dns: str) -> bool:
+    """
+    Checks to see if the link should be discluded or included.
+
+    :param dns: The dns name we are checking against the DISCLUDES list.
+    :return:
+    """
+    for item in DISCLUDES:
+        if dns == item:
+            return True
+    return False
+
+
+def _read_portal_links() -> List[Dict]:
+    """
+    Reads the portal links that were generated by the a fabric cron job from the master server.
+
+    :return:
+    """
+    with FabricConnectionWrapper(conn_mng) as ssh_conn:
+        portal_links = []
+        ret_val = ssh_conn.run('cat /etc/dnsmasq_kube_hosts', hide=True)  # type: Result
+        for line in ret_val.stdout.split('\n'):
+            try:
+                ip, dns = line.split(' ')
+                if _isDiscluded(dns):
+                    continue
+
+                if dns == "grr-frontend.lan":
+                    portal_links.append({'ip': 'https://' + ip, 'dns': 'https://' + dns, 'logins': 'admin/password'})
+                elif dns == "moloch-viewer.lan":
+                    portal_links.append({'ip': 'http://' + ip, 'dns': 'http://' + dns, 'logins': 'assessor/password'})
+                elif dns == "kubernetes-dashboard.lan":
+                    portal_links.append({'ip': 'https://' + ip, 'dns': 'https://' + dns, 'logins': ''})
+                else:
+                    portal_links.append({'ip': 'http://' + ip, 'dns': 'http://' + dns, 'logins': ''})
+            except ValueError as e:
+                pass
+        return portal_links
+
+
+class PortalLinkCache(object):
+    """
+    Holds the last portal links that were read and refreshes them in the background.
+    """
+
+    def __init__(self):
+        self._links = None  # type: List[Dict]
+        self._refreshed_at = None  # type: Optional[datetime]
+        self._last_error = None  # type: Optional[str]
+        self._wake_up = Event()
+        self._greenlet = None
+
+    def start(self) -> None:
+        """
+        Starts the refresh greenlet if it is not running yet.
+
+        :return:
+        """
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def get(self) -> Dict:
+        """
+        Gets the portal links from memory.  Until the links have been read once the defaults
+        are returned.
+
+        :return: {'links': [...], 'refreshed_at': '2019-01-01T00:00:00', 'is_default': False, 'error': None}
+        """
+        self.start()
+        return {'links': _get_defaults() if self._links is None else self._links,
+                'refreshed_at': self._refreshed_at.isoformat() if self._refreshed_at else None,
+                'is_default': self._links is None,
+                'error': self._last_error}
+
+    def invalidate(self) -> None:
+        """
+        Reads the links again right away instead of waiting for the next refresh.
+
+        :return:
+        """
+        self._wake_up.set()
+
+    def refresh(self) -> bool:
+        """
+        Reads the links from the master server.  If that fails the links that were read
+        last are kept.
+
+        :return: True if the links were read.
+        """
+        try:
+            self._links = _read_portal_links()
+            self._refreshed_at = datetime.utcnow()
+            self._last_error = None
+            return True
+        except Exception as e:
+            logger.warn("Failed to refresh the portal links: %s" % str(e))
+            self._last_error = str(e)
+            return False
+
+    def _run(self) -> None:
+        while True:
+            self._wake_up.clear()
+            is_refreshed = self.refresh()
+            self._wake_up.wait(PORTAL_REFRESH_SECONDS if is_refreshed else PORTAL_RETRY_SECONDS)
+
+
+PORTAL_LINKS = PortalLinkCache()
+
+
+def refresh_portal_links() -> None:
+    """
+    Job hook that reads the portal links again after a job changed the kit.
+
+    :return:
+    """
+    logger.info("Refreshing the portal links.")
+    PORTAL_LINKS.invalidate()
@@ -1,32 +1,414 @@
+import json
+import pymongo
+import zlib
+
 from app import socketio, conn_mng, logger
+from datetime import datetime
+from gevent import sleep, spawn_later
+from gevent.lock import Semaphore
+from pymongo.collection import Collection
+from threading import Thread
+from time import time
+from typing import Dict, List
 
+# A jobs buffered console lines are flushed when either limit is hit, whichever comes first.
+CONSOLE_FLUSH_LINES = 200
+CONSOLE_FLUSH_INTERVAL = 0.05  # seconds
 
-def log_to_console(job_name: str, jobid: str, text: str, color: str=None) -> None:
+# Retention settings of the console collection.
+CONSOLE_MAX_LINES_PER_JOB = 200000  # Only the newest lines of each job are kept.
+CONSOLE_TTL_SECONDS = 60 * 60 * 24 * 30  # Lines older than this are expired by mongo.
+CONSOLE_CAPPED_SIZE_BYTES = None  # If set, the console collection is a capped collection of this size.
+CONSOLE_COMPACT_INTERVAL = 300  # seconds
+
+# If set to true, each flushed batch of a job is stored as one zlib compressed chunk document
+# in the console_chunks collection instead of one document per line in the console collection.
+CONSOLE_CHUNKED_STORAGE = False
+CONSOLE_CHUNK_COMPRESSION_LEVEL = 6
+
+
+def _console_collection() -> Collection:
     """
-    Callback function that logs to console.
+    Returns the collection the console output is stored in.
+
+    :return:
+    """
+    if CONSOLE_CHUNKED_STORAGE:
+        return conn_mng.mongo_console_chunks
+    return conn_mng.mongo_console
+
+
+def _seq_field() -> str:
+    """
+    Returns the field holding the newest sequence number of a console document.
+
+    :return:
+    """
+    if CONSOLE_CHUNKED_STORAGE:
+        return 'last_seq'
+    return 'seq'
+
+
+def _pack_chunk(logs: List[Dict]) -> Dict:
+    """
+    Packs a run of console logs of one job into a compressed chunk document.
+    The sequence numbers of the logs are contiguous so only the range is stored.
+
+    :param logs: The console log documents.
+    :return:
+    """
+    lines = [[log['jobid'], log['log'], log['color']] for log in logs]
+    data = zlib.compress(json.dumps(lines).encode('utf-8'), CONSOLE_CHUNK_COMPRESSION_LEVEL)
+    return {'jobName': logs[0]['jobName'],
+            'first_seq': logs[0]['seq'],
+            'last_seq': logs[-1]['seq'],
+            'created': logs[0]['created'],
+            'data': data}
+
+
+def _unpack_chunk(chunk: Dict) -> List[Dict]:
+    """
+    Unpacks a chunk document back into console log documents.
+
+    :param chunk: The chunk document
+    :return:
+    """
+    lines = json.loads(zlib.decompress(chunk['data']).decode('utf-8'))
+    return [{'jobName': chunk['jobName'], 'jobid': jobid, 'log': text, 'color': color, 'seq': chunk['first_seq'] + i}
+            for i, (jobid, text, color) in enumerate(lines)]
+
+
+def _store_logs(logs: List[Dict]) -> None:
+    """
+    Stores a batch of console logs of one job.
+
+    :param logs: The console log documents.
+    :return:
+    """
+    if CONSOLE_CHUNKED_STORAGE:
+        conn_mng.mongo_console_chunks.insert_one(_pack_chunk(logs))
+    else:
+        conn_mng.mongo_console.insert_many(logs)
+
+
+def _read_chunks(job_name: str, after: int, before: int, limit: int) -> List[Dict]:
+    """
+    Reads console logs from the compressed chunks.  Only chunks that
+    overlap the requested range are fetched and decompressed.
+
+    :return:
+    """
+    query = {'jobName': job_name}
+    if after is not None:
+        query['last_seq'] = {'$gt': after}
+    if before is not None:
+        query['first_seq'] = {'$lt': before}
+
+    is_tail = after is None and limit
+    direction = pymongo.DESCENDING if is_tail else pymongo.ASCENDING
+    cursor = conn_mng.mongo_console_chunks.find(query, {'_id': False}).sort('last_seq', direction)
+    chunks_logs = []
+    count = 0
+    for chunk in cursor:
+        logs = [log for log in _unpack_chunk(chunk)
+                if (after is None or log['seq'] > after) and (before is None or log['seq'] < before)]
+        chunks_logs.append(logs)
+        count += len(logs)
+        if limit and count >= limit:
+            break
+    cursor.close()
+
+    if is_tail:
+        chunks_logs.reverse()
+    logs = [log for logs in chunks_logs for log in logs]
+    if limit:
+        logs = logs[-limit:] if is_tail else logs[:limit]
+    return logs
+
+
+def _read_lines(job_name: str, after: int, before: int, limit: int) -> List[Dict]:
+    """
+    Reads console logs that are stored as one document per line.
+
+    :return:
+    """
+    query = {"jobName": job_name}
+    seq_range = {}
+    if after is not None:
+        seq_range['$gt'] = after
+    if before is not None:
+        seq_range['$lt'] = before
+    if seq_range:
+        query['seq'] = seq_range
+
+    projection = {'_id': False, 'created': False}
+    if after is None and limit:
+        # Tail and page backwards mode, grab the newest logs first and flip them.
+        cursor = conn_mng.mongo_console.find(query, projection).sort('seq', pymongo.DESCENDING).limit(limit)
+        logs = list(cursor)
+        logs.reverse()
+        return logs
+
+    return list(conn_mng.mongo_console.find(query, projection).sort('seq', pymongo.ASCENDING).limit(limit))
+
+
+def read_console_logs(job_name: str, after: int=None, before: int=None, limit: int=0) -> List[Dict]:
+    """
+    Reads the console logs of a job in ascending order of their sequence number.
+
+    :param job_name: The name of the job
+    :param after: Only return logs with a sequence number greater than this one.
+    :param before: Only return logs with a sequence number less than this one.
+    :param limit: The maximum number of logs to return, 0 means no limit.  Without after
+                  the newest logs are returned.
+    :return:
+    """
+    if CONSOLE_CHUNKED_STORAGE:
+        return _read_chunks(job_name, after, before, limit)
+    return _read_lines(job_name, after, before, limit)
+
+
+def delete_console_logs(job_name: str) -> None:
+    """
+    Removes the console logs of a job from both storage formats.
+
+    :param job_name: The name of the job
+    :return:
+    """
+    conn_mng.mongo_console.delete_many({'jobName': job_name})
+    conn_mng.mongo_console_chunks.delete_many({'jobName': job_name})
+
+
+def console_room(job_name: str) -> str:
+    """
+    Returns the Socket.IO room that receives the console output of a job.
 
     :param job_name: The name of the job
-    :param jobid: The jobid
-    :param text: The console output string
     :return:
     """
+    return 'console_' + job_name
 
-    log = {'jobName': job_name, 'jobid': jobid, 'log': text}
+
+def _get_color(text: str, color: str=None) -> str:
+    """
+    Classifies a console line by the color it should be displayed with.
+
+    :param text: The console output string
+    :param color: Overrides the classification if it is set.
+    :return:
+    """
+    if color:
+        return color
     if text.startswith('fatal'):
-        log['color'] = 'red'
+        return 'red'
     elif text.startswith('skipping'):
-        log['color'] = 'lightgreen'
+        return 'lightgreen'
     elif text.startswith('ok'):
-        log['color'] = 'lightgreen'
+        return 'lightgreen'
     elif text.startswith('changed'):
-        log['color'] = 'orange'
+        return 'orange'
+    return 'white'
+
+
+class ConsoleSink(object):
+    """
+    Buffers console lines per job and flushes them as a single socket event
+    and a single mongo insert_many.
+    """
+
+    def __init__(self, max_lines: int=CONSOLE_FLUSH_LINES, flush_interval: float=CONSOLE_FLUSH_INTERVAL):
+        """
+        :param max_lines: The number of buffered lines that triggers a flush.
+        :param flush_interval: The maximum amount of seconds a line stays buffered.
+        """
+        self._max_lines = max_lines
+        self._flush_interval = flush_interval
+        self._buffers = {}  # type: Dict[str, List[Dict]]
+        self._buffered_at = {}  # type: Dict[str, float]
+        self._locks = {}  # type: Dict[str, Semaphore]
+        self._last_seq = {}  # type: Dict[str, int]
+        self._stats = {'flushes': 0, 'lines': 0,
+                       'last_batch_size': 0, 'max_batch_size': 0,
+                       'last_wait_ms': 0.0, 'max_wait_ms': 0.0,
+                       'last_flush_ms': 0.0, 'max_flush_ms': 0.0}
+
+    def write(self, log: Dict) -> None:
+        """
+        Buffers a console log and flushes the jobs buffer if it is full.
+
+        :param log: The console log document.
+        :return:
+        """
+        job_name = log['jobName']
+        log['seq'] = self._next_seq(job_name)
+        buffer = self._buffers.get(job_name)
+        if buffer is None:
+            buffer = self._buffers[job_name] = []
+            self._buffered_at[job_name] = time()
+            spawn_later(self._flush_interval, self.flush, job_name)
+
+        buffer.append(log)
+        if len(buffer) >= self._max_lines:
+            self.flush(job_name)
+
+    def _next_seq(self, job_name: str) -> int:
+        """
+        Returns the next monotonic sequence number of a job.  The last sequence number
+        is loaded from the database the first time a job writes after a restart.
+
+        :param job_name: The name of the job
+        :return:
+        """
+        if job_name not in self._last_seq:
+            seq_field = _seq_field()
+            last_log = _console_collection().find_one({'jobName': job_name},
+                                                      sort=[(seq_field, pymongo.DESCENDING)])
+            # setdefault because another greenlet of the same job may have loaded it while we waited.
+            self._last_seq.setdefault(job_name, last_log.get(seq_field, 0) if last_log else 0)
+
+        self._last_seq[job_name] += 1
+        return self._last_seq[job_name]
+
+    def flush(self, job_name: str) -> None:
+        """
+        Sends the buffered lines of a job to the database and the clients in the jobs room.
+        A per job lock keeps batches in order.
+
+        :param job_name: The name of the job
+        :return:
+        """
+        lock = self._locks.setdefault(job_name, Semaphore())
+        with lock:
+            logs = self._buffers.pop(job_name, None)
+            if not logs:
+                return
+
+            start = time()
+            wait_ms = (start - self._buffered_at.pop(job_name)) * 1000
+            try:
+                # Store before emitting so that a client which joins the room and then
+                # fetches what it missed can never fall between the two.
+                messages = [dict(log) for log in logs]
+                created = datetime.utcnow()
+                for log in logs:
+                    log['created'] = created
+                _store_logs(logs)
+                socketio.emit('messages', messages, room=console_room(job_name))
+            except Exception as e:
+                logger.exception(e)
+            self._record(len(logs), wait_ms, (time() - start) * 1000)
+
+    def _record(self, batch_size: int, wait_ms: float, flush_ms: float) -> None:
+        stats = self._stats
+        stats['flushes'] += 1
+        stats['lines'] += batch_size
+        stats['last_batch_size'] = batch_size
+        stats['max_batch_size'] = max(stats['max_batch_size'], batch_size)
+        stats['last_wait_ms'] = wait_ms
+        stats['max_wait_ms'] = max(stats['max_wait_ms'], wait_ms)
+        stats['last_flush_ms'] = flush_ms
+        stats['max_flush_ms'] = max(stats['max_flush_ms'], flush_ms)
+
+    @property
+    def stats(self) -> Dict:
+        """
+        Returns the flush statistics so that the batch limits can be tuned under load.
+
+        :return:
+        """
+        ret_val = dict(self._stats)
+        ret_val['avg_batch_size'] = 0.0
+        if ret_val['flushes'] > 0:
+            ret_val['avg_batch_size'] = ret_val['lines'] / ret_val['flushes']
+        ret_val['buffered_lines'] = sum(len(logs) for logs in self._buffers.values())
+        return ret_val
+
+
+console_sink = ConsoleSink()
+
+
+def _is_capped_mode() -> bool:
+    return CONSOLE_CAPPED_SIZE_BYTES is not None
+
+
+def setup_console_collection() -> None:
+    """
+    Sets up the collection of the configured storage format.  In capped mode the collection is converted to a
+    capped collection, otherwise a TTL index is created on the insert timestamp.
+    Both modes get the index that backs the per job cursor queries.
+
+    :return:
+    """
+    console = _console_collection()
+    if _is_capped_mode():
+        if not console.options().get('capped'):
+            conn_mng.mongo_database.command('convertToCapped', console.name, size=CONSOLE_CAPPED_SIZE_BYTES)
     else:
-        log['color'] = 'white'
+        console.create_index('created', expireAfterSeconds=CONSOLE_TTL_SECONDS)
+    console.create_index([('jobName', pymongo.ASCENDING), (_seq_field(), pymongo.ASCENDING)])
 
-    if color:
-        log['color'] = color
-    
-    socketio.emit('message', log, broadcast=True)
-    #socketio.emit(jobid, log, broadcast=True, namespace='/console')
-    conn_mng.mongo_console.insert_one(log)
 
+def _compact_job(job_name: str) -> int:
+    """
+    Deletes the oldest lines of a job so that it works like a ring buffer of
+    CONSOLE_MAX_LINES_PER_JOB lines.
+
+    :param job_name: The name of the job
+    :return: The number of deleted documents.
+    """
+    console = _console_collection()
+    seq_field = _seq_field()
+    last_log = console.find_one({'jobName': job_name}, {seq_field: True},
+                                sort=[(seq_field, pymongo.DESCENDING)])
+    if last_log is None or seq_field not in last_log:
+        return 0
+
+    floor_seq = last_log[seq_field] - CONSOLE_MAX_LINES_PER_JOB
+    if floor_seq <= 0:
+        return 0
+    result = console.delete_many({'jobName': job_name, seq_field: {'$lte': floor_seq}})
+    return result.deleted_count
+
+
+def _compact_console() -> None:
+    """
+    Background loop that enforces the per job line cap.  Capped collections
+    enforce their own limits so there is nothing to do in capped mode.
+
+    :return:
+    """
+    logger.info("Starting console compactor!")
+    while True:
+        try:
+            for job_name in _console_collection().distinct('jobName'):
+                deleted_count = _compact_job(job_name)
+                if deleted_count > 0:
+                    logger.debug("Compacted %d console documents of %s" % (deleted_count, job_name))
+        except Exception as e:
+            logger.exception(e)
+        sleep(CONSOLE_COMPACT_INTERVAL)
+
+
+def start_console_compactor() -> None:
+    """
+    Sets up the console collection and starts the compactor thread.
+
+    :return:
+    """
+    setup_console_collection()
+    if not _is_capped_mode():
+        compactor_thread = socketio.start_background_task(target=_compact_console)  # type: Thread
+        compactor_thread.start()
+
+
+def log_to_console(job_name: str, jobid: str, text: str, color: str=None) -> None:
+    """
+    Callback function that logs to console.
+
+    :param job_name: The name of the job
+    :param jobid: The jobid
+    :param text: The console output string
+    :return:
+    """
+    log = {'jobName': job_name, 'jobid': jobid, 'log': text, 'color': _get_color(text, color)}
+    console_sink.write(log)
@@ -1,24 +1,37 @@
 import os
+import threading
 
 from datetime import datetime
 from fabric import Connection, Config
+from invoke.exceptions import Failure
 from kubernetes import client, config
 from pymongo.collection import Collection
 from pymongo.database import Database
 from pymongo import MongoClient
 from shared.constants import KIT_ID, DATE_FORMAT_STR, KICKSTART_ID
 from shared.utils import decode_password
-from typing import Dict, Tuple
+from time import sleep, time
+from typing import Dict, List, Tuple
 
 KUBEDIR = "/root/.kube"
 USERNAME = 'root'
 CONNECTION_TIMEOUT = 20
+SSH_POOL_MAX_CONNECTIONS_PER_HOST = 2
+# OpenSSH allows 10 sessions (channels) per connection by default
+SSH_POOL_MAX_SESSIONS_PER_CONNECTION = 8
+SSH_POOL_IDLE_SECONDS = 300
+SSH_POOL_CHECK_AFTER_SECONDS = 30
+KUBE_CONNECTION_POOL_SIZE = 16
 
 
 class KitFormNotFound(Exception):
     pass
 
 
+class SSHPoolTimeout(Exception):
+    pass
+
+
 def objectify(some_dict: Dict) -> Dict:
     """
     Converts a given dictionary into a savable mongo object.
@@ -109,6 +122,33 @@ class MongoConnectionManager(object):
         """
         return self._rock_database.console
 
+    @property
+    def mongo_console_chunks(self) -> Collection:
+        """
+        Returns a mongo object that can do manipulate the compressed chunks of console output.
+
+        :return:
+        """
+        return self._rock_database.console_chunks
+
+    @property
+    def mongo_jobs(self) -> Collection:
+        """
+        Returns a mongo object that can do manipulate the state and history of every job.
+
+        :return:
+        """
+        return self._rock_database.jobs
+
+    @property
+    def mongo_node_facts(self) -> Collection:
+        """
+        Returns a mongo object that can do manipulate the cached ansible facts of the nodes.
+
+        :return:
+        """
+        return self._rock_database.node_facts
+
     @property
     def mongo_last_jobs(self) -> Collection:
         """
@@ -157,6 +197,271 @@ def get_master_node_ip_and_password(kit_form: Dict) -> str:
     return None, None
 
 
+class _PooledConnection(object):
+    """
+    A connection in the SSH pool and the number of users it is leased to.
+    """
+    __slots__ = ('connection', 'password', 'leases', 'last_used', 'is_opening', 'is_checking')
+
+    def __init__(self, connection: Connection, password: str):
+        self.connection = connection
+        self.password = password
+        self.leases = 0
+        self.last_used = time()
+        self.is_opening = True
+        self.is_checking = False
+
+
+def is_connection_error(exc_type: type) -> bool:
+    """
+    Checks if an exception raised while a connection was leased means its transport is broken.
+    A command that ran and failed (IE: a non zero exit code) does not.
+
+    :param exc_type: The type of the exception or None.
+    :return:
+    """
+    return exc_type is not None and not issubclass(exc_type, Failure)
+
+
+class SSHConnectionPool(object):
+    """
+    Process wide pool of fabric connections keyed by (host, user).
+
+    A connection is leased to several users at once, every command they run opens its
+    own channel over the shared transport.  A new connection is only opened when every
+    connection to the host has SSH_POOL_MAX_SESSIONS_PER_CONNECTION leases, up to
+    SSH_POOL_MAX_CONNECTIONS_PER_HOST connections.  Connections that are idle for
+    SSH_POOL_IDLE_SECONDS are closed by a reaper thread.
+
+    Opening, probing and closing connections is done outside of the pool lock so a slow
+    host never blocks the users of other hosts.
+    """
+
+    def __init__(self):
+        self._pools = {}  # type: Dict[Tuple[str, str], List[_PooledConnection]]
+        self._leased = {}  # type: Dict[int, Tuple[Tuple[str, str], _PooledConnection]]
+        self._available = threading.Condition(threading.Lock())
+        self._reaper = None  # type: threading.Thread
+
+    @staticmethod
+    def _new_connection(host: str, user: str, password: str) -> Connection:
+        config = Config(overrides={'sudo': {'password': password}})
+        return Connection(host,
+                          config=config,
+                          user=user,
+                          connect_timeout=CONNECTION_TIMEOUT,
+                          connect_kwargs={'password': password,
+                                          'allow_agent': False,
+                                          'look_for_keys': False})
+
+    @staticmethod
+    def _probe(pooled: _PooledConnection) -> bool:
+        """
+        Checks that the transport of a connection that has been idle for a while still
+        works by sending it an ignore message.
+
+        :param pooled:
+        :return:
+        """
+        try:
+            pooled.connection.transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connections: List[Connection]) -> None:
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _remove(self, key: Tuple[str, str], pooled: _PooledConnection) -> List[Connection]:
+        """
+        Takes a connection out of the pool.  Call _close on the result once the lock is released.
+
+        :return: The connection if nobody leases it anymore so it can be closed.
+        """
+        pool = self._pools.get(key, [])
+        if pooled in pool:
+            pool.remove(pooled)
+        if not pool:
+            self._pools.pop(key, None)
+        return [pooled.connection] if pooled.leases == 0 else []
+
+    def _evict_idle(self) -> List[Connection]:
+        to_close = []
+        now = time()
+        for key, pool in list(self._pools.items()):
+            for pooled in list(pool):
+                if pooled.leases == 0 and now - pooled.last_used > SSH_POOL_IDLE_SECONDS:
+                    to_close.extend(self._remove(key, pooled))
+        return to_close
+
+    def _reap(self) -> None:
+        while True:
+            sleep(SSH_POOL_IDLE_SECONDS / 2)
+            with self._available:
+                to_close = self._evict_idle()
+            self._close(to_close)
+
+    def _start_reaper(self) -> None:
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, daemon=True)
+            self._reaper.start()
+
+    def _lease_existing(self, key: Tuple[str, str], password: str) -> Tuple[_PooledConnection, List[Connection]]:
+        """
+        Finds a connection with a free session.  Connections with stale passwords or
+        broken transports are dropped along the way.
+
+        :return: The connection or None if there is none and the connections to close.
+        """
+        to_close = []
+        for pooled in list(self._pools.get(key, [])):
+            if pooled.is_opening or pooled.is_checking:
+                continue
+            if pooled.password != password or not pooled.connection.is_connected:
+                to_close.extend(self._remove(key, pooled))
+                continue
+            if pooled.leases < SSH_POOL_MAX_SESSIONS_PER_CONNECTION:
+                return pooled, to_close
+        return None, to_close
+
+    def _lease(self, key: Tuple[str, str], password: str, deadline: float) -> Tuple[_PooledConnection, List[Connection]]:
+        """
+        Leases an existing connection or reserves a new one.  It must be called with the lock held.
+
+        :return: The leased connection and the connections to close.
+        """
+        to_close = self._evict_idle()
+        while True:
+            pooled, removed = self._lease_existing(key, password)
+            to_close.extend(removed)
+            if pooled is not None:
+                if pooled.leases == 0 and time() - pooled.last_used > SSH_POOL_CHECK_AFTER_SECONDS:
+                    # Nobody else gets it until it has been probed.
+                    pooled.is_checking = True
+                pooled.leases += 1
+                self._leased[id(pooled.connection)] = (key, pooled)
+                return pooled, to_close
+
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < SSH_POOL_MAX_CONNECTIONS_PER_HOST:
+                pooled = _PooledConnection(self._new_connection(key[0], key[1], password), password)
+                pooled.leases = 1
+                pool.append(pooled)
+                return pooled, to_close
+
+            remaining = deadline - time()
+            if remaining <= 0:
+                self._close_later(to_close)
+                raise SSHPoolTimeout("Timed out waiting for an ssh session to %s@%s." % (key[1], key[0]))
+            self._available.wait(remaining)
+
+    def _close_later(self, connections: List[Connection]) -> None:
+        if connections:
+            threading.Thread(target=self._close, args=(connections,), daemon=True).start()
+
+    def acquire(self, host: str, user: str, password: str, timeout: float=CONNECTION_TIMEOUT) -> Connection:
+        """
+        Leases a connection to a host.  Call release when you are done with it.
+
+        :param host: The ip address or hostname of the server.
+        :param user: The user to login as.
+        :param password: The password of the user, it is also used for sudo.
+        :param timeout: The number of seconds to wait when the host has no free sessions left.
+        :return: An open fabric connection.
+        """
+        key = (host, user)
+        deadline = time() + timeout
+        self._start_reaper()
+        while True:
+            with self._available:
+                pooled, to_close = self._lease(key, password, deadline)
+            self._close(to_close)
+
+            if pooled.is_checking:
+                is_healthy = self._probe(pooled)
+                with self._available:
+                    pooled.is_checking = False
+                    if not is_healthy:
+                        pooled.leases -= 1
+                        del self._leased[id(pooled.connection)]
+                        to_close = self._remove(key, pooled)
+                    self._available.notify_all()
+                if not is_healthy:
+                    self._close(to_close)
+                    continue
+                return pooled.connection
+
+            if not pooled.is_opening:
+                return pooled.connection
+            break
+
+        # The handshake runs outside of the lock so other hosts are not blocked by it.
+        try:
+            pooled.connection.open()
+        except Exception:
+            with self._available:
+                pooled.leases = 0
+                to_close = self._remove(key, pooled)
+                self._available.notify_all()
+            self._close(to_close)
+            raise
+
+        with self._available:
+            pooled.is_opening = False
+            self._leased[id(pooled.connection)] = (key, pooled)
+            self._available.notify_all()
+        return pooled.connection
+
+    def release(self, connection: Connection, is_broken: bool=False) -> None:
+        """
+        Gives a leased connection back to the pool.
+
+        :param connection: A connection returned by acquire.
+        :param is_broken: If set to true the connection failed while it was leased, it is
+                          taken out of the pool and closed once nobody leases it anymore.
+        :return:
+        """
+        to_close = []
+        with self._available:
+            key, pooled = self._leased.get(id(connection), (None, None))
+            if pooled is None:
+                return
+
+            pooled.leases -= 1
+            pooled.last_used = time()
+            if is_broken:
+                to_close.extend(self._remove(key, pooled))
+            if pooled.leases == 0:
+                del self._leased[id(connection)]
+                if not pooled.connection.is_connected or pooled not in self._pools.get(key, []):
+                    to_close.extend(self._remove(key, pooled))
+            to_close.extend(self._evict_idle())
+            self._available.notify_all()
+        self._close(list(set(to_close)))
+
+    def close_all(self) -> None:
+        """
+        Closes every connection that is not leased.
+
+        :return:
+        """
+        to_close = []
+        with self._available:
+            for key, pool in list(self._pools.items()):
+                for pooled in list(pool):
+                    if pooled.leases == 0:
+                        to_close.extend(self._remove(key, pooled))
+        self._close(to_close)
+
+
+SSH_POOL = SSHConnectionPool()
+
+
 class FabricConnectionWrapper():
 
     def __init__(self, conn_mongo: MongoConnectionManager=None):
@@ -169,12 +474,7 @@ class FabricConnectionWrapper():
         if kit_form and kickstart_form:
             master_ip = get_master_node_ip_and_password(kit_form['form'])
             password = decode_password(kickstart_form['form']['root_password'])
-            self._connection = Connection(master_ip, 
-                                          user=USERNAME, 
-                                          connect_timeout=CONNECTION_TIMEOUT,
-                                          connect_kwargs={'password': password, 
-                                                          'allow_agent': False, 
-                                                          'look_for_keys': False})
+            self._connection = SSH_POOL.acquire(master_ip, USERNAME, password)
         else:
             raise KitFormNotFound()
 
@@ -187,10 +487,72 @@ class FabricConnectionWrapper():
             
         return self._connection
 
-    def __exit__(self, *exc):
+    def __exit__(self, exc_type, exc_value, traceback):
         if self._connection:
-            self._connection.close()
-        
+            SSH_POOL.release(self._connection, is_connection_error(exc_type))
+            self._connection = None
+
+
+class KubernetesClient(object):
+    """
+    Process wide kubernetes API handler.  It is built the first time it is needed and
+    kept until invalidate is called, so every request reuses the keep alive connections
+    of its urllib3 pool instead of loading the kubeconfig and doing a TLS handshake.
+    """
+
+    def __init__(self):
+        self._kube_apiv1 = None  # type: client.CoreV1Api
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_and_save_kubernetes_config(mongo_conn: MongoConnectionManager) -> None:
+        """
+        Retrieves the kuberntes configuration file from the master server.
+        """
+        if not os.path.exists(KUBEDIR):
+            os.makedirs(KUBEDIR)
+
+        config_path = KUBEDIR + '/config'
+        if not os.path.exists(config_path) or not os.path.isfile(config_path):
+            with FabricConnectionWrapper(mongo_conn) as fab_conn:
+                fab_conn.get(config_path, config_path)
+
+    def get(self, mongo_conn: MongoConnectionManager) -> client.CoreV1Api:
+        """
+        Returns the kubernetes API handler, it is built if it does not exist yet.
+
+        :param mongo_conn: Used to find the master server if the kubeconfig has to be retrieved.
+        :return:
+        """
+        kube_apiv1 = self._kube_apiv1
+        if kube_apiv1 is not None:
+            return kube_apiv1
+
+        with self._lock:
+            if self._kube_apiv1 is None:
+                self._get_and_save_kubernetes_config(mongo_conn)
+                configuration = client.Configuration()
+                config.load_kube_config(client_configuration=configuration)
+                configuration.connection_pool_maxsize = KUBE_CONNECTION_POOL_SIZE
+                self._kube_apiv1 = client.CoreV1Api(client.ApiClient(configuration))
+            return self._kube_apiv1
+
+    def invalidate(self) -> None:
+        """
+        Drops the API handler so the next call to get reloads the kubeconfig.
+
+        :return:
+        """
+        with self._lock:
+            kube_apiv1 = self._kube_apiv1
+            self._kube_apiv1 = None
+
+        if kube_apiv1 is not None:
+            kube_apiv1.api_client.rest_client.pool_manager.clear()
+
+
+KUBERNETES_CLIENT = KubernetesClient()
+
 
 class KubernetesWrapper():
 
@@ -206,25 +568,12 @@ class KubernetesWrapper():
             self._mongo_conn = mongo_conn
             self._is_close = False
 
-        self._get_and_save_kubernetes_config()
-        config.load_kube_config()
-        self._kube_apiv1 = client.CoreV1Api()
-
-    def _get_and_save_kubernetes_config(self) -> None:
-        """
-        Retrieves the kuberntes configuration file from the master server.
-        """
-        if not os.path.exists(KUBEDIR):
-            os.makedirs(KUBEDIR)
-
-        config_path = KUBEDIR + '/config'
-        if not os.path.exists(config_path) or not os.path.isfile(config_path):
-            with FabricConnectionWrapper(self._mongo_conn) as fab_conn:
-                fab_conn.get(config_path, config_path)
+        self._kube_apiv1 = KUBERNETES_CLIENT.get(self._mongo_conn)
 
     def close(self) -> None:
         """
-        Closes the connections associated with this context wrapper.
+        Closes the connections associated with this context wrapper.  The kubernetes
+        API handler is shared so it stays open.
         """
         if self._mongo_conn and self._is_close:
             self._mongo_conn.close()
@@ -260,26 +609,25 @@ class FabricConnectionManager:
 
     def _establish_fabric_connection(self) -> None:
         if not self._connection:
-            config = Config(overrides={'sudo': {'password': self._password}})
-            self._connection = Connection(self._ipaddress,
-                                          config=config,
-                                          user=self._username,
-                                          connect_timeout=CONNECTION_TIMEOUT,
-                                          connect_kwargs={'password': self._password,
-                                                          'allow_agent': False,
-                                                          'look_for_keys': False})            
+            self._connection = SSH_POOL.acquire(self._ipaddress, self._username, self._password)
 
     @property
     def connection(self):
         return self._connection
 
-    def close(self):
+    def close(self, is_broken: bool=False):
+        """
+        Gives the connection back to the pool.
+
+        :param is_broken: If set to true the connection failed and is not handed out again.
+        """
         if self._connection:
-            self._connection.close()
+            SSH_POOL.release(self._connection, is_broken)
+            self._connection = None
 
     def __enter__(self):
         self._establish_fabric_connection()
         return self._connection
 
-    def __exit__(self, *exc):
-        self.close()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(is_connection_error(exc_type))
@@ -10,8 +10,17 @@ export class ConfigmapsService {
 
   constructor(private http: HttpClient) { }
 
-  getConfigMaps(): Observable<Object> {
-    const url = '/api/get_config_maps';
+  /**
+   * Gets the config maps without their data.  The server answers with an ETag so the
+   * browser only downloads the list again after a config map changed.
+   */
+  getConfigMapSummaries(): Observable<Object> {
+    const url = '/api/get_config_map_summaries';
+    return this.http.get(url).pipe();
+  }
+
+  getConfigMap(namespace: string, name: string): Observable<Object> {
+    const url = `/api/get_config_map/${namespace}/${name}`;
     return this.http.get(url).pipe();
   }
 
@@ -20,6 +29,14 @@ export class ConfigmapsService {
     return this.http.post(url, configMap, HTTP_OPTIONS).pipe();
   }
   
+  /**
+   * Saves several config maps at once.  Only the keys that changed are sent to kubernetes.
+   */
+  applyConfigMaps(configMaps: Array<Object>): Observable<Object> {
+    const url = '/api/apply_config_maps';
+    return this.http.post(url, {'config_maps': configMaps}, HTTP_OPTIONS).pipe();
+  }
+  
   deleteConfigMap(namespace: string, name: string): Observable<Object> {
     const url = `/api/delete_config_map/${namespace}/${name}`;
     return this.http.delete(url).pipe();
@@ -41,20 +41,41 @@ export class ConfigmapsComponent implements OnInit {
 
   ngOnInit() {
     this.title.setTitle("Config Maps");
-    this.configMapSrv.getConfigMaps().subscribe(data => {
-      if (data['items']){
-        this.configMaps = data['items'];
+    this.configMapSrv.getConfigMapSummaries().subscribe(data => {
+      if (data instanceof Array){
+        this.configMaps = data;
         this.isConfigMapVisible = new Array(this.configMaps.length).fill(false);
       }
     }); 
   }
 
-  objectKeys(obj: any) {
-    let ret_val = [];
-    for (let item of Object.keys(obj)){      
-        ret_val.push(item);
+  /**
+   * The list only has the summaries of the config maps so the data of a config map
+   * is fetched the first time it is needed.
+   */
+  private loadConfigMapData(configMapIndex: number, next: () => void) {
+    let configMap = this.configMaps[configMapIndex];
+    if (configMap['data']){
+      next();
+      return;
     }
-    return ret_val;
+
+    this.configMapSrv.getConfigMap(configMap['metadata']['namespace'], configMap['metadata']['name']).subscribe(data => {
+      configMap['metadata'] = data['metadata'];
+      configMap['data'] = data['data'] ? data['data'] : {};
+      next();
+    }, error => {
+      console.log(error);
+      this.configMapsModal.updateModal("Error ", "Failed to load config map " + configMap['metadata']['name'] + 
+                                       ". REASON: " + error["statusText"], "Ok", undefined, ModalType.error);
+      this.configMapsModal.openModal();
+    });
+  }
+
+  private updateConfigMapKeys(configMap: Object) {
+    configMap['keys'] = Object.keys(configMap['data']).sort().map(name => {
+      return {'name': name, 'size': new Blob([configMap['data'][name]]).size};
+    });
   }
 
   addConfigMap() {
@@ -75,20 +96,20 @@ export class ConfigmapsComponent implements OnInit {
     this.activeConfigDataTitle = "Editing " + configDataName;
     this.activeConfigDataKey = configDataName;    
     this.activeConfigMapIndex = configMapIndex;
-    this.activeConfigData = this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey];
-    this.isUserEditing = true;
+    this.loadConfigMapData(configMapIndex, () => {
+      this.activeConfigData = this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey];
+      this.isUserEditing = true;
+    });
   }
 
   addNewConfigMapData(formSubmission: Object){
     this.activeConfigDataTitle = "Editing " + formSubmission['name'];
     this.activeConfigDataKey = formSubmission['name'];
-    if (!this.configMaps[this.activeConfigMapIndex]['data']){
-      this.configMaps[this.activeConfigMapIndex]['data'] = {}
-    }
-    
-    this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey] = '';
-    this.activeConfigData = this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey];
-    this.isUserEditing = true;
+    this.loadConfigMapData(this.activeConfigMapIndex, () => {
+      this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey] = '';
+      this.activeConfigData = this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey];
+      this.isUserEditing = true;
+    });
   }
 
   addNewConfigMap(formSubmission: Object){
@@ -97,6 +118,10 @@ export class ConfigmapsComponent implements OnInit {
                                   'namespace': formSubmission['namespace']},
                      'data': {}};
     this.configMapSrv.createConfigMap(newConfigMap).subscribe(data => {
+      if (!data['data']){
+        data['data'] = {};
+      }
+      this.updateConfigMapKeys(data);
       this.configMaps.splice(0, 0, data);
       this.isConfigMapVisible.splice(0, 0, true);
       this.configMapsModal.updateModal("Success ", "Successfully added " + formSubmission['name'], "Ok");
@@ -124,16 +149,20 @@ export class ConfigmapsComponent implements OnInit {
   }
 
   private deleteConfigMapData() {
-    delete this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey];
-    this.configMapSrv.saveConfigMap(this.configMaps[this.activeConfigMapIndex]).subscribe(data => {
-      if (data) {
-        this.configMapsModal.updateModal("Success ", "Successfully deleted " + this.activeConfigDataKey + " configmap data!", "Ok");
+    this.loadConfigMapData(this.activeConfigMapIndex, () => {
+      let configMap = this.configMaps[this.activeConfigMapIndex];
+      delete configMap['data'][this.activeConfigDataKey];
+      this.configMapSrv.saveConfigMap(configMap).subscribe(data => {
+        if (data) {
+          this.updateConfigMapKeys(configMap);
+          this.configMapsModal.updateModal("Success ", "Successfully deleted " + this.activeConfigDataKey + " configmap data!", "Ok");
+          this.configMapsModal.openModal();
+        }
+      }, error => {
+        console.log(error);
+        this.configMapsModal.updateModal("Error ", "Failed to delete config map data REASON: " + error["statusText"], "Ok", undefined, ModalType.error);
         this.configMapsModal.openModal();
-      }
-    }, error => {
-      console.log(error);
-      this.configMapsModal.updateModal("Error ", "Failed to delete config map data REASON: " + error["statusText"], "Ok", undefined, ModalType.error);
-      this.configMapsModal.openModal();
+      });
     });
   }
 
@@ -183,6 +212,7 @@ export class ConfigmapsComponent implements OnInit {
     this.configMaps[this.activeConfigMapIndex]['data'][this.activeConfigDataKey] = dataToSave;
     this.configMapSrv.saveConfigMap(this.configMaps[this.activeConfigMapIndex]).subscribe(data => {
       if (data){
+        this.updateConfigMapKeys(this.configMaps[this.activeConfigMapIndex]);
         this.configMapsModal.updateModal("Success ", "Successfully saved " + data['name'] + " configmap!", "Ok");
         this.configMapsModal.openModal();  
       }
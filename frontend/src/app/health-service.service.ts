@@ -1,14 +1,19 @@
 import { Injectable } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
 import { Observable, of } from 'rxjs';
+import { Socket } from 'ngx-socket-io';
+import { MySocket } from './server-stdout.service';
 
 
 @Injectable({
   providedIn: 'root'
 })
 export class HealthServiceService {
+  private socket: Socket;
 
-  constructor(private http: HttpClient) { }
+  constructor(private http: HttpClient) {
+    this.socket = new MySocket();
+  }
 
   performSystemsCheck(): Observable<Object> {
     const url = '/api/perform_systems_check';
@@ -24,6 +29,40 @@ export class HealthServiceService {
     const url = '/api/get_node_statuses';
     return this.http.get(url).pipe();
   }
+
+  /**
+   * Gets the pods that changed since a version.  Since 0 returns every pod with the current version.
+   * @param since
+   */
+  getPodsStatusesSince(since: number): Observable<Object> {
+    const url = `/api/get_pods_statuses?since=${since}`;
+    return this.http.get(url).pipe();
+  }
+
+  getNodeStatusesSince(since: number): Observable<Object> {
+    const url = `/api/get_node_statuses?since=${since}`;
+    return this.http.get(url).pipe();
+  }
+
+  /**
+   * Subscribes to the pod and node status changes.
+   * @param joined - Called once the server has added us to the health room.
+   */
+  joinHealth(joined: () => void){
+    this.socket.emit("join_health", joined);
+  }
+
+  leaveHealth(){
+    this.socket.emit("leave_health");
+  }
+
+  getStatusChanges(){
+    return this.socket.fromEvent("cluster_status").pipe();
+  }
+
+  onReconnect(){
+    return this.socket.fromEvent("reconnect").pipe();
+  }
   
   describePod(podName: string, namespace: string): Observable<Object> {
     const url = `/api/describe_pod/${podName}/${namespace}`
@@ -1,7 +1,7 @@
 import { Injectable } from '@angular/core';
-import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { Observable, of } from 'rxjs';
-import { catchError, map, tap } from 'rxjs/operators';
+import { HttpClient, HttpHeaders, HttpEventType } from '@angular/common/http';
+import { Observable, of, from } from 'rxjs';
+import { catchError, map, tap, filter, mergeMap } from 'rxjs/operators';
 import { HTTP_OPTIONS } from './globals';
 
 
@@ -37,15 +37,48 @@ export class KickstartService {
     return this.http.get(url).pipe();
   }
 
-  gatherDeviceFacts(management_ip: string): Observable<Object> {
+  gatherDeviceFacts(management_ip: string, refresh: boolean = false): Observable<Object> {
     const url = '/api/gather_device_facts';
-    let post_payload = {"management_ip": management_ip};
+    let post_payload = {"management_ip": management_ip, "refresh": refresh};
     return this.http.post(url, post_payload , HTTP_OPTIONS).pipe(
       tap(data => this.mapDeviceFacts(data)),
       catchError(this.handleError('gatherDeviceFacts'))
     );
   }
 
+  /**
+   * Gathers the device facts of many nodes with one request.  The server streams
+   * back one json line per node as soon as its facts are in so each node is
+   * emitted individually instead of waiting on the slowest node.
+   * @param management_ips - the management ips of the nodes
+   * @param refresh - gather the facts again instead of using the cached facts
+   */
+  gatherDeviceFactsBatch(management_ips: Array<string>, refresh: boolean = false): Observable<Object> {
+    const url = '/api/gather_device_facts_batch';
+    let post_payload = {"management_ips": management_ips, "refresh": refresh};
+    let parsedLength = 0;
+    return this.http.post(url, post_payload, {
+      headers: HTTP_OPTIONS.headers,
+      observe: 'events',
+      reportProgress: true,
+      responseType: 'text'
+    }).pipe(
+      filter(event => event.type === HttpEventType.DownloadProgress || event.type === HttpEventType.Response),
+      mergeMap(event => {
+        let text = event.type === HttpEventType.Response ? event['body'] : event['partialText'];
+        let lastNewLine = text ? text.lastIndexOf('\n') : -1;
+        if (lastNewLine < parsedLength) {
+          return from([]);
+        }
+        let lines = text.substring(parsedLength, lastNewLine).split('\n').filter(line => line.length > 0);
+        parsedLength = lastNewLine + 1;
+        return from(lines.map(line => JSON.parse(line)));
+      }),
+      tap(data => this.mapDeviceFacts(data)),
+      catchError(this.handleError('gatherDeviceFactsBatch'))
+    );
+  }
+
   generateKickstartInventory(kickStartForm: Object){
     const url = '/api/generate_kickstart_inventory';    
     
@@ -244,7 +244,10 @@ export class KitFormComponent implements OnInit, AfterViewInit{
     const payload = {'kitForm': this.kitForm.getRawValue(), 'nodesToAdd': this.addNodeCache};
     this.kitSrv.executeAddNode(payload)
     .subscribe(data => {
-      this.openConsole();
+      // Every added node has its own job, the console of the first one is opened.
+      if (data && data['job_names'] && data['job_names'].length > 0) {
+        this.openConsole(data['job_names'][0]);
+      }
       this.addNodeCache = new Array();
     });    
   }
@@ -258,8 +261,8 @@ export class KitFormComponent implements OnInit, AfterViewInit{
     });
   }
 
-  openConsole(){
-    this.router.navigate(['/stdout/Kit']);
+  openConsole(jobName: string='Kit'){
+    this.router.navigate(['/stdout/' + jobName]);
   }
 
   private appendNode(node: Object, disableIsKubernetesMasterCheckbox: boolean=false){
@@ -426,28 +429,52 @@ export class KitFormComponent implements OnInit, AfterViewInit{
     if (node instanceof SensorFormGroup) {
       host_key = "host_sensor";
     }
-    this.kickStartSrv.gatherDeviceFacts(node.value[host_key])
+    this.kickStartSrv.gatherDeviceFacts(node.value[host_key], true)
     .subscribe(data => {
       this._gatherFacts(node, data, host_key);
     });
   }
 
   private gatherAllFacts(){
+    let nodes = {};
+    let management_ips = [];
+    let addNode = (node: ServerFormGroup | SensorFormGroup, host_key: string) => {
+      let management_ip = node.value[host_key];
+      if (!nodes[management_ip]){
+        nodes[management_ip] = [];
+        management_ips.push(management_ip);
+      }
+      nodes[management_ip].push({node: node, host_key: host_key});
+    };
+
     for (let i = 0; i < this.kitForm.sensors.length; i++){
-      let host_key = "host_sensor";
-      let node = this.kitForm.sensors.at(i) as SensorFormGroup;
-      this.kickStartSrv.gatherDeviceFacts(node.value[host_key]).subscribe(data => {        
-        this._gatherFacts(node, data, host_key);
-      });      
+      addNode(this.kitForm.sensors.at(i) as SensorFormGroup, "host_sensor");
     }
-    
+
     for (let i = 0; i < this.kitForm.servers.length; i++){
-      let host_key = "host_server";
-      let node = this.kitForm.servers.at(i) as ServerFormGroup;
-      this.kickStartSrv.gatherDeviceFacts(node.value[host_key]).subscribe(data => {
-        this._gatherFacts(node, data, host_key);
-      });      
+      addNode(this.kitForm.servers.at(i) as ServerFormGroup, "host_server");
+    }
+
+    if (management_ips.length === 0){
+      return;
     }
+
+    this.kickStartSrv.gatherDeviceFactsBatch(management_ips).subscribe(data => {
+      if (data === undefined || data === null){
+        return;
+      }
+
+      let targets = nodes[data['management_ip']];
+      if (!targets){
+        // An error that is not tied to a specific node.
+        this._gatherFacts(undefined, data, undefined);
+        return;
+      }
+
+      for (let target of targets){
+        this._gatherFacts(target.node, data, target.host_key);
+      }
+    });
   }
 
   toggleAdvancedSettings(){
@@ -9,6 +9,8 @@ import { Title } from '@angular/platform-browser';
 })
 export class PortalComponent implements OnInit {  
   links: Array<{ip: string, dns: string, logins: string}>;
+  refreshedAt: Date;
+  isDefault: boolean;
 
   constructor(private portalSrv: PortalService, private title: Title) { 
     this.links = new Array();
@@ -17,8 +19,10 @@ export class PortalComponent implements OnInit {
   ngOnInit() {
     this.title.setTitle("Portal");
     this.portalSrv.getPortalLinks().subscribe(data => {
-      let portalLinks = data as Array<{ip: string, dns: string, logins: string}>;
+      let portalLinks = data['links'] as Array<{ip: string, dns: string, logins: string}>;
       this.links = portalLinks;
+      this.isDefault = data['is_default'];
+      this.refreshedAt = data['refreshed_at'] ? new Date(data['refreshed_at'] + 'Z') : null;
     });
   }
 
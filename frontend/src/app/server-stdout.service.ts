@@ -38,11 +38,47 @@ export class ServerStdoutService {
     return this.socket.fromEvent("message").pipe();
   }
 
+  getMessages(){
+    return this.socket.fromEvent("messages").pipe();
+  }
+
+  onReconnect(){
+    return this.socket.fromEvent("reconnect").pipe();
+  }
+
+  /**
+   * Subscribes to the console output of a job.
+   * @param jobName
+   * @param joined - Called once the server has added us to the jobs room.
+   */
+  joinJob(jobName: string, joined: () => void){
+    this.socket.emit("join_job", jobName, joined);
+  }
+
+  leaveJob(jobName: string){
+    this.socket.emit("leave_job", jobName);
+  }
+
   getConsoleOutput(jobName: string){
     const url = `/api/get_console_logs/${jobName}`;
     return this.http.get(url).pipe();
   }
 
+  getConsoleTail(jobName: string, lines: number){
+    const url = `/api/get_console_logs/${jobName}?tail=${lines}`;
+    return this.http.get(url).pipe();
+  }
+
+  getConsoleOutputAfter(jobName: string, seq: number){
+    const url = `/api/get_console_logs/${jobName}?after=${seq}`;
+    return this.http.get(url).pipe();
+  }
+
+  getConsoleOutputBefore(jobName: string, seq: number, limit: number){
+    const url = `/api/get_console_logs/${jobName}?before=${seq}&limit=${limit}`;
+    return this.http.get(url).pipe();
+  }
+
   removeConsoleOutput(id_obj: {jobName: string, jobid: string}){
     const url = '/api/remove_console_output';
     return this.http.post(url, id_obj);
@@ -1,15 +1,18 @@
-import { Component, OnInit, ViewChild, ElementRef, HostListener } from '@angular/core';
+import { Component, OnInit, OnDestroy, ViewChild, ElementRef, HostListener } from '@angular/core';
+import { Subscription } from 'rxjs';
 import { ServerStdoutService } from '../server-stdout.service';
 import { ActivatedRoute } from '@angular/router';
 import { Title } from '@angular/platform-browser';
 import { HtmlModalPopUp } from '../html-elements';
 
+const CONSOLE_PAGE_SIZE = 1000;
+
 @Component({
   selector: 'app-server-stdout',
   templateUrl: './server-stdout.component.html',
   styleUrls: ['./server-stdout.component.css']
 })
-export class ServerStdoutComponent implements OnInit {
+export class ServerStdoutComponent implements OnInit, OnDestroy {
 
   @ViewChild('console')
   private consoleDiv: ElementRef;
@@ -17,6 +20,13 @@ export class ServerStdoutComponent implements OnInit {
   killModal: HtmlModalPopUp;
 
   messages: Array<{msg: string, color: string}>;
+  hasOlderMessages: boolean;
+  private oldestSeq: number;
+  private lastSeq: number;
+  // Live batches that arrive while we are fetching what we missed.  Null when we are caught up.
+  private pendingBatches: Array<Array<Object>>;
+  private subscriptions: Array<Subscription>;
+
   constructor(private stdoutService: ServerStdoutService, 
               private route: ActivatedRoute,
               private title: Title
@@ -24,6 +34,11 @@ export class ServerStdoutComponent implements OnInit {
     this.title.setTitle("Console Output");
     this.messages = new Array<{msg: string, color: string}>();
     this.jobName = null;
+    this.hasOlderMessages = false;
+    this.oldestSeq = null;
+    this.lastSeq = null;
+    this.pendingBatches = null;
+    this.subscriptions = [];
     this.killModal = new HtmlModalPopUp('kill_modal');
   }
 
@@ -38,32 +53,106 @@ export class ServerStdoutComponent implements OnInit {
   }
 
   ngOnInit() {
-    this.route.params.subscribe(params => {
+    this.subscriptions.push(this.route.params.subscribe(params => {
+      if (this.jobName) {
+        this.stdoutService.leaveJob(this.jobName);
+      }
       this.jobName = params['id'];
+      this.messages = new Array<{msg: string, color: string}>();
+      this.oldestSeq = null;
+      this.lastSeq = null;
+      this.joinJob();
+    }));
+
+    this.subscriptions.push(this.stdoutService.getMessages().subscribe(data => {
+      if (this.pendingBatches !== null) {
+        this.pendingBatches.push(data as Array<Object>);
+        return;
+      }
+      this.appendMessages(data as Array<Object>);
+      this.scrollToBottom();
+    }));
+
+    // The server forgets our rooms when we disconnect so join again and fetch what we missed.
+    this.subscriptions.push(this.stdoutService.onReconnect().subscribe(() => {
+      this.joinJob();
+    }));
+  }
 
-      this.stdoutService.getConsoleOutput(this.jobName).subscribe(data => {
-        for (let item in data){          
-          this.messages.push({msg: data[item]['log'], color: data[item]['color']});
+  ngOnDestroy() {
+    if (this.jobName) {
+      this.stdoutService.leaveJob(this.jobName);
+    }
+    for (let subscription of this.subscriptions) {
+      subscription.unsubscribe();
+    }
+  }
+
+  /**
+   * Joins the jobs room and then loads the tail of the console, or only the lines after
+   * the last one we have seen if we are resuming.  Live batches are held back until then.
+   */
+  private joinJob(){
+    this.pendingBatches = [];
+    this.stdoutService.joinJob(this.jobName, () => {
+      let isResuming = this.lastSeq !== null;
+      let request = isResuming ? this.stdoutService.getConsoleOutputAfter(this.jobName, this.lastSeq) :
+                                 this.stdoutService.getConsoleTail(this.jobName, CONSOLE_PAGE_SIZE);
+      request.subscribe(data => {
+        let logs = data as Array<Object>;
+        if (!isResuming) {
+          this.setOldestSeq(logs);
+        }
+        this.appendMessages(logs);
+        for (let batch of this.pendingBatches) {
+          this.appendMessages(batch);
         }
+        this.pendingBatches = null;
 
-        setTimeout(() => {          
+        setTimeout(() => {
           this.scrollToBottom();
         }, 1000);
-        
-      });  
+      });
     });
-    
-    this.stdoutService.getMessage().subscribe(data => {
-      this.messages.push({msg: data['log'], color: data['color']});
-      this.scrollToBottom();
-    });
-    
+  }
+
+  private appendMessages(logs: Array<Object>){
+    for (let item of logs){
+      let seq = item['seq'];
+      if (seq !== undefined && this.lastSeq !== null && seq <= this.lastSeq) {
+        continue;
+      }
+      this.messages.push({msg: item['log'], color: item['color']});
+      if (seq !== undefined) {
+        this.lastSeq = seq;
+      }
+    }
   }
 
   ngAfterViewInit(){
     this.resizeConsole();
   }
 
+  private setOldestSeq(logs: Array<Object>){
+    this.hasOlderMessages = logs.length === CONSOLE_PAGE_SIZE && logs[0]['seq'] !== undefined;
+    if (logs.length > 0) {
+      this.oldestSeq = logs[0]['seq'];
+    }
+  }
+
+  loadOlderMessages(){
+    if (this.oldestSeq === null){
+      return;
+    }
+
+    this.stdoutService.getConsoleOutputBefore(this.jobName, this.oldestSeq, CONSOLE_PAGE_SIZE).subscribe(data => {
+      let logs = data as Array<Object>;
+      let olderMessages = logs.map(item => ({msg: item['log'], color: item['color']}));
+      this.messages = olderMessages.concat(this.messages);
+      this.setOldestSeq(logs);
+    });
+  }
+
   public scrollToBottom(){
     this.consoleDiv.nativeElement.scrollTop = this.consoleDiv.nativeElement.scrollHeight;    
   }
@@ -85,6 +174,10 @@ export class ServerStdoutComponent implements OnInit {
 
   clearConsole() {
     this.messages = new Array<{msg: string, color: string}>();
+    this.hasOlderMessages = false;
+    this.oldestSeq = null;
+    // The sequence numbers restart at 1 once the backend restarts with an empty console.
+    this.lastSeq = null;
     this.stdoutService.removeConsoleOutput({jobName: this.jobName, jobid: "Not Implemented"}).subscribe();
   }
 
@@ -1,4 +1,5 @@
-import { Component, OnInit } from '@angular/core';
+import { Component, OnInit, OnDestroy } from '@angular/core';
+import { Subscription, forkJoin } from 'rxjs';
 import { HealthServiceService } from '../health-service.service';
 import { Title } from '@angular/platform-browser';
 import { Router } from '@angular/router';
@@ -11,36 +12,116 @@ declare var $: any;
   templateUrl: './system-health.component.html',
   styleUrls: ['./system-health.component.css']
 })
-export class SystemHealthComponent implements OnInit {
+export class SystemHealthComponent implements OnInit, OnDestroy {
   podsStatuses: Array<Object>;
   nodeStatuses: Array<Object>;
   podDescribeModal: HtmlModalPopUp;
   activeIPAddress: string;
+  private versions: Object;
+  // Changes that arrive while the statuses are being fetched.
+  private pendingChanges: Array<Object>;
+  private subscriptions: Array<Subscription>;
 
   constructor(private title: Title, private healthSrv: HealthServiceService, private router: Router) { 
     this.podDescribeModal = new HtmlModalPopUp('pod_describe');
     this.activeIPAddress = "";
+    this.versions = {pods: null, nodes: null};
+    this.pendingChanges = null;
+    this.subscriptions = [];
   }
 
   ngOnInit() {
     this.title.setTitle("System Health");
 
-    this.healthSrv.getPodsStatuses().subscribe(data => {
-      this.podsStatuses = data as Array<Object>;
-    });
-
-    this.healthSrv.getNodeStatuses().subscribe(data => {
-      this.nodeStatuses = data as Array<Object>;
-      if (this.nodeStatuses && this.nodeStatuses.length > 0) {
-        this.activeIPAddress = this.nodeStatuses[0]['metadata']['public_ip'];        
+    this.subscriptions.push(this.healthSrv.getStatusChanges().subscribe(data => {
+      if (this.pendingChanges !== null) {
+        this.pendingChanges.push(data);
+        return;
       }
-    });
+      this.applyChanges(data);
+    }));
+
+    // The server forgets our rooms when we disconnect so join again and fetch what we missed.
+    this.subscriptions.push(this.healthSrv.onReconnect().subscribe(() => {
+      this.joinHealth();
+    }));
+
+    this.joinHealth();
 
     setTimeout(() => {
       this.updateTooltips();
     }, 2000);
   }
 
+  ngOnDestroy() {
+    this.healthSrv.leaveHealth();
+    for (let subscription of this.subscriptions) {
+      subscription.unsubscribe();
+    }
+  }
+
+  /**
+   * Joins the health room and then fetches the pods and nodes.  Changes pushed while
+   * fetching are applied afterwards if they are newer than what was fetched.
+   */
+  private joinHealth() {
+    this.pendingChanges = [];
+    this.healthSrv.joinHealth(() => {
+      forkJoin(this.healthSrv.getPodsStatusesSince(0), this.healthSrv.getNodeStatusesSince(0)).subscribe(([pods, nodes]) => {
+        this.podsStatuses = pods['items'] as Array<Object>;
+        this.versions['pods'] = pods['version'];
+        this.nodeStatuses = nodes['items'] as Array<Object>;
+        this.versions['nodes'] = nodes['version'];
+        if (this.nodeStatuses && this.nodeStatuses.length > 0 && !this.activeIPAddress) {
+          this.activeIPAddress = this.nodeStatuses[0]['metadata']['public_ip'];
+        }
+
+        let pendingChanges = this.pendingChanges;
+        this.pendingChanges = null;
+        for (let changes of pendingChanges) {
+          this.applyChanges(changes);
+        }
+      });
+    });
+  }
+
+  /**
+   * Applies a batch of pushed changes to the pods or nodes.  A change only carries the
+   * fields this page shows so they are merged into the object we already have.
+   * @param data - {kind: 'pods', version: 1, changes: [{type: 'MODIFIED', namespace: '', name: '', object: {}}]}
+   */
+  private applyChanges(data: Object) {
+    let kind = data['kind'];
+    let version = this.versions[kind];
+    if (version !== null && version !== undefined && data['version'] <= version) {
+      return;
+    }
+
+    let items = (kind === 'pods' ? this.podsStatuses : this.nodeStatuses) || [];
+    for (let change of data['changes']) {
+      let index = items.findIndex(item => item['metadata']['name'] === change['name'] &&
+                                          (item['metadata']['namespace'] || '') === change['namespace']);
+      if (change['type'] === 'DELETED') {
+        if (index !== -1) {
+          items.splice(index, 1);
+        }
+      } else if (index === -1) {
+        items.push(change['object']);
+      } else {
+        for (let key in change['object']) {
+          items[index][key] = Object.assign(items[index][key] || {}, change['object'][key]);
+        }
+      }
+    }
+    this.versions[kind] = data['version'];
+
+    if (kind === 'pods') {
+      this.podsStatuses = items.slice();
+    } else {
+      this.nodeStatuses = items.slice();
+    }
+  }
+
   setActiveIp(ipAddress: string){
     if (ipAddress) {
       this.activeIPAddress = ipAddress;